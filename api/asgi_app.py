@@ -0,0 +1,210 @@
+# Modo de servidor asíncrono (ASGI). Se arranca con:
+#     uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+# /start y /chat se atienden en el event loop con AsyncOpenAI, de modo que un
+# run de 10-60 s no ocupa un hilo. El resto de rutas son las de la app Flask
+# (main.app), montada tal cual: mismas URLs y mismos JSON.
+import asyncio
+import os
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import main
+from openai_client import async_client
+from context_budget import context_budget, usage_of
+from embedding_pipeline import get_local_retrieval, is_local_session
+from file_ingestion import ingest_files_async
+from instrumentation import span, log, start_trace, finish_trace, set_thread_id
+from run_scheduler import run_scheduler
+from session_pool import session_pool
+from session_reaper import session_reaper
+from text_preprocessing import remove_temporary_files
+from upload_streaming import UploadTooLarge, UPLOAD_MAX_REQUEST_BYTES, close_uploads
+
+# Hilos para la parte síncrona (disco, FAISS, ediciones del documento)
+ASYNC_WSGI_WORKERS = int(os.environ.get('ASYNC_WSGI_WORKERS', '10'))
+
+
+def _json(payload, status_code=200):
+    # Mismas cabeceras CORS que Flask-CORS para las rutas servidas aquí
+    return JSONResponse(payload, status_code=status_code, headers={"Access-Control-Allow-Origin": "*"})
+
+
+def _traced(route):
+    """
+    Traza de la petición (mismas métricas y logs que las rutas de Flask).
+    """
+    def decorator(handler):
+        async def wrapper(request):
+            trace = start_trace(route, request.query_params.get('thread_id'))
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                finish_trace(trace, status)
+        return wrapper
+    return decorator
+
+
+async def _ingest_uploads(uploaded_files, vector_store_id):
+    spooled_files = await asyncio.to_thread(main.spool_request_uploads, uploaded_files)
+    temporary_files = []
+    try:
+        saved_files, temporary_files, preprocessing_report, hashes = await asyncio.to_thread(
+            main.preprocess_uploads, spooled_files, vector_store_id)
+        if is_local_session(vector_store_id):
+            report = await asyncio.to_thread(get_local_retrieval(main.client).ingest_files, vector_store_id, saved_files)
+        else:
+            with span("ingestion", files=len(saved_files)):
+                report = await ingest_files_async(async_client, vector_store_id, saved_files)
+        main.record_preprocessed(vector_store_id, hashes, report)
+    finally:
+        remove_temporary_files(temporary_files)
+        close_uploads(spooled_files)
+
+    if preprocessing_report is not None:
+        report["preprocessing"] = preprocessing_report
+    return report["file_ids"], report
+
+
+@_traced('/start')
+async def start_conversation(request):
+    """
+    Igual que GET /start en main.py, creando la sesión con AsyncOpenAI si el
+    pool está vacío.
+    """
+    with span("session.acquire"):
+        thread_id, assistant_id, vector_store_id = await session_pool.acquire_async(async_client)
+    set_thread_id(thread_id)
+    log("session.started", thread_id=thread_id, assistant_id=assistant_id, vector_store_id=vector_store_id)
+
+    return _json({
+        "thread_id": thread_id,
+        "assistant_id": assistant_id,
+        "vector_store_id": vector_store_id
+    })
+
+
+@_traced('/chat')
+async def chat(request):
+    """
+    Igual que POST /chat en main.py (mismos parámetros y misma respuesta), con
+    la ingesta de archivos y el poll del run hechos de forma asíncrona.
+    """
+    if int(request.headers.get('content-length') or 0) > UPLOAD_MAX_REQUEST_BYTES:
+        log("upload.too_large", limit=UPLOAD_MAX_REQUEST_BYTES)
+        return _json({"error": f"Uploads exceed the limit of {UPLOAD_MAX_REQUEST_BYTES} bytes per request"}, 413)
+    form = await request.form()
+    thread_id = form.get('thread_id')
+    assistant_id = form.get('assistant_id')
+    vector_store_id = form.get('vector_store_id')
+    user_input = form.get('message', '')
+    set_thread_id(thread_id)
+
+    if not thread_id or not assistant_id or not vector_store_id:
+        log("chat.missing_ids")
+        return _json({"error": "Missing required IDs"}, 400)
+
+    uploaded_files = [file for file in form.getlist('files') if getattr(file, 'filename', None)]
+    try:
+        files_info, ingestion_report = await _ingest_uploads(uploaded_files, vector_store_id)
+    except UploadTooLarge:
+        log("upload.too_large", limit=UPLOAD_MAX_REQUEST_BYTES)
+        return _json({"error": f"Uploads exceed the limit of {UPLOAD_MAX_REQUEST_BYTES} bytes per request"}, 413)
+    session_reaper.track_files(thread_id, files_info)
+
+    log("chat.received", thread_id=thread_id, assistant_id=assistant_id, message_length=len(user_input))
+
+    # Un run por thread: si ya hay uno en marcha, el mensaje va en el siguiente lote
+    outcome = await run_scheduler.run_async(
+        thread_id, assistant_id, user_input, files_info,
+        lambda batch: _run_chat_batch(batch, thread_id, assistant_id, vector_store_id)
+    )
+
+    if outcome["status"] == 'completed':
+        log("chat.completed", response_length=len(outcome["response"]))
+        result = {"response": outcome["response"]}
+        if uploaded_files:
+            result["ingestion"] = ingestion_report
+        return _json(result)
+
+    log("chat.run_not_completed", status=outcome["status"])
+    result = {"error": "Run did not complete successfully"}
+    if uploaded_files:
+        result["ingestion"] = ingestion_report
+    return _json(result, 500)
+
+
+async def _run_chat_batch(batch, thread_id, assistant_id, vector_store_id):
+    """
+    Versión asíncrona de main.run_chat_batch.
+    """
+    for queued in batch:
+        if queued.sent:
+            continue
+        with span("openai.messages.create"):
+            await async_client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=queued.content,
+                attachments=[
+                    {"file_id": fid, "tools": [{"type": "file_search"}]}
+                    for fid in queued.file_ids
+                ]
+            )
+        queued.sent = True
+    if len(batch) > 1:
+        log("chat.batched", messages=len(batch))
+
+    clock = run_scheduler.clock()
+    with span("openai.runs.create_and_poll"):
+        run_options = await asyncio.to_thread(context_budget.run_options, thread_id)
+        run = await async_client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            **run_options
+        )
+        run = await run_scheduler.poll_async(async_client, thread_id, run, clock)
+
+    if run.status == 'requires_action':
+        log("chat.requires_action", tool_calls=len(run.required_action.submit_tool_outputs.tool_calls))
+        # Las ediciones del documento tocan disco: van a un hilo, la compilación al scheduler
+        tool_outputs = await asyncio.to_thread(
+            main.execute_tool_calls, run.required_action.submit_tool_outputs.tool_calls,
+            thread_id, vector_store_id)
+
+        if tool_outputs:
+            try:
+                with span("openai.runs.submit_tool_outputs_and_poll"):
+                    run = await async_client.beta.threads.runs.submit_tool_outputs(
+                        thread_id=thread_id,
+                        run_id=run.id,
+                        tool_outputs=tool_outputs
+                    )
+                    run = await run_scheduler.poll_async(async_client, thread_id, run, clock)
+                log("chat.tool_outputs_submitted")
+            except Exception as e:
+                log("chat.tool_outputs_failed", error=str(e))
+
+    usage = usage_of(run)
+    # El resumen (si toca) se hace en un hilo de fondo con el cliente síncrono
+    context_budget.record(main.client, thread_id, assistant_id, usage)
+    log("chat.usage", **(usage or {}))
+
+    response_text = None
+    if run.status == 'completed':
+        with span("openai.messages.list"):
+            messages = await async_client.beta.threads.messages.list(thread_id=thread_id)
+        response_text = main.find_assistant_response(messages.data)
+    return {"status": run.status, "response": response_text}
+
+
+app = Starlette(routes=[
+    Route('/start', start_conversation, methods=['GET']),
+    Route('/chat', chat, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(main.app, workers=ASYNC_WSGI_WORKERS)),
+])
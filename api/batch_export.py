@@ -0,0 +1,178 @@
+# Exportación en lote de los PDFs de generatedDocuments/, sin pasar por la API
+# (p. ej. después de cambiar la plantilla). Desde la carpeta api/:
+#     python batch_export.py                          # todos los documentos desactualizados
+#     python batch_export.py --workers 8 thread_abc thread_def
+#     python batch_export.py --force --report batchExports/plantilla-v2.json
+# Cada documento se compila con latex_compiler.compile_document en un proceso
+# de un pool (uno por núcleo por defecto) y se publica igual que desde
+# /compile, así que se puede lanzar con la API en marcha. Se saltan los
+# documentos cuyo PDF publicado ya corresponde al fuente actual.
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from instrumentation import log
+
+# Líneas finales del log de pdflatex que se guardan en el informe de un fallo
+_LOG_TAIL_CHARS = 2000
+
+
+def prepare_environment(tex_binary: str = None):
+    """
+    Variables de entorno que leen latex_compiler y tex_engine al importarse;
+    los procesos del pool las heredan.
+    """
+    load_dotenv('.env')
+    if tex_binary:
+        os.environ['TEX_BINARY'] = tex_binary
+    # Cada proceso del pool ya es un worker: pdflatex se lanza directamente desde él
+    os.environ['TEX_WORKERS'] = '0'
+
+
+def list_documents(thread_ids: list = None) -> list:
+    """
+    thread_ids con .tex en generatedDocuments/ (todos, o los indicados que existan).
+    """
+    from document_model import GENERATED_DOCUMENTS_DIR, document_path
+    if thread_ids:
+        return [thread_id for thread_id in thread_ids if os.path.exists(document_path(thread_id))]
+    return sorted(name[:-4] for name in os.listdir(GENERATED_DOCUMENTS_DIR) if name.endswith(".tex"))
+
+
+def is_current(thread_id: str) -> bool:
+    """
+    True si el PDF publicado del thread se compiló a partir del fuente actual
+    (mismo build_hash que usaría compile_document).
+    """
+    from build_cache import build_cache
+    from document_model import document_path
+    from latex_compiler import published_pdf
+    from tex_engine import tex_engine
+
+    published = published_pdf(thread_id)
+    if published is None:
+        return False
+    with open(document_path(thread_id), 'rb') as f:
+        return published[1] == build_cache.key_for(f.read(), tex_engine.build_id())
+
+
+def export_document(thread_id: str) -> dict:
+    """
+    Compila y publica un documento (en un proceso del pool). Nunca lanza:
+    los errores se devuelven en el resultado.
+    """
+    from latex_compiler import CompileError, compile_document
+
+    started = time.perf_counter()
+    result = {"thread_id": thread_id}
+    try:
+        build = compile_document(thread_id)
+        result.update(status="cached" if build["cache_hit"] else "compiled",
+                      build_hash=build["build_hash"], timings=build["timings"])
+    except CompileError as e:
+        result.update(status="failed", error=str(e), log=(e.stdout + e.stderr)[-_LOG_TAIL_CHARS:])
+    except Exception as e:
+        result.update(status="failed", error=f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _prepare_format():
+    """
+    Genera en este proceso el formato del preámbulo antes de repartir el
+    trabajo, para que los procesos del pool no lo construyan a la vez.
+    """
+    from tex_engine import tex_engine
+    if tex_engine.format is not None:
+        tex_engine.format.ensure(tex_engine.pool)
+
+
+def export_documents(thread_ids: list, workers: int, force: bool = False) -> dict:
+    """
+    Exporta los documentos en paralelo y devuelve el informe. El progreso se
+    registra (log) a medida que termina cada documento.
+    """
+    from document_model import document_path
+    from tex_engine import tex_engine
+
+    started_at = datetime.datetime.now()
+    started = time.perf_counter()
+    results = []
+    pending = []
+    for thread_id in thread_ids:
+        if not force and is_current(thread_id):
+            results.append({"thread_id": thread_id, "status": "skipped", "seconds": 0.0})
+        else:
+            pending.append(thread_id)
+    log("batch_export.started", documents=len(thread_ids), pending=len(pending),
+        current=len(thread_ids) - len(pending), workers=workers, compiler=tex_engine.tex_binary)
+
+    if pending:
+        _prepare_format()
+        # Los más grandes primero: el último en terminar no es uno largo que empezó tarde
+        pending.sort(key=lambda thread_id: os.path.getsize(document_path(thread_id)), reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(export_document, thread_id) for thread_id in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                results.append(result)
+                log("batch_export.document", done=done, pending=len(pending), thread_id=result["thread_id"],
+                    status=result["status"], seconds=result["seconds"], error=result.get("error"))
+
+    wall_seconds = time.perf_counter() - started
+    counts = {status: sum(1 for result in results if result["status"] == status)
+              for status in ("compiled", "cached", "skipped", "failed")}
+    build_seconds = sum(result["seconds"] for result in results)
+    return {
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "wall_seconds": round(wall_seconds, 3),
+        "build_seconds": round(build_seconds, 3),
+        # Builds en paralelo de media (cercano a 'workers' si el pool estuvo ocupado)
+        "parallelism": round(build_seconds / wall_seconds, 2) if wall_seconds else None,
+        "workers": workers,
+        "compiler": tex_engine.tex_binary,
+        "documents": len(results),
+        **counts,
+        "failures": [result for result in results if result["status"] == "failed"],
+        "results": sorted(results, key=lambda result: result["thread_id"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile and publish the PDFs of many documents in parallel")
+    parser.add_argument("thread_ids", nargs="*", help="documents to export (default: all in generatedDocuments/)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="compile processes")
+    parser.add_argument("--force", action="store_true", help="recompile documents whose PDF is already current")
+    parser.add_argument("--tex-binary", help="pdflatex executable (default: TEX_BINARY)")
+    parser.add_argument("--report", help="JSON report path (default: batchExports/export-<date>.json)")
+    args = parser.parse_args()
+
+    prepare_environment(args.tex_binary)
+    thread_ids = list_documents(args.thread_ids)
+    missing = sorted(set(args.thread_ids) - set(thread_ids))
+    if missing:
+        log("batch_export.missing", thread_ids=missing)
+
+    report = export_documents(thread_ids, max(1, args.workers), args.force)
+    report["missing"] = missing
+
+    report_path = args.report or os.path.join(
+        "batchExports", f"export-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    log("batch_export.finished", compiled=report["compiled"], cached=report["cached"], skipped=report["skipped"],
+        failed=report["failed"], wall_seconds=report["wall_seconds"], parallelism=report["parallelism"],
+        report=report_path)
+    return 1 if report["failed"] or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
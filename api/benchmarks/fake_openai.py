@@ -0,0 +1,523 @@
+# Servidor local que imita los endpoints de OpenAI que usa la API (assistants,
+# threads, messages, runs, chat completions, files y vector stores), con
+# latencias configurables y un guion de tool calls para los runs (también en
+# streaming, con eventos Server-Sent Events como los de la API real). Se usa
+# desde run_benchmarks.py, o suelto para pruebas manuales:
+#     python -m benchmarks.fake_openai --port 8765
+#     OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python main.py
+import argparse
+import collections
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Latencias por defecto (segundos) de cada tipo de operación
+DEFAULT_LATENCIES = {
+    "default": 0.02,        # creaciones, borrados y lecturas sencillas
+    "files.create": 0.1,    # subida de un archivo
+    "batch.index": 0.3,     # tiempo hasta que un file batch queda indexado
+    "run": 1.0,             # cada paso de un run (hasta pedir tool calls o completar)
+}
+# Guion por defecto: cada run pide una modificación del documento y luego responde
+DEFAULT_TOOL_SCRIPT = [
+    [{"name": "modify_document",
+      "arguments": {"Section": "PURPOSE", "Content": "Benchmark purpose text."}}],
+]
+DEFAULT_REPLY = "Listo, he actualizado el documento."
+# Intervalo de poll que se sugiere al SDK (cabecera openai-poll-after-ms)
+DEFAULT_POLL_MS = 50
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+class FakeOpenAIState:
+    """
+    Estado en memoria de los objetos creados. Los runs avanzan de forma
+    perezosa: su estado se recalcula en cada consulta según el tiempo pasado.
+    """
+
+    def __init__(self, latencies: dict, tool_script: list, reply: str, poll_ms: int):
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.tool_script = tool_script if tool_script is not None else DEFAULT_TOOL_SCRIPT
+        self.reply = reply
+        self.poll_ms = poll_ms
+        self.lock = threading.Lock()
+        self.assistants = {}
+        self.threads = {}     # thread_id -> {"thread", "messages", "runs"}
+        self.vector_stores = {}
+        self.files = {}
+        self.batches = {}
+        self.calls = collections.Counter()
+
+    def latency(self, name: str) -> float:
+        return self.latencies.get(name, self.latencies["default"])
+
+    # ---- runs -------------------------------------------------------------
+
+    def advance_run(self, run: dict):
+        now = time.time()
+        if run["status"] not in ("queued", "in_progress"):
+            return
+        if now - run["_step_started"] < self.latency("run"):
+            run["status"] = "in_progress"
+            return
+        if run["_round"] < len(self.tool_script):
+            run["status"] = "requires_action"
+            run["required_action"] = {
+                "type": "submit_tool_outputs",
+                "submit_tool_outputs": {"tool_calls": [
+                    {"id": _new_id("call"), "type": "function",
+                     "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])}}
+                    for call in self.tool_script[run["_round"]]
+                ]},
+            }
+            return
+        run["status"] = "completed"
+        run["completed_at"] = int(now)
+        run["required_action"] = None
+        run["usage"] = self.estimate_usage(run)
+        self.add_message(run["thread_id"], "assistant", self.reply, run["assistant_id"], run["id"])
+
+    def estimate_usage(self, run: dict) -> dict:
+        """
+        Tokens aproximados (4 caracteres por token) de los mensajes que vería
+        el run, respetando truncation_strategy=last_messages.
+        """
+        messages = self.threads[run["thread_id"]]["messages"]
+        truncation = run.get("truncation_strategy") or {}
+        if truncation.get("type") == "last_messages" and truncation.get("last_messages"):
+            messages = messages[-truncation["last_messages"]:]
+        prompt = 500 + sum(len(part["text"]["value"]) for message in messages
+                           for part in message["content"]) // 4
+        if run.get("max_prompt_tokens"):
+            prompt = min(prompt, run["max_prompt_tokens"])
+        completion = max(1, len(self.reply) // 4)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def add_message(self, thread_id: str, role: str, content: str, assistant_id=None, run_id=None) -> dict:
+        message = {
+            "id": _new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "status": "completed",
+            "content": [{"type": "text", "text": {"value": content, "annotations": []}}],
+            "assistant_id": assistant_id,
+            "run_id": run_id,
+            "attachments": [],
+            "metadata": {},
+        }
+        self.threads[thread_id]["messages"].append(message)
+        return message
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenAI/1.0"
+
+    # (método, patrón de ruta) -> nombre del manejador
+    ROUTES = [
+        ("POST", r"/v1/assistants", "create_assistant"),
+        ("GET", r"/v1/assistants", "list_assistants"),
+        ("DELETE", r"/v1/assistants/(?P<assistant_id>[^/]+)", "delete_assistant"),
+        ("POST", r"/v1/threads", "create_thread"),
+        ("DELETE", r"/v1/threads/(?P<thread_id>[^/]+)", "delete_thread"),
+        ("POST", r"/v1/threads/(?P<thread_id>[^/]+)/messages", "create_message"),
+        ("GET", r"/v1/threads/(?P<thread_id>[^/]+)/messages", "list_messages"),
+        ("DELETE", r"/v1/threads/(?P<thread_id>[^/]+)/messages/(?P<message_id>[^/]+)", "delete_message"),
+        ("POST", r"/v1/threads/(?P<thread_id>[^/]+)/runs", "create_run"),
+        ("GET", r"/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)", "retrieve_run"),
+        ("POST", r"/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/submit_tool_outputs", "submit_tool_outputs"),
+        ("POST", r"/v1/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/cancel", "cancel_run"),
+        ("POST", r"/v1/chat/completions", "create_chat_completion"),
+        ("POST", r"/v1/files", "create_file"),
+        ("GET", r"/v1/files/(?P<file_id>[^/]+)", "retrieve_file"),
+        ("DELETE", r"/v1/files/(?P<file_id>[^/]+)", "delete_file"),
+        ("POST", r"/v1/vector_stores", "create_vector_store"),
+        ("DELETE", r"/v1/vector_stores/(?P<vector_store_id>[^/]+)", "delete_vector_store"),
+        ("POST", r"/v1/vector_stores/(?P<vector_store_id>[^/]+)/file_batches", "create_file_batch"),
+        ("GET", r"/v1/vector_stores/(?P<vector_store_id>[^/]+)/file_batches/(?P<batch_id>[^/]+)", "retrieve_file_batch"),
+        ("GET", r"/v1/vector_stores/(?P<vector_store_id>[^/]+)/file_batches/(?P<batch_id>[^/]+)/files", "list_batch_files"),
+    ]
+    _COMPILED = [(method, re.compile(pattern + r"/?$"), name) for method, pattern, name in ROUTES]
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> FakeOpenAIState:
+        return self.server.state
+
+    # ---- despacho ---------------------------------------------------------
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        body = {}
+        if raw_body and self.headers.get("Content-Type", "").startswith("application/json"):
+            body = json.loads(raw_body)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+        for route_method, pattern, name in self._COMPILED:
+            match = pattern.match(parsed.path)
+            if route_method == method and match:
+                self.state.calls[name] += 1
+                try:
+                    status, payload = getattr(self, name)(body=body, raw_body=raw_body, query=query,
+                                                          **match.groupdict())
+                except KeyError as e:
+                    status, payload = 404, {"error": {"message": f"No such object: {e}", "type": "invalid_request_error"}}
+                if status is not None:  # None: el manejador ya respondió (streaming)
+                    self._send(status, payload)
+                return
+        self._send(404, {"error": {"message": f"Unknown route {method} {parsed.path}", "type": "invalid_request_error"}})
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("openai-poll-after-ms", str(self.state.poll_ms))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _sleep(self, name: str = "default"):
+        time.sleep(self.state.latency(name))
+
+    @staticmethod
+    def _deleted(object_id: str, kind: str) -> dict:
+        return {"id": object_id, "object": f"{kind}.deleted", "deleted": True}
+
+    # ---- assistants -------------------------------------------------------
+
+    def create_assistant(self, body, **_):
+        self._sleep()
+        assistant = {
+            "id": _new_id("asst"), "object": "assistant", "created_at": int(time.time()),
+            "name": body.get("name"), "model": body.get("model", "gpt-4o"),
+            "instructions": body.get("instructions"), "tools": body.get("tools", []),
+            "tool_resources": body.get("tool_resources", {}), "metadata": {},
+        }
+        with self.state.lock:
+            self.state.assistants[assistant["id"]] = assistant
+        return 200, assistant
+
+    def list_assistants(self, **_):
+        self._sleep()
+        with self.state.lock:
+            data = list(self.state.assistants.values())
+        return 200, {"object": "list", "data": data, "first_id": None, "last_id": None, "has_more": False}
+
+    def delete_assistant(self, assistant_id, **_):
+        self._sleep()
+        with self.state.lock:
+            del self.state.assistants[assistant_id]
+        return 200, self._deleted(assistant_id, "assistant")
+
+    # ---- threads y mensajes -----------------------------------------------
+
+    def create_thread(self, **_):
+        self._sleep()
+        thread = {"id": _new_id("thread"), "object": "thread", "created_at": int(time.time()),
+                  "metadata": {}, "tool_resources": {}}
+        with self.state.lock:
+            self.state.threads[thread["id"]] = {"thread": thread, "messages": [], "runs": {}}
+        return 200, thread
+
+    def delete_thread(self, thread_id, **_):
+        self._sleep()
+        with self.state.lock:
+            del self.state.threads[thread_id]
+        return 200, self._deleted(thread_id, "thread")
+
+    def create_message(self, thread_id, body, **_):
+        self._sleep()
+        content = body.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        with self.state.lock:
+            message = self.state.add_message(thread_id, body.get("role", "user"), content)
+            message["attachments"] = body.get("attachments") or []
+        return 200, message
+
+    def list_messages(self, thread_id, query, **_):
+        self._sleep()
+        with self.state.lock:
+            messages = list(self.state.threads[thread_id]["messages"])
+        if query.get("order", "desc") == "desc":
+            messages.reverse()
+        if query.get("after"):
+            ids = [message["id"] for message in messages]
+            messages = messages[ids.index(query["after"]) + 1:] if query["after"] in ids else []
+        limit = int(query.get("limit", 20))
+        page = messages[:limit]
+        return 200, {"object": "list", "data": page,
+                     "first_id": page[0]["id"] if page else None,
+                     "last_id": page[-1]["id"] if page else None,
+                     "has_more": len(messages) > limit}
+
+    def delete_message(self, thread_id, message_id, **_):
+        self._sleep()
+        with self.state.lock:
+            messages = self.state.threads[thread_id]["messages"]
+            ids = [message["id"] for message in messages]
+            if message_id not in ids:
+                raise KeyError(message_id)
+            del messages[ids.index(message_id)]
+        return 200, self._deleted(message_id, "thread.message")
+
+    # ---- chat completions -------------------------------------------------
+
+    def create_chat_completion(self, body, **_):
+        """
+        Responde con un texto fijo que indica cuántos mensajes recibió (lo usa
+        el resumen de contexto).
+        """
+        self._sleep()
+        messages = body.get("messages", [])
+        content = f"Summary of {len(messages)} message(s)."
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in messages)
+        return 200, {
+            "id": _new_id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5},
+        }
+
+    # ---- runs -------------------------------------------------------------
+
+    def create_run(self, thread_id, body, **_):
+        self._sleep()
+        now = time.time()
+        run = {
+            "id": _new_id("run"), "object": "thread.run", "created_at": int(now),
+            "thread_id": thread_id, "assistant_id": body.get("assistant_id"),
+            "status": "queued", "required_action": None, "last_error": None,
+            "model": "gpt-4o", "instructions": "", "tools": [], "metadata": {}, "usage": None,
+            "truncation_strategy": body.get("truncation_strategy"),
+            "max_prompt_tokens": body.get("max_prompt_tokens"),
+            "max_completion_tokens": body.get("max_completion_tokens"),
+            "_round": 0, "_step_started": now,
+        }
+        with self.state.lock:
+            self.state.threads[thread_id]["runs"][run["id"]] = run
+            if not body.get("stream"):
+                return 200, self._public(run)
+        return self._stream_run(thread_id, run["id"], ["thread.run.created", "thread.run.in_progress"])
+
+    def retrieve_run(self, thread_id, run_id, **_):
+        with self.state.lock:
+            run = self.state.threads[thread_id]["runs"][run_id]
+            self.state.advance_run(run)
+            return 200, self._public(run)
+
+    def submit_tool_outputs(self, thread_id, run_id, body, **_):
+        self._sleep()
+        with self.state.lock:
+            run = self.state.threads[thread_id]["runs"][run_id]
+            if run["status"] != "requires_action":
+                return 400, {"error": {"message": f"Run is {run['status']}", "type": "invalid_request_error"}}
+            run["_round"] += 1
+            run["_step_started"] = time.time()
+            run["status"] = "in_progress"
+            run["required_action"] = None
+            if not body.get("stream"):
+                return 200, self._public(run)
+        return self._stream_run(thread_id, run_id, ["thread.run.in_progress"])
+
+    def _stream_run(self, thread_id: str, run_id: str, opening_events: list):
+        """
+        Responde en Server-Sent Events: los eventos de apertura, y tras la
+        latencia del tramo, requires_action o el mensaje y run completed.
+        Durante la latencia no se envía nada (como un stream parado).
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def emit(event: str, data):
+            payload = data if isinstance(data, str) else json.dumps(data)
+            self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            with self.state.lock:
+                run = self._public(self.state.threads[thread_id]["runs"][run_id])
+            for event in opening_events:
+                emit(event, run)
+            time.sleep(self.state.latency("run"))
+            with self.state.lock:
+                run = self.state.threads[thread_id]["runs"][run_id]
+                run["_step_started"] = min(run["_step_started"], time.time() - self.state.latency("run"))
+                self.state.advance_run(run)
+                public = self._public(run)
+                message = self.state.threads[thread_id]["messages"][-1]
+            if public["status"] == "requires_action":
+                emit("thread.run.requires_action", public)
+            elif public["status"] == "completed":
+                text = message["content"][0]["text"]["value"]
+                emit("thread.message.delta", {"id": message["id"], "object": "thread.message.delta", "delta": {
+                    "content": [{"index": 0, "type": "text", "text": {"value": text}}]}})
+                emit("thread.message.completed", message)
+                emit("thread.run.completed", public)
+            else:
+                emit(f"thread.run.{public['status']}", public)
+            emit("done", "[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        return None, None
+
+    def cancel_run(self, thread_id, run_id, **_):
+        with self.state.lock:
+            run = self.state.threads[thread_id]["runs"][run_id]
+            run["status"] = "cancelled"
+            return 200, self._public(run)
+
+    @staticmethod
+    def _public(run: dict) -> dict:
+        return {key: value for key, value in run.items() if not key.startswith("_")}
+
+    # ---- files y vector stores --------------------------------------------
+
+    def create_file(self, raw_body, **_):
+        self._sleep("files.create")
+        match = re.search(rb'filename="([^"]*)"', raw_body)
+        file = {"id": _new_id("file"), "object": "file", "bytes": len(raw_body), "created_at": int(time.time()),
+                "filename": match.group(1).decode("utf-8", "replace") if match else "upload",
+                "purpose": "assistants", "status": "processed"}
+        with self.state.lock:
+            self.state.files[file["id"]] = file
+        return 200, file
+
+    def retrieve_file(self, file_id, **_):
+        self._sleep()
+        with self.state.lock:
+            return 200, self.state.files[file_id]
+
+    def delete_file(self, file_id, **_):
+        self._sleep()
+        with self.state.lock:
+            del self.state.files[file_id]
+        return 200, self._deleted(file_id, "file")
+
+    def create_vector_store(self, body, **_):
+        self._sleep()
+        store = {"id": _new_id("vs"), "object": "vector_store", "created_at": int(time.time()),
+                 "name": body.get("name"), "status": "completed", "usage_bytes": 0,
+                 "file_counts": {"in_progress": 0, "completed": 0, "failed": 0, "cancelled": 0, "total": 0}}
+        with self.state.lock:
+            self.state.vector_stores[store["id"]] = store
+        return 200, store
+
+    def delete_vector_store(self, vector_store_id, **_):
+        self._sleep()
+        with self.state.lock:
+            del self.state.vector_stores[vector_store_id]
+        return 200, self._deleted(vector_store_id, "vector_store")
+
+    def create_file_batch(self, vector_store_id, body, **_):
+        self._sleep()
+        file_ids = body.get("file_ids", [])
+        batch = {"id": _new_id("vsfb"), "object": "vector_store.file_batch", "created_at": int(time.time()),
+                 "vector_store_id": vector_store_id, "_file_ids": file_ids, "_started": time.time()}
+        with self.state.lock:
+            if vector_store_id not in self.state.vector_stores:
+                raise KeyError(vector_store_id)
+            for file_id in file_ids:
+                if file_id not in self.state.files:
+                    raise KeyError(file_id)
+            self.state.batches[batch["id"]] = batch
+            return 200, self._batch(batch)
+
+    def retrieve_file_batch(self, vector_store_id, batch_id, **_):
+        self._sleep()
+        with self.state.lock:
+            return 200, self._batch(self.state.batches[batch_id])
+
+    def list_batch_files(self, vector_store_id, batch_id, **_):
+        self._sleep()
+        with self.state.lock:
+            batch = self._batch(self.state.batches[batch_id])
+            file_ids = self.state.batches[batch_id]["_file_ids"]
+        status = "completed" if batch["status"] == "completed" else "in_progress"
+        data = [{"id": file_id, "object": "vector_store.file", "vector_store_id": vector_store_id,
+                 "status": status, "last_error": None, "created_at": batch["created_at"], "usage_bytes": 0}
+                for file_id in file_ids]
+        return 200, {"object": "list", "data": data, "first_id": None, "last_id": None, "has_more": False}
+
+    def _batch(self, batch: dict) -> dict:
+        total = len(batch["_file_ids"])
+        done = time.time() - batch["_started"] >= self.state.latency("batch.index")
+        public = self._public(batch)
+        public["status"] = "completed" if done else "in_progress"
+        public["file_counts"] = {"in_progress": 0 if done else total, "completed": total if done else 0,
+                                 "failed": 0, "cancelled": 0, "total": total}
+        return public
+
+
+def start_fake_openai(port: int = 0, latencies: dict = None, tool_script: list = None,
+                      reply: str = DEFAULT_REPLY, poll_ms: int = DEFAULT_POLL_MS):
+    """
+    Arranca el servidor en un hilo. Devuelve (server, base_url); el estado
+    (y el número de llamadas por endpoint) queda en server.state.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.state = FakeOpenAIState(latencies, tool_script, reply, poll_ms)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def parse_latencies(values: list) -> dict:
+    """
+    Convierte ["run=2", "files.create=0.5"] en {"run": 2.0, "files.create": 0.5}.
+    """
+    latencies = {}
+    for value in values or []:
+        name, _, seconds = value.partition("=")
+        latencies[name] = float(seconds)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI server for local benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", action="append", help="name=seconds (default, files.create, batch.index, run)")
+    parser.add_argument("--tool-script", help="JSON file with the tool-call rounds of each run")
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    args = parser.parse_args()
+
+    tool_script = None
+    if args.tool_script:
+        with open(args.tool_script, "r", encoding="utf-8") as f:
+            tool_script = json.load(f)
+    server, base_url = start_fake_openai(args.port, parse_latencies(args.latency), tool_script, args.reply)
+    print(f"[fake_openai] Listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
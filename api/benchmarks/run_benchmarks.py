@@ -0,0 +1,271 @@
+# Benchmark de la API contra el servidor falso de OpenAI. Desde la carpeta api/:
+#     python -m benchmarks.run_benchmarks --concurrency 8 --sessions 16
+#     python -m benchmarks.run_benchmarks --compare benchmarks/results/<anterior>.json
+# Arranca fake_openai, levanta la app Flask (main.app) en un puerto local con
+# un directorio de trabajo temporal y mide /start, /chat, /compile (encolado y
+# build completo) y /readTextFile. El resultado (p50/p95/p99, RPS) se guarda
+# en JSON para comparar entre commits.
+import argparse
+import datetime
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks.fake_openai import start_fake_openai, parse_latencies
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(API_DIR, "benchmarks", "results")
+
+
+def percentile(sorted_values: list, fraction: float):
+    if not sorted_values:
+        return None
+    # Nearest-rank: el menor valor que deja por debajo (o igual) esa fracción de muestras
+    index = min(len(sorted_values) - 1, max(0, math.ceil(round(fraction * len(sorted_values), 9)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: list, wall_seconds: float) -> dict:
+    """
+    samples: [(segundos, ok)]. Latencias en milisegundos.
+    """
+    latencies = sorted(seconds * 1000 for seconds, ok in samples if ok)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, ok in samples if not ok),
+        "p50_ms": _round(percentile(latencies, 0.50)),
+        "p95_ms": _round(percentile(latencies, 0.95)),
+        "p99_ms": _round(percentile(latencies, 0.99)),
+        "mean_ms": _round(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": _round(latencies[-1]) if latencies else None,
+        "rps": round(len(samples) / wall_seconds, 2) if wall_seconds > 0 else None,
+    }
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+def prepare_environment(workdir: str, base_url: str, args):
+    """
+    Variables de entorno de la app apuntando al servidor falso y a carpetas
+    temporales (no se toca nada del repositorio).
+    """
+    for name in ("output", "public", "generatedDocuments"):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPEN_AI_API_KEY": "sk-benchmark",
+        "BACKEND_OUTPUT_DIR": os.path.join(workdir, "output"),
+        "FRONTEND_PUBLIC_PATH": os.path.join(workdir, "public"),
+        "FILES_TO_UPLOAD_STRUCTURE_PATH": os.path.join(API_DIR, "invention-disclosure-structure.tex"),
+        "FILES_TO_UPLOAD_STRUCTURE_COPY_TO_LOCAL": "True",
+        "FILES_TO_UPLOAD_INSTRUCTIONS_PATH": os.path.join(API_DIR, "invention-disclosure-instructions.md"),
+        "FILES_TO_UPLOAD_INSTRUCTIONS_COPY_TO_LOCAL": "False",
+        "ASSISTANT_DURATION": "86400",
+        "REAPER_DB_PATH": os.path.join(workdir, "sessions.db"),
+        "FILE_REGISTRY_PATH": os.path.join(workdir, "file_registry.db"),
+        "CONTEXT_SUMMARY_DB_PATH": os.path.join(workdir, "context_summaries.db"),
+        "BUILD_CACHE_DIR": os.path.join(workdir, "buildCache"),
+        "TEX_FORMAT_DIR": os.path.join(workdir, "texFormats"),
+        "TEX_BINARY": args.tex_binary,
+        "STUB_COMPILE_SECONDS": str(args.compile_seconds),
+        # Sin caché de builds cada compilación pasa por el compilador
+        "BUILD_CACHE_MAX_ENTRIES": os.environ.get('BUILD_CACHE_MAX_ENTRIES', '200') if args.build_cache else "0",
+    })
+    os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+
+
+def serve_app(app):
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="benchmark-app", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_phase(name: str, jobs: list, concurrency: int, func) -> dict:
+    """
+    Ejecuta func(job) para cada job con 'concurrency' clientes en paralelo.
+    func devuelve True si la petición fue correcta.
+    """
+    def timed(job):
+        started = time.perf_counter()
+        try:
+            ok = func(job)
+        except Exception as e:
+            print(f"[benchmark] {name} error: {e}")
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed, jobs))
+    result = summarize(samples, time.perf_counter() - started)
+    print(f"[benchmark] {name}: {result}")
+    return result
+
+
+def run_benchmarks(app_url: str, args) -> dict:
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    http.mount("http://", adapter)
+    sessions = []
+    lock = threading.Lock()
+    results = {}
+
+    def start(_):
+        response = http.get(f"{app_url}/start")
+        if response.status_code == 200:
+            with lock:
+                sessions.append(response.json())
+        return response.status_code == 200
+
+    results["/start"] = run_phase("/start", range(args.sessions), args.concurrency, start)
+
+    def chat(session):
+        response = http.post(f"{app_url}/chat", data={**session, "message": "Fill in the purpose section."})
+        return response.status_code == 200
+
+    chats = [session for session in sessions for _ in range(args.messages)]
+    results["/chat"] = run_phase("/chat", chats, args.concurrency, chat)
+
+    def compile_enqueue(session):
+        response = http.post(f"{app_url}/compile", json={"thread_id": session["thread_id"]})
+        return response.status_code == 202
+
+    results["/compile"] = run_phase("/compile", sessions, args.concurrency, compile_enqueue)
+
+    def compile_build(session):
+        # Edición + compilación completa: encola y espera a que el build termine
+        response = http.post(f"{app_url}/compile", json={"thread_id": session["thread_id"]})
+        if response.status_code != 202:
+            return False
+        deadline = time.monotonic() + args.compile_timeout
+        while time.monotonic() < deadline:
+            status = http.get(f"{app_url}/compile/status", params={"thread_id": session["thread_id"]}).json()
+            if status.get("status") in ("done", "failed") and not status.get("pending"):
+                return status["status"] == "done"
+            time.sleep(0.02)
+        return False
+
+    results["compile (build)"] = run_phase("compile (build)", sessions, args.concurrency, compile_build)
+
+    def read_text(session):
+        response = http.get(f"{app_url}/readTextFile", params={"thread_id": session["thread_id"]})
+        return response.status_code == 200 and bool(response.json().get("response"))
+
+    reads = [sessions[index % len(sessions)] for index in range(args.reads)] if sessions else []
+    results["/readTextFile"] = run_phase("/readTextFile", reads, args.concurrency, read_text)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, previous_path: str):
+    """
+    Imprime la variación de p50/p95/RPS respecto a un resultado anterior.
+    """
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"[benchmark] Comparing with {previous_path} (commit {previous.get('commit')})")
+    for endpoint, result in current["endpoints"].items():
+        before = previous.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        changes = []
+        for metric in ("p50_ms", "p95_ms", "rps"):
+            if before.get(metric) and result.get(metric) is not None:
+                delta = (result[metric] - before[metric]) / before[metric] * 100
+                changes.append(f"{metric} {before[metric]} -> {result[metric]} ({delta:+.1f}%)")
+        print(f"  {endpoint}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against a local fake OpenAI server")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=8, help="sessions opened with /start")
+    parser.add_argument("--messages", type=int, default=1, help="/chat messages per session")
+    parser.add_argument("--reads", type=int, default=200, help="/readTextFile requests")
+    parser.add_argument("--latency", action="append", help="fake OpenAI latency, name=seconds")
+    parser.add_argument("--tool-script", help="JSON file with the tool-call rounds of each run")
+    parser.add_argument("--tex-binary", default="stub", help="'stub' or a pdflatex-compatible executable")
+    parser.add_argument("--compile-seconds", type=float, default=0.5, help="duration of each stub compile")
+    parser.add_argument("--compile-timeout", type=float, default=60)
+    parser.add_argument("--build-cache", action="store_true", help="keep the PDF build cache enabled")
+    parser.add_argument("--output", help="JSON result path (default: benchmarks/results/<date>-<commit>.json)")
+    parser.add_argument("--compare", help="previous JSON result to compare against")
+    args = parser.parse_args()
+    # Rutas relativas a la carpeta desde la que se lanza (luego se cambia al directorio temporal)
+    output = os.path.abspath(args.output) if args.output else None
+    previous = os.path.abspath(args.compare) if args.compare else None
+
+    tool_script = None
+    if args.tool_script:
+        with open(args.tool_script, "r", encoding="utf-8") as f:
+            tool_script = json.load(f)
+    latencies = parse_latencies(args.latency)
+    fake_server, base_url = start_fake_openai(latencies=latencies, tool_script=tool_script)
+
+    workdir = tempfile.mkdtemp(prefix="idv2-bench-")
+    prepare_environment(workdir, base_url, args)
+    os.chdir(workdir)
+    sys.path.insert(0, API_DIR)
+    import main as api_main  # después de preparar el entorno: lee las variables al importarse
+
+    app_server, app_url = serve_app(api_main.app)
+    print(f"[benchmark] App on {app_url}, fake OpenAI on {base_url}, workdir {workdir}")
+    try:
+        endpoints = run_benchmarks(app_url, args)
+        usage = requests.get(f"{app_url}/usageStats").json()
+    finally:
+        app_server.shutdown()
+        fake_server.shutdown()
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "concurrency": args.concurrency,
+            "sessions": args.sessions,
+            "messages": args.messages,
+            "reads": args.reads,
+            "latencies": fake_server.state.latencies,
+            "tool_script": args.tool_script,
+            "tex_binary": args.tex_binary,
+            "compile_seconds": args.compile_seconds,
+            "build_cache": args.build_cache,
+        },
+        "endpoints": endpoints,
+        "usage": usage,
+        "fake_openai_calls": dict(fake_server.state.calls),
+    }
+
+    output = output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{commit or 'nocommit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[benchmark] Results written to {output}")
+
+    if previous:
+        compare(result, previous)
+
+
+if __name__ == "__main__":
+    main()
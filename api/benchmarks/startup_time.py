@@ -0,0 +1,106 @@
+# Tiempo de arranque de la API. Desde la carpeta api/:
+#     python -m benchmarks.startup_time --runs 5
+#     python -m benchmarks.startup_time --compare benchmarks/results/<anterior>.json
+# Cada medida es un proceso nuevo que importa main (como un worker de
+# gunicorn/uvicorn al arrancar), espera --idle-seconds (el worker ya acepta
+# tráfico pero aún no le llega nada) y hace dos peticiones a OpenAI (contra
+# fake_openai): la primera paga lo que quede de arranque y la conexión, la
+# segunda reutiliza el pool. Se guarda en JSON junto a los resultados de
+# run_benchmarks.
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.fake_openai import start_fake_openai
+from benchmarks.run_benchmarks import API_DIR, RESULTS_DIR, git_commit, percentile, prepare_environment
+
+# Módulos pesados cuya carga se vigila
+WATCHED_MODULES = ("openai", "httpx", "requests", "numpy", "faiss", "PyPDF2", "langchain")
+
+_CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+loaded = [name for name in {watched!r} if name in sys.modules]
+time.sleep({idle})
+requested = time.perf_counter()
+main.client.beta.threads.create()
+first = time.perf_counter()
+main.client.beta.threads.create()
+second = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - started) * 1000, "first_request_ms": (first - requested) * 1000,
+                  "warm_request_ms": (second - first) * 1000, "modules_at_import": loaded}}))
+"""
+
+
+def measure(runs: int, idle_seconds: float) -> dict:
+    code = _CHILD.format(watched=WATCHED_MODULES, idle=idle_seconds)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.getcwd(), capture_output=True,
+                                text=True, check=True, env={**os.environ, "PYTHONPATH": API_DIR}).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    result = {"runs": runs, "modules_at_import": samples[-1]["modules_at_import"]}
+    for metric in ("import_ms", "first_request_ms", "warm_request_ms"):
+        values = sorted(sample[metric] for sample in samples)
+        result[metric] = {"p50": round(percentile(values, 0.5), 1), "max": round(values[-1], 1)}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API process start-up time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--idle-seconds", type=float, default=1.0,
+                        help="pause between the import and the first request")
+    parser.add_argument("--tex-binary", default="stub")
+    parser.add_argument("--output", help="JSON result path (default: benchmarks/results/startup-<date>-<commit>.json)")
+    parser.add_argument("--compare", help="previous JSON result to compare against")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    previous = os.path.abspath(args.compare) if args.compare else None
+
+    fake_server, base_url = start_fake_openai(latencies={"default": 0.0})
+    workdir = tempfile.mkdtemp(prefix="idv2-startup-")
+    # Mismo entorno que run_benchmarks (sin pool de sesiones ni barrido, que no son arranque)
+    prepare_environment(workdir, base_url, argparse.Namespace(
+        tex_binary=args.tex_binary, compile_seconds=0, build_cache=False))
+    os.environ.update({"SESSION_POOL_SIZE": "0", "RETENTION_MAX_AGE_DAYS": "0"})
+    os.chdir(workdir)
+    try:
+        startup = measure(args.runs, args.idle_seconds)
+    finally:
+        fake_server.shutdown()
+    print(f"[startup] {startup}")
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "startup": startup,
+    }
+    output = output or os.path.join(
+        RESULTS_DIR, f"startup-{datetime.datetime.now():%Y%m%d-%H%M%S}-{commit or 'nocommit'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[startup] Results written to {output}")
+
+    if previous:
+        with open(previous, "r", encoding="utf-8") as f:
+            before = json.load(f)["startup"]
+        print(f"[startup] Comparing with {previous}")
+        for metric in ("import_ms", "first_request_ms", "warm_request_ms"):
+            old, new = before[metric]["p50"], startup[metric]["p50"]
+            delta = (new - old) / old * 100 if old else 0
+            print(f"  {metric}: {old} -> {new} ({delta:+.1f}%)")
+        print(f"  modules_at_import: {before['modules_at_import']} -> {startup['modules_at_import']}")
+
+
+if __name__ == "__main__":
+    main()
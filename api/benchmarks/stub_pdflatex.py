@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# pdflatex falso: entiende las opciones que usa tex_engine (-ini, -fmt,
+# -jobname, -output-directory), espera STUB_COMPILE_SECONDS y escribe un PDF
+# (o un .fmt) mínimo. Sirve para medir el camino real de procesos sin TeX:
+#     TEX_BINARY=$PWD/benchmarks/stub_pdflatex.py
+import os
+import sys
+import time
+
+PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def main(argv):
+    ini = False
+    jobname = None
+    output_dir = "."
+    source = None
+    args = iter(argv)
+    for arg in args:
+        if arg == "-ini":
+            ini = True
+        elif arg.startswith("-jobname="):
+            jobname = arg.split("=", 1)[1]
+        elif arg == "-output-directory":
+            output_dir = next(args)
+        elif not arg.startswith("-") and not arg.startswith("&"):
+            source = arg
+
+    if source is None or not os.path.exists(source):
+        print(f"! I can't find file `{source}'.")
+        return 1
+    jobname = jobname or os.path.splitext(os.path.basename(source))[0]
+
+    time.sleep(float(os.environ.get("STUB_COMPILE_SECONDS", "0")))
+    if ini:
+        with open(os.path.join(output_dir, f"{jobname}.fmt"), "wb") as f:
+            f.write(b"stub format\n")
+    else:
+        with open(os.path.join(output_dir, f"{jobname}.pdf"), "wb") as f:
+            f.write(PDF)
+    print(f"Output written on {jobname}.{'fmt' if ini else 'pdf'}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
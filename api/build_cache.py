@@ -0,0 +1,136 @@
+import collections
+import hashlib
+import os
+import shutil
+import threading
+
+# Carpeta donde se guardan los PDFs ya compilados, indexados por hash
+BUILD_CACHE_DIR = os.environ.get('BUILD_CACHE_DIR', 'buildCache')
+# Límites de la caché (se expulsa primero lo usado hace más tiempo)
+BUILD_CACHE_MAX_ENTRIES = int(os.environ.get('BUILD_CACHE_MAX_ENTRIES', '200'))
+BUILD_CACHE_MAX_BYTES = int(os.environ.get('BUILD_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Archivos adicionales de los que depende el build (separados por comas). Por
+# defecto la plantilla: si cambia, no se sirven PDFs compilados con la anterior
+BUILD_CACHE_ASSETS = [path for path in os.environ.get(
+    'BUILD_CACHE_ASSETS', os.environ.get('FILES_TO_UPLOAD_STRUCTURE_PATH', 'invention-disclosure-structure.tex')
+).split(',') if path]
+
+
+class BuildCache:
+    """
+    Caché LRU de PDFs compilados. La clave es el SHA-256 del fuente .tex más
+    los archivos de la plantilla y el compilador y formato del preámbulo
+    usados (TexEngine.build_id), de modo que un .tex que ya se compiló antes
+    no vuelve a pasar por pdflatex.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int, max_bytes: int, assets: list):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.assets = assets
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> tamaño en bytes
+        self._total_bytes = 0
+        self._asset_hashes = {}  # ruta -> (mtime_ns, size, sha256)
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cached = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pdf"):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                cached.append((stat.st_mtime, name[:-4], stat.st_size))
+        # Lo más antiguo primero: será lo primero en expulsarse
+        for _, key, size in sorted(cached):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def _asset_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        known = self._asset_hashes.get(path)
+        if known and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+            return known[2]
+        with open(path, 'rb') as f:
+            sha = hashlib.sha256(f.read()).hexdigest()
+        self._asset_hashes[path] = (stat.st_mtime_ns, stat.st_size, sha)
+        return sha
+
+    def key_for(self, tex_source: bytes, build_id: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(build_id.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(tex_source)
+        for asset in self.assets:
+            digest.update(b"\0")
+            digest.update(asset.encode('utf-8'))
+            try:
+                digest.update(self._asset_hash(asset).encode('ascii'))
+            except FileNotFoundError:
+                digest.update(b"missing")
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        Devuelve la ruta del PDF en caché, o None.
+        """
+        with self._lock:
+            if key in self._entries and os.path.exists(self._path(key)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._path(key)
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, pdf_path: str):
+        size = os.path.getsize(pdf_path)
+        if size > self.max_bytes:
+            return
+        # Temporal propio de cada proceso/hilo: batch_export compila en varios procesos a la vez
+        tmp_path = f"{self._path(key)}.{os.getpid()}-{threading.get_ident()}.tmp"
+        shutil.copyfile(pdf_path, tmp_path)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else None,
+                "evictions": self.evictions,
+            }
+
+
+# Caché compartida por el proceso
+build_cache = BuildCache(BUILD_CACHE_DIR, BUILD_CACHE_MAX_ENTRIES, BUILD_CACHE_MAX_BYTES, BUILD_CACHE_ASSETS)
@@ -0,0 +1,149 @@
+import os
+import shutil
+import threading
+import time
+
+from document_model import GENERATED_DOCUMENTS_DIR, document_store
+from instrumentation import log
+
+# Días que se conservan el .tex y los builds de un thread sin actividad (0, por
+# defecto, = no se borra nada: activarlo borra los documentos de los usuarios)
+RETENTION_MAX_AGE_DAYS = float(os.environ.get('RETENTION_MAX_AGE_DAYS', '0'))
+# Segundos entre dos barridos
+RETENTION_SWEEP_INTERVAL = float(os.environ.get('RETENTION_SWEEP_INTERVAL', '3600'))
+
+
+def _last_activity(paths: list):
+    """
+    mtime más reciente de las rutas (recorriendo carpetas), o None si no existe ninguna.
+    """
+    latest = None
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        candidates = [path]
+        if os.path.isdir(path):
+            candidates += [os.path.join(path, name) for name in os.listdir(path)]
+        for candidate in candidates:
+            try:
+                mtime = os.path.getmtime(candidate)
+            except OSError:
+                continue
+            latest = mtime if latest is None else max(latest, mtime)
+    return latest
+
+
+class RetentionSweeper:
+    """
+    Borra periódicamente los artefactos de threads inactivos: el .tex de
+    generatedDocuments, la carpeta de builds en BACKEND_OUTPUT_DIR y la copia
+    en FRONTEND_PUBLIC_PATH. Nunca toca threads con una sesión aún activa.
+    """
+
+    def __init__(self, max_age_days: float, interval: float):
+        self.max_age = max_age_days * 86400
+        self.interval = interval
+        self._active_threads = lambda: set()
+        self._stopped = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.sweeps = 0
+        self.removed_threads = 0
+        self.removed_bytes = 0
+        self.last_sweep_at = None
+
+    def start(self, active_threads):
+        """
+        Arranca el barrido periódico (el primero, en el momento).
+        'active_threads()' devuelve los thread_id que no se deben borrar.
+        """
+        if self.max_age <= 0 or self._worker is not None:
+            return
+        self._active_threads = active_threads
+        self._worker = threading.Thread(target=self._loop, name="build-retention", daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                log("build_retention.error", error=str(e))
+            self._stopped.wait(timeout=self.interval)
+
+    def _thread_paths(self, thread_id: str) -> list:
+        paths = [os.path.join(GENERATED_DOCUMENTS_DIR, f"{thread_id}.tex")]
+        for env_name in ("BACKEND_OUTPUT_DIR", "FRONTEND_PUBLIC_PATH"):
+            root = os.getenv(env_name)
+            if root:
+                paths.append(os.path.join(root, thread_id))
+        return paths
+
+    def _known_threads(self) -> set:
+        thread_ids = set()
+        if os.path.isdir(GENERATED_DOCUMENTS_DIR):
+            thread_ids.update(name[:-4] for name in os.listdir(GENERATED_DOCUMENTS_DIR) if name.endswith(".tex"))
+        for env_name in ("BACKEND_OUTPUT_DIR", "FRONTEND_PUBLIC_PATH"):
+            root = os.getenv(env_name)
+            if root and os.path.isdir(root):
+                thread_ids.update(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+        return thread_ids
+
+    def sweep(self) -> list:
+        """
+        Borra los threads sin actividad desde hace más de RETENTION_MAX_AGE_DAYS.
+        Devuelve los thread_id eliminados.
+        """
+        cutoff = time.time() - self.max_age
+        active = self._active_threads()
+        removed = []
+        freed = 0
+        for thread_id in self._known_threads() - active:
+            paths = self._thread_paths(thread_id)
+            last_activity = _last_activity(paths)
+            if last_activity is None or last_activity > cutoff:
+                continue
+            for path in paths:
+                freed += self._remove(path)
+            document_store.invalidate(thread_id)
+            removed.append(thread_id)
+
+        with self._lock:
+            self.sweeps += 1
+            self.removed_threads += len(removed)
+            self.removed_bytes += freed
+            self.last_sweep_at = time.time()
+        if removed:
+            log("build_retention.swept", threads=len(removed), freed_bytes=freed)
+        return removed
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(path) for name in names)
+            shutil.rmtree(path, ignore_errors=True)
+            return size
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        return 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_age_days": self.max_age / 86400,
+                "interval": self.interval,
+                "sweeps": self.sweeps,
+                "removed_threads": self.removed_threads,
+                "removed_bytes": self.removed_bytes,
+                "last_sweep_at": self.last_sweep_at,
+            }
+
+
+# Barrido compartido por el proceso
+retention_sweeper = RetentionSweeper(RETENTION_MAX_AGE_DAYS, RETENTION_SWEEP_INTERVAL)
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import log, span
+from latex_compiler import compile_document, CompileError
+
+# Compilaciones simultáneas (cada una es un proceso pdflatex aparte)
+COMPILE_MAX_WORKERS = int(os.environ.get('COMPILE_MAX_WORKERS', '2'))
+# Ventana en segundos para agrupar ráfagas de ediciones del mismo thread
+COMPILE_DEBOUNCE_SECONDS = float(os.environ.get('COMPILE_DEBOUNCE_SECONDS', '0.3'))
+# Segundos que se conserva el estado de un build terminado
+COMPILE_STATUS_TTL = float(os.environ.get('COMPILE_STATUS_TTL', '3600'))
+
+
+class _CompileJob:
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.status = "queued"       # queued | running | done | failed
+        self.generation = 0          # se incrementa con cada petición de compilación
+        self.built_generation = 0    # última versión compilada con éxito
+        self.scheduled = False       # hay un worker asignado a este thread
+        self.process = None
+        self.last_request_at = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self.duration = None
+        self.error = None
+        self.cache_hit = None
+        self.build_hash = None
+        self.timings = None
+        self.builds = 0
+        self.cancelled = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "thread_id": self.thread_id,
+            "status": self.status,
+            "duration": self.duration,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "cache_hit": self.cache_hit,
+            "build_hash": self.build_hash,
+            "timings": self.timings,
+            "builds": self.builds,
+            "cancelled": self.cancelled,
+            "pending": self.generation != self.built_generation,
+        }
+
+
+class CompileScheduler:
+    """
+    Cola de compilaciones por thread_id sobre un pool acotado de workers.
+    - Las peticiones de un mismo thread se agrupan: sólo se compila la última
+      versión del documento.
+    - Si llega una edición mientras compila, el build en curso se cancela
+      (queda obsoleto) y se vuelve a compilar.
+    - Las peticiones HTTP sólo encolan; nunca esperan a pdflatex.
+    """
+
+    def __init__(self, max_workers: int, debounce: float):
+        self.debounce = debounce
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="compile")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, thread_id: str) -> dict:
+        with self._lock:
+            self._evict_finished()
+            job = self._jobs.get(thread_id)
+            if job is None:
+                job = self._jobs[thread_id] = _CompileJob(thread_id)
+            job.generation += 1
+            job.last_request_at = time.monotonic()
+
+            if job.status == "running" and job.process is not None:
+                # El build en curso compila una versión obsoleta: lo cancelamos
+                job.process.terminate()
+                job.cancelled += 1
+                log("compile.cancelled_stale", thread_id=thread_id)
+
+            if not job.scheduled:
+                job.scheduled = True
+                job.status = "queued"
+                self._executor.submit(self._worker, job)
+            return job.snapshot()
+
+    def status(self, thread_id: str):
+        with self._lock:
+            job = self._jobs.get(thread_id)
+            return job.snapshot() if job else None
+
+    def _worker(self, job: _CompileJob):
+        while True:
+            # Debounce: esperamos a que la ráfaga de ediciones termine
+            while True:
+                with self._lock:
+                    remaining = job.last_request_at + self.debounce - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(remaining)
+
+            with self._lock:
+                generation = job.generation
+                job.status = "running"
+                job.started_at = time.time()
+
+            started = time.perf_counter()
+            error = None
+            result = {}
+            try:
+                with span("compile", thread_id=job.thread_id) as attrs:
+                    result = compile_document(job.thread_id, on_process=lambda process: self._attach_process(job, process))
+                    attrs.update(cache_hit=result.get("cache_hit"), timings=result.get("timings"))
+            except CompileError as e:
+                error = e.stderr or str(e)
+            except Exception as e:
+                error = str(e)
+            duration = round(time.perf_counter() - started, 3)
+
+            with self._lock:
+                job.process = None
+                if job.generation != generation:
+                    # Llegó una versión nueva durante el build: recompilamos
+                    job.status = "queued"
+                    continue
+                job.builds += 1
+                job.duration = duration
+                job.finished_at = time.time()
+                job.error = error
+                job.cache_hit = result.get("cache_hit")
+                job.build_hash = result.get("build_hash")
+                job.timings = result.get("timings")
+                job.status = "failed" if error else "done"
+                if not error:
+                    job.built_generation = generation
+                job.scheduled = False
+                log("compile.finished", thread_id=job.thread_id, status=job.status, seconds=duration)
+                return
+
+    def _attach_process(self, job: _CompileJob, process):
+        with self._lock:
+            job.process = process
+
+    def _evict_finished(self):
+        now = time.time()
+        for thread_id, job in list(self._jobs.items()):
+            if not job.scheduled and job.finished_at and now - job.finished_at > COMPILE_STATUS_TTL:
+                del self._jobs[thread_id]
+
+
+# Scheduler compartido por el proceso
+compile_scheduler = CompileScheduler(COMPILE_MAX_WORKERS, COMPILE_DEBOUNCE_SECONDS)
@@ -0,0 +1,248 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+from instrumentation import log, metrics, span
+
+# Mensajes del thread que ve cada run (0, por defecto, = truncado automático de OpenAI).
+# Con un valor, el assistant deja de ver los mensajes anteriores: conviene
+# activar también el resumen (CONTEXT_SUMMARY_THRESHOLD)
+RUN_TRUNCATION_LAST_MESSAGES = int(os.environ.get('RUN_TRUNCATION_LAST_MESSAGES', '0'))
+# Tokens máximos de prompt y de respuesta por run (0, por defecto, = sin límite).
+# Un run que llega al límite termina como 'incomplete'
+RUN_MAX_PROMPT_TOKENS = int(os.environ.get('RUN_MAX_PROMPT_TOKENS', '0'))
+RUN_MAX_COMPLETION_TOKENS = int(os.environ.get('RUN_MAX_COMPLETION_TOKENS', '0'))
+# Tokens de prompt de un run a partir de los cuales se resumen los turnos antiguos (0 = nunca)
+CONTEXT_SUMMARY_THRESHOLD = int(os.environ.get('CONTEXT_SUMMARY_THRESHOLD', '0'))
+# Borrar del thread los mensajes ya resumidos (una vez guardado el resumen). Sin
+# borrarlos, el resumen sólo ahorra contexto junto con RUN_TRUNCATION_LAST_MESSAGES
+CONTEXT_SUMMARY_DELETE_MESSAGES = os.environ.get('CONTEXT_SUMMARY_DELETE_MESSAGES', 'False') == 'True'
+# Base de datos local con los resúmenes (sobreviven a reinicios y se comparten entre procesos)
+CONTEXT_SUMMARY_DB_PATH = os.environ.get('CONTEXT_SUMMARY_DB_PATH', 'context_summaries.db')
+# Mensajes más recientes que se conservan tal cual al resumir (al menos uno y,
+# con RUN_TRUNCATION_LAST_MESSAGES, no más de los que ve el run: los de en medio
+# no se resumirían ni se enviarían)
+CONTEXT_SUMMARY_KEEP_MESSAGES = max(1, int(os.environ.get('CONTEXT_SUMMARY_KEEP_MESSAGES', '8')))
+CONTEXT_SUMMARY_MODEL = os.environ.get('CONTEXT_SUMMARY_MODEL', 'gpt-4o-mini')
+# Segundos que un run espera a que termine un resumen en curso del mismo thread
+CONTEXT_SUMMARY_WAIT_SECONDS = float(os.environ.get('CONTEXT_SUMMARY_WAIT_SECONDS', '20'))
+# Threads cuyo consumo se guarda en memoria
+USAGE_MAX_THREADS = int(os.environ.get('USAGE_MAX_THREADS', '1024'))
+
+if 0 < RUN_TRUNCATION_LAST_MESSAGES < CONTEXT_SUMMARY_KEEP_MESSAGES:
+    log("context_budget.keep_messages_clamped", keep_messages=CONTEXT_SUMMARY_KEEP_MESSAGES,
+        truncation_last_messages=RUN_TRUNCATION_LAST_MESSAGES)
+    CONTEXT_SUMMARY_KEEP_MESSAGES = RUN_TRUNCATION_LAST_MESSAGES
+
+SUMMARY_PROMPT = (
+    "Summarize the earlier part of this conversation between a researcher and the assistant that "
+    "is helping them fill in an invention disclosure. Keep every fact about the invention, the "
+    "decisions taken, the sections already written and any pending request. Be concise; do not "
+    "add information that is not in the conversation."
+)
+
+_tokens_total = metrics.counter("run_tokens_total", "Tokens consumidos por los runs, por tipo.")
+_summaries_total = metrics.counter("context_summaries_total", "Resúmenes de contexto generados.")
+
+
+def usage_of(run) -> dict:
+    """
+    'usage' de un run terminado como dict, o None si el run no lo trae.
+    """
+    usage = getattr(run, "usage", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "total_tokens": usage.total_tokens or 0,
+    }
+
+
+def _empty_totals() -> dict:
+    return {"runs": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+class ContextBudget:
+    """
+    Límites de contexto de cada run y contabilidad de tokens:
+      - run_options(thread_id): truncation_strategy, max_prompt_tokens,
+        max_completion_tokens y, si el thread se ha resumido, el resumen
+        como additional_instructions;
+      - record(...): suma el 'usage' del run por thread y por assistant;
+      - si un run supera CONTEXT_SUMMARY_THRESHOLD tokens de prompt, en
+        segundo plano se resumen los mensajes antiguos aún no resumidos y, con
+        CONTEXT_SUMMARY_DELETE_MESSAGES, se borran del thread (los que llevan
+        archivos adjuntos se conservan).
+    Los resúmenes se guardan en SQLite antes de borrar nada; el consumo vive
+    en memoria del proceso.
+    """
+
+    def __init__(self, max_threads: int, db_path: str):
+        self.max_threads = max_threads
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                thread_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                next_message_id TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+        self._threads = collections.OrderedDict()  # thread_id -> totales + último run
+        self._assistants = collections.OrderedDict()  # assistant_id -> totales
+        self._summarizing = {}  # thread_id -> Event que se activa al terminar el resumen
+        self._lock = threading.Lock()
+
+    def summary(self, thread_id: str):
+        """
+        (resumen, id del primer mensaje aún sin resumir) del thread, o None.
+        """
+        with self._lock:
+            return self._db.execute("SELECT summary, next_message_id FROM summaries WHERE thread_id = ?",
+                                    (thread_id,)).fetchone()
+
+    def forget(self, thread_id: str):
+        """
+        Borra el resumen de un thread que ya no existe (fin de la sesión).
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM summaries WHERE thread_id = ?", (thread_id,))
+            self._db.commit()
+
+    def run_options(self, thread_id: str) -> dict:
+        """
+        Parámetros extra para runs.create / create_and_poll / stream.
+        """
+        with self._lock:
+            pending = self._summarizing.get(thread_id)
+        if pending is not None:
+            pending.wait(timeout=CONTEXT_SUMMARY_WAIT_SECONDS)
+
+        options = {}
+        if RUN_TRUNCATION_LAST_MESSAGES > 0:
+            options["truncation_strategy"] = {"type": "last_messages",
+                                              "last_messages": RUN_TRUNCATION_LAST_MESSAGES}
+        else:
+            options["truncation_strategy"] = {"type": "auto"}
+        if RUN_MAX_PROMPT_TOKENS > 0:
+            options["max_prompt_tokens"] = RUN_MAX_PROMPT_TOKENS
+        if RUN_MAX_COMPLETION_TOKENS > 0:
+            options["max_completion_tokens"] = RUN_MAX_COMPLETION_TOKENS
+        summary = self.summary(thread_id)
+        if summary:
+            options["additional_instructions"] = f"\nSummary of the earlier conversation:\n{summary[0]}"
+        return options
+
+    def record(self, client, thread_id: str, assistant_id: str, usage: dict):
+        """
+        Registra el consumo de un run terminado y, si el prompt ya pasa del
+        umbral, lanza el resumen del thread.
+        """
+        if not usage:
+            return
+        with self._lock:
+            totals = self._threads.get(thread_id)
+            if totals is None:
+                totals = self._threads[thread_id] = {**_empty_totals(), "assistant_id": assistant_id}
+            self._threads.move_to_end(thread_id)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+            assistant_totals = self._assistants.setdefault(assistant_id, _empty_totals())
+            self._assistants.move_to_end(assistant_id)
+            while len(self._assistants) > self.max_threads:
+                self._assistants.popitem(last=False)
+            for target in (totals, assistant_totals):
+                target["runs"] += 1
+                for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                    target[key] += usage[key]
+            totals["last_run"] = {**usage, "at": time.time()}
+            start_summary = (0 < CONTEXT_SUMMARY_THRESHOLD <= usage["prompt_tokens"]
+                             and thread_id not in self._summarizing)
+            if start_summary:
+                self._summarizing[thread_id] = threading.Event()
+
+        _tokens_total.inc(usage["prompt_tokens"], kind="prompt")
+        _tokens_total.inc(usage["completion_tokens"], kind="completion")
+        if start_summary:
+            threading.Thread(target=self._summarize, args=(client, thread_id),
+                             name="context-summary", daemon=True).start()
+
+    def _summarize(self, client, thread_id: str):
+        try:
+            with span("context.summarize", thread_id=thread_id) as attrs:
+                # Sólo los mensajes que no entraron en el resumen anterior (el
+                # primero de ellos nunca se borra: se conservó en la pasada anterior)
+                previous = self.summary(thread_id)
+                messages = list(client.beta.threads.messages.list(thread_id=thread_id, order="asc"))
+                ids = [message.id for message in messages]
+                if previous and previous[1] in ids:
+                    messages = messages[ids.index(previous[1]):]
+                older = messages[:-CONTEXT_SUMMARY_KEEP_MESSAGES]
+                attrs["messages"] = len(older)
+                if not older:
+                    return
+
+                transcript = [f"Previous summary:\n{previous[0]}"] if previous else []
+                for message in older:
+                    text = "\n".join(part.text.value for part in message.content if part.type == "text")
+                    transcript.append(f"{message.role}: {text}")
+
+                completion = client.chat.completions.create(
+                    model=CONTEXT_SUMMARY_MODEL,
+                    messages=[{"role": "system", "content": SUMMARY_PROMPT},
+                              {"role": "user", "content": "\n\n".join(transcript)}],
+                )
+                summary = completion.choices[0].message.content.strip()
+                # Primero el resumen en disco: si el proceso cae, los mensajes borrados ya están resumidos
+                with self._lock:
+                    self._db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+                                     (thread_id, summary, messages[len(older)].id, time.time()))
+                    self._db.commit()
+
+                deleted = 0
+                if CONTEXT_SUMMARY_DELETE_MESSAGES:
+                    for message in older:
+                        if not message.attachments:
+                            client.beta.threads.messages.delete(message_id=message.id, thread_id=thread_id)
+                            deleted += 1
+                _summaries_total.inc()
+                log("context_budget.summarized", thread_id=thread_id, messages=len(older), deleted=deleted)
+        except Exception as e:
+            log("context_budget.error", thread_id=thread_id, error=str(e))
+        finally:
+            with self._lock:
+                pending = self._summarizing.pop(thread_id, None)
+            if pending is not None:
+                pending.set()
+
+    def thread_usage(self, thread_id: str) -> dict:
+        with self._lock:
+            totals = self._threads.get(thread_id)
+            if totals is None:
+                return None
+            summarized = self._db.execute("SELECT 1 FROM summaries WHERE thread_id = ?", (thread_id,)).fetchone()
+            return {**totals, "summarized": summarized is not None}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limits": {
+                    "truncation_last_messages": RUN_TRUNCATION_LAST_MESSAGES,
+                    "max_prompt_tokens": RUN_MAX_PROMPT_TOKENS,
+                    "max_completion_tokens": RUN_MAX_COMPLETION_TOKENS,
+                    "summary_threshold": CONTEXT_SUMMARY_THRESHOLD,
+                    "summary_deletes_messages": CONTEXT_SUMMARY_DELETE_MESSAGES,
+                },
+                "threads": len(self._threads),
+                "summarized_threads": self._db.execute("SELECT COUNT(*) FROM summaries").fetchone()[0],
+                "assistants": {assistant_id: dict(totals) for assistant_id, totals in self._assistants.items()},
+            }
+
+
+# Presupuesto de contexto compartido por el proceso
+context_budget = ContextBudget(USAGE_MAX_THREADS, CONTEXT_SUMMARY_DB_PATH)
@@ -1,13 +1,7 @@
-from openai import OpenAI
-import os
 from assistant_instructions import instructions
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-OPENAI_API_KEY = os.environ['OPEN_AI_API_KEY']
-
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Shared client (loads the environment variables)
+from instrumentation import log
+from openai_client import client
 
 
 # Function to create a vector store and upload files
@@ -77,7 +71,7 @@ def create_or_update_assistant(file_paths):
                     "vector_store_ids": [vector_store_id]
                 }
             })
-        print(f"Updated existing assistant: {assistant_name}")
+        log("assistant.updated", name=assistant_name)
         return updated_assistant
     else:
         # Create a new assistant
@@ -91,5 +85,5 @@ def create_or_update_assistant(file_paths):
                                                             "vector_store_ids": [vector_store_id]
                                                             }
                                                         })
-        print(f"Created new assistant: {assistant_name}")
+        log("assistant.created", name=assistant_name)
         return new_assistant
\ No newline at end of file
@@ -1,5 +1,7 @@
 import os
-import requests 
+from document_model import document_store
+from compile_scheduler import compile_scheduler
+from instrumentation import log, span
 # Cargar la plantilla LaTeX
 
 
@@ -10,7 +12,7 @@ def load_template(filename):
         with open(filename, "r", encoding='utf-8') as file:
             return file.read()
     except FileNotFoundError:
-        print(f"{filename} no encontrado. Cargando archivo predeterminado.")
+        log("template.fallback", filename=filename, fallback=fallback_file)
         with open(fallback_file, "r", encoding='utf-8') as fallback:
             return fallback.read()
 
@@ -19,9 +21,9 @@ def load_template(filename):
 def edit_section(template: str, section: str, content: str) -> str:
     placeholder = f"<<{section}>>"
     if placeholder not in template:
-        print(f"[edit_section] ❗ MARCADOR NO ENCONTRADO: {placeholder}")
+        log("edit_section.not_found", section=section)
     else:
-        print(f"[edit_section] ✅ Reemplazando {placeholder}")
+        log("edit_section.replaced", section=section)
     return template.replace(placeholder, content)
 
 
@@ -32,51 +34,111 @@ def save_updated_document(updated_template: str, output_file: str):
 
 
 
-def update_latex_section(section_key: str, new_content: str, thread_id: str):
+def request_compile(thread_id: str):
     """
-    Inserta el contenido debajo del marcador <<SECTION_KEY>>, 
-    y elimina cualquier contenido previamente insertado automáticamente.
+    Encola la compilación del documento del thread en el scheduler de fondo
+    (sin pasar por HTTP ni ocupar un worker del servidor).
     """
-    file_path = f"generatedDocuments/{thread_id}.tex"
-    marker = f"<<{section_key}>>"
-    start_tag = f"% --- start:{section_key} ---"
-    end_tag = f"% --- end:{section_key} ---"
-
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-
-        updated_lines = []
-        skip = False
-        for line in lines:
-            if start_tag in line:
-                skip = True
-                continue
-            if end_tag in line:
-                skip = False
-                continue
-            if skip:
-                continue
-            updated_lines.append(line)
-            if marker in line:
-                new_content = sanitize_latex_input(new_content)
-                updated_lines.append(f"{start_tag}\n")
-                updated_lines.append(new_content.strip() + "\n")
-                updated_lines.append(f"{end_tag}\n")
-                print(f"[edit_section] ✅ Reemplazado marcador {marker}")
-
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.writelines(updated_lines)
-
-        requests.post("http://localhost:5000/compile", json={"thread_id": thread_id})
-        print(f"[compile] ✅ Compilación solicitada para thread_id={thread_id}")
+        compile_scheduler.submit(thread_id)
+        log("compile.requested", thread_id=thread_id)
+    except Exception as e:
+        log("compile.request_error", thread_id=thread_id, error=str(e))
+
 
+def apply_section_updates(thread_id: str, updates: dict, compile: bool = True, expected: dict = None) -> list:
+    """
+    Aplica todas las secciones de 'updates' ({SECTION_KEY: contenido}) en una
+    única lectura-modificación-escritura atómica y solicita una sola
+    compilación para todo el lote, sólo si se aplicó alguna. Devuelve las
+    secciones aplicadas; si la escritura falla, lanza la excepción. Con
+    'expected', sólo se aplican las secciones que no cambiaron (ver
+    DocumentStore.update_sections).
+    """
+    if not updates:
+        return []
+
+    sanitized = {
+        section_key: sanitize_latex_input(new_content).strip()
+        for section_key, new_content in updates.items()
+    }
+    try:
+        with span("disk.write_document", thread_id=thread_id, sections=len(sanitized)):
+            applied = document_store.update_sections(thread_id, sanitized, expected)
     except Exception as e:
-        print(f"[edit_section] ⚠️ Error actualizando sección {section_key}: {e}")
-        print(f"[compile] ❌ Error al solicitar compilación: {e}")
+        log("edit_section.write_error", thread_id=thread_id, sections=list(updates), error=str(e))
+        raise
+    log("edit_section.applied", thread_id=thread_id, sections=sorted(applied),
+        not_applied=[section_key for section_key in updates if section_key not in applied])
+
+    if compile and applied:
+        request_compile(thread_id)
+    return applied
 
 
+class SectionBatch:
+    """
+    Acumula cambios de sección y los aplica de una vez al salir del bloque:
+
+        with batch_edit(thread_id) as batch:
+            batch.set("TITLE", "...")
+            batch.set("PURPOSE", "...")
+        batch.result("TITLE")  # {"success": True, "section": "TITLE"} o {"error": ...}
+
+    Si el bloque lanza una excepción no se escribe nada. Si una sección se
+    modifica varias veces, gana el último contenido. Si la escritura falla,
+    el error queda en 'error' y en el resultado de cada sección. Con
+    'expected', sólo se escriben las secciones cuyo contenido sigue siendo el
+    esperado.
+    """
 
+    def __init__(self, thread_id: str, compile: bool = True, expected: dict = None):
+        self.thread_id = thread_id
+        self.compile = compile
+        self.expected = expected
+        self.updates = {}
+        self.applied = []
+        self.error = None
+
+    def set(self, section_key: str, new_content: str):
+        self.updates[section_key] = new_content
+
+    def result(self, section_key: str) -> dict:
+        """
+        Resultado real de una sección del lote (después de salir del bloque).
+        """
+        if self.error is not None:
+            return {"error": f"Could not write section {section_key}: {self.error}"}
+        if section_key in self.applied:
+            return {"success": True, "section": section_key}
+        return {"error": f"Section marker <<{section_key}>> not found in the document"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                self.applied = apply_section_updates(self.thread_id, self.updates, compile=self.compile,
+                                                     expected=self.expected)
+            except Exception as e:
+                self.error = e
+        return False
+
+
+def batch_edit(thread_id: str, compile: bool = True, expected: dict = None) -> SectionBatch:
+    return SectionBatch(thread_id, compile=compile, expected=expected)
+
+
+def update_latex_section(section_key: str, new_content: str, thread_id: str) -> dict:
+    """
+    Inserta el contenido debajo del marcador <<SECTION_KEY>>, 
+    y elimina cualquier contenido previamente insertado automáticamente.
+    Devuelve el resultado de la sección (ver SectionBatch.result).
+    """
+    with batch_edit(thread_id) as batch:
+        batch.set(section_key, new_content)
+    return batch.result(section_key)
 
 
 def sanitize_latex_input(text: str) -> str:
@@ -0,0 +1,353 @@
+import collections
+import hashlib
+import itertools
+import os
+import re
+import tempfile
+import threading
+import time
+
+# Documentos parseados que se mantienen en memoria (LRU por thread_id)
+DOCUMENT_CACHE_SIZE = int(os.environ.get('DOCUMENT_CACHE_SIZE', '256'))
+# Cada cuántos segundos una espera de wait_for_version vuelve a mirar el archivo
+# en disco (las ediciones de otros procesos no la despiertan)
+DOCUMENT_WAIT_RECHECK_SECONDS = float(os.environ.get('DOCUMENT_WAIT_RECHECK_SECONDS', '1'))
+
+GENERATED_DOCUMENTS_DIR = "generatedDocuments"
+
+_MARKER_RE = re.compile(r"<<([A-Z0-9_]+)>>")
+_START_RE = re.compile(r"^\s*% --- start:([A-Z0-9_]+) ---\s*$")
+_END_RE = re.compile(r"^\s*% --- end:([A-Z0-9_]+) ---\s*$")
+
+# Contador de versiones común a todos los documentos. Arranca en la hora actual
+# (ms) para que las versiones sigan creciendo aunque se reinicie el proceso.
+_version_counter = itertools.count(int(time.time() * 1000))
+
+
+def document_path(thread_id: str) -> str:
+    return f"{GENERATED_DOCUMENTS_DIR}/{thread_id}.tex"
+
+
+class DocumentChanged(Exception):
+    """
+    El archivo ya no es el que se leyó: write_atomic no lo reemplaza.
+    """
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_atomic(file_path: str, text: str, expected_hash: str = None):
+    """
+    Escribe el archivo a través de un temporal en el mismo directorio y lo
+    renombra, para que nunca se lea un .tex a medio escribir. Con
+    'expected_hash' (content_hash del archivo tal como se leyó), justo antes
+    del rename se comprueba que el archivo no ha cambiado; si cambió, se
+    descarta el temporal y se lanza DocumentChanged.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".tex")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+        if expected_hash is not None:
+            with open(file_path, 'rb') as file:
+                if content_hash(file.read()) != expected_hash:
+                    raise DocumentChanged(file_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def iter_sections(lines):
+    """
+    Recorre un .tex línea a línea (p. ej. el archivo abierto, sin leerlo
+    entero) y devuelve (KEY, contenido) de cada bloque '% --- start:KEY ---'
+    ... '% --- end:KEY ---' cerrado, en orden de aparición.
+    """
+    key = None
+    content = []
+    for line in lines:
+        if key is None:
+            start = _START_RE.match(line)
+            if start:
+                key = start.group(1)
+                content = []
+            continue
+        end = _END_RE.match(line)
+        if end and end.group(1) == key:
+            yield key, "".join(content)
+            key = None
+        else:
+            content.append(line)
+
+
+class _Slot:
+    """
+    Hueco de una sección: el contenido entre '% --- start:KEY ---' y
+    '% --- end:KEY ---'. 'present' indica si las etiquetas existen en el texto.
+    """
+    __slots__ = ("key", "content", "present")
+
+    def __init__(self, key: str, content: str = "", present: bool = False):
+        self.key = key
+        self.content = content
+        self.present = present
+
+    def render(self) -> str:
+        if not self.present:
+            return ""
+        return f"% --- start:{self.key} ---\n{self.content}% --- end:{self.key} ---\n"
+
+
+class LatexDocument:
+    """
+    Documento .tex parseado una sola vez en una lista ordenada de segmentos
+    estáticos (texto) y huecos de sección (_Slot), con acceso O(1) por clave.
+    Editar una sección sólo toca su hueco; render() es un único join.
+    """
+
+    def __init__(self, segments: list, slots: dict):
+        self.segments = segments
+        self.slots = slots  # clave -> [_Slot, ...] (normalmente uno)
+        self._rendered = None
+
+    @classmethod
+    def parse(cls, text: str) -> "LatexDocument":
+        segments = []
+        slots = {}
+        static = []
+        open_slot = None
+        open_lines = []
+
+        def flush_static():
+            if static:
+                segments.append("".join(static))
+                static.clear()
+
+        for line in text.splitlines(keepends=True):
+            if open_slot is not None:
+                end = _END_RE.match(line)
+                if end and end.group(1) == open_slot.key:
+                    open_slot.content = "".join(open_lines)
+                    open_slot.present = True
+                    open_slot = None
+                    open_lines = []
+                else:
+                    open_lines.append(line)
+                continue
+
+            start = _START_RE.match(line)
+            if start:
+                key = start.group(1)
+                # Las etiquetas rellenan el hueco creado por el marcador que las precede;
+                # si no hay marcador, el bloque queda como hueco propio en su posición.
+                pending = [slot for slot in slots.get(key, []) if not slot.present]
+                if pending:
+                    open_slot = pending[-1]
+                else:
+                    flush_static()
+                    open_slot = _Slot(key)
+                    segments.append(open_slot)
+                    slots.setdefault(key, []).append(open_slot)
+                continue
+
+            static.append(line)
+            markers = _MARKER_RE.findall(line)
+            if markers:
+                flush_static()
+                for key in markers:
+                    slot = _Slot(key)
+                    segments.append(slot)
+                    slots.setdefault(key, []).append(slot)
+
+        if open_slot is not None:
+            # Bloque sin etiqueta de cierre: lo conservamos como texto
+            static.append(f"% --- start:{open_slot.key} ---\n")
+            static.extend(open_lines)
+        flush_static()
+        return cls(segments, slots)
+
+    def sections(self) -> list:
+        return list(self.slots)
+
+    def get_section(self, key: str):
+        slots = self.slots.get(key)
+        if not slots:
+            return None
+        return slots[0].content
+
+    def set_section(self, key: str, content: str) -> bool:
+        """
+        Sustituye el contenido de la sección. Devuelve False si el documento
+        no tiene el marcador <<KEY>>.
+        """
+        slots = self.slots.get(key)
+        if not slots:
+            return False
+        if content and not content.endswith("\n"):
+            content += "\n"
+        for slot in slots:
+            slot.content = content
+            slot.present = True
+        self._rendered = None
+        return True
+
+    def render(self) -> str:
+        if self._rendered is None:
+            self._rendered = "".join(
+                segment if isinstance(segment, str) else segment.render()
+                for segment in self.segments
+            )
+        return self._rendered
+
+
+class _Versions:
+    """
+    Versión del documento y versión en la que cambió cada sección. 'base' es
+    la versión con la que se cargó el documento: quien pida cambios desde
+    antes de 'base' recibe todas las secciones.
+    """
+
+    def __init__(self, sections: list):
+        self.base = next(_version_counter)
+        self.version = self.base
+        self.sections = {key: self.base for key in sections}
+
+
+class DocumentStore:
+    """
+    LRU de documentos parseados por thread_id con escritura directa a disco
+    (write-through). Las lecturas se sirven desde memoria; sólo se vuelve a
+    parsear si el archivo cambió en disco (p. ej. lo editó otro proceso).
+    Cada documento lleva un número de versión que crece con cada edición, para
+    enviar al frontend sólo las secciones que cambiaron.
+    """
+
+    def __init__(self, max_documents: int):
+        self.max_documents = max_documents
+        self._documents = collections.OrderedDict()  # thread_id -> (LatexDocument, (mtime_ns, size), _Versions)
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+
+    @staticmethod
+    def _signature(path: str):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, thread_id: str) -> LatexDocument:
+        """
+        Devuelve el documento parseado. Lanza FileNotFoundError si no existe.
+        """
+        return self._entry(thread_id)[0]
+
+    def _entry(self, thread_id: str) -> tuple:
+        path = document_path(thread_id)
+        with self._lock:
+            signature = self._signature(path)
+            cached = self._documents.get(thread_id)
+            if cached is not None and cached[1] == signature:
+                self._documents.move_to_end(thread_id)
+                return cached
+
+            with open(path, 'r', encoding='utf-8') as file:
+                document = LatexDocument.parse(file.read())
+            # Documento nuevo o cambiado fuera de este proceso: versión nueva
+            return self._remember(thread_id, document, signature, _Versions(document.sections()))
+
+    def read_text(self, thread_id: str) -> str:
+        return self.get(thread_id).render()
+
+    def read_versioned(self, thread_id: str) -> tuple:
+        """
+        Devuelve (texto completo, versión).
+        """
+        with self._lock:
+            document, _, versions = self._entry(thread_id)
+            return document.render(), versions.version
+
+    def changes_since(self, thread_id: str, since: int) -> dict:
+        """
+        Secciones que cambiaron después de la versión 'since':
+        {"version", "full", "sections": {SECTION_KEY: contenido}}. Si 'since'
+        no corresponde a esta carga del documento, devuelve todas ('full').
+        """
+        with self._lock:
+            document, _, versions = self._entry(thread_id)
+            full = since < versions.base or since > versions.version
+            keys = document.sections() if full else [
+                key for key, version in versions.sections.items() if version > since
+            ]
+            return {
+                "version": versions.version,
+                "full": full,
+                "sections": {key: document.get_section(key) for key in keys},
+            }
+
+    def wait_for_version(self, thread_id: str, since: int, timeout: float) -> dict:
+        """
+        Como changes_since, pero si no hay cambios espera (como mucho
+        'timeout' segundos) a la siguiente edición. Las de este proceso la
+        despiertan al momento; las de otros (otro worker, template_migration,
+        batch_export) se detectan al volver a mirar el archivo, cada
+        DOCUMENT_WAIT_RECHECK_SECONDS.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                changes = self.changes_since(thread_id, since)
+                remaining = deadline - time.monotonic()
+                if changes["sections"] or changes["version"] != since or remaining <= 0:
+                    return changes
+                self._changed.wait(timeout=min(remaining, DOCUMENT_WAIT_RECHECK_SECONDS))
+
+    def update_sections(self, thread_id: str, updates: dict, expected: dict = None) -> list:
+        """
+        Aplica {SECTION_KEY: contenido} en memoria y escribe el documento una
+        sola vez de forma atómica. Devuelve las secciones aplicadas. Si la
+        escritura falla, lanza la excepción y el documento en memoria se
+        descarta (la siguiente lectura es la del disco). Con 'expected'
+        ({SECTION_KEY: contenido}), una sección sólo se aplica si su contenido
+        sigue siendo ese (nadie la editó mientras tanto).
+        """
+        path = document_path(thread_id)
+        with self._lock:
+            document, _, versions = self._entry(thread_id)
+            if expected is not None:
+                updates = {key: content for key, content in updates.items()
+                           if key in expected and document.get_section(key) == expected[key]}
+            previous = {key: document.get_section(key) for key in updates}
+            applied = [key for key, content in updates.items() if document.set_section(key, content)]
+            if applied:
+                try:
+                    write_atomic(path, document.render())
+                except BaseException:
+                    # La copia en memoria ya tiene los cambios y el disco no: se vuelve a leer del disco
+                    self._documents.pop(thread_id, None)
+                    raise
+                changed = [key for key in applied if document.get_section(key) != previous[key]]
+                if changed:
+                    versions.version = next(_version_counter)
+                    for key in changed:
+                        versions.sections[key] = versions.version
+                    self._changed.notify_all()
+                self._remember(thread_id, document, self._signature(path), versions)
+            return applied
+
+    def invalidate(self, thread_id: str):
+        with self._lock:
+            self._documents.pop(thread_id, None)
+
+    def _remember(self, thread_id: str, document: LatexDocument, signature, versions: _Versions) -> tuple:
+        entry = self._documents[thread_id] = (document, signature, versions)
+        self._documents.move_to_end(thread_id)
+        while len(self._documents) > self.max_documents:
+            self._documents.popitem(last=False)
+        return entry
+
+
+# Almacén compartido por el proceso
+document_store = DocumentStore(DOCUMENT_CACHE_SIZE)
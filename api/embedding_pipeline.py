@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from instrumentation import log
+from upload_streaming import open_source, source_sha256
+
+# Modo de recuperación: 'openai' (vector stores alojados) o 'local' (FAISS por sesión)
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'openai')
+# Embedder para el modo local: 'hashing' (determinista, sin red) u 'openai'
+EMBEDDER = os.environ.get('EMBEDDER', 'hashing')
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'text-embedding-3-small')
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '1000'))
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '200'))
+SEARCH_TOP_K = int(os.environ.get('SEARCH_TOP_K', '5'))
+# Carpeta donde se guarda el índice de cada sesión (lo comparten los procesos y sobrevive a reinicios)
+LOCAL_INDEX_DIR = os.environ.get('LOCAL_INDEX_DIR', 'localIndexes')
+
+LOCAL_SESSION_PREFIX = "local_"
+_LOCAL_SESSION_RE = re.compile(rf"^{LOCAL_SESSION_PREFIX}[0-9a-f]{{32}}$")
+
+# Function tool que sustituye a 'file_search' en modo local
+SEARCH_DOCUMENTS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "search_documents",
+        "description": "Semantic search over the documents uploaded in this session (template, instructions and user files). Returns the most relevant fragments.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "Query": {"type": "string", "description": "What to look for in the documents."}
+            },
+            "required": ["Query"]
+        }
+    }
+}
+
+LOCAL_RETRIEVAL_INSTRUCTIONS = (
+    "\nEn esta sesión los documentos se consultan con la herramienta 'search_documents' "
+    "(en lugar de 'file_search'): úsala con una consulta concreta cada vez que necesites "
+    "información de los archivos."
+)
+
+
+def is_local_session(vector_store_id: str) -> bool:
+    return bool(vector_store_id) and vector_store_id.startswith(LOCAL_SESSION_PREFIX)
+
+
+def new_local_session_id() -> str:
+    return f"{LOCAL_SESSION_PREFIX}{uuid.uuid4().hex}"
+
+
+def read_document_text(filename: str, source) -> str:
+    """
+    Extrae el texto de un archivo subido (PDF con PyPDF2, el resto como texto).
+    'source' es una ruta o un SpooledUpload.
+    """
+    with open_source(source) as f:
+        if filename.lower().endswith(".pdf"):
+            from PyPDF2 import PdfReader  # import diferido: sólo hace falta en modo local
+            reader = PdfReader(f)
+            return "\n".join(page.extract_text() or "" for page in reader.pages)
+        return f.read().decode('utf-8', errors='replace')
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list:
+    """
+    Trocea el texto en fragmentos de ~chunk_size caracteres con solapamiento,
+    cortando preferentemente en saltos de párrafo o de línea.
+    """
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = max(text.rfind("\n\n", start, end), text.rfind("\n", start, end))
+            if cut > start + chunk_size // 2:
+                end = cut
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class HashingEmbedder:
+    """
+    Embedder local y determinista: bolsa de palabras con hashing, normalizada.
+    No necesita red; sirve para tests y para despliegues sin coste de embeddings.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def embed(self, texts: list):
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for token in re.findall(r"\w+", text.lower()):
+                digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                vectors[row, bucket] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class OpenAIEmbedder:
+    """
+    Embeddings de OpenAI (normalizados para usar producto interno como coseno).
+    """
+
+    def __init__(self, client, model: str = EMBEDDING_MODEL, batch_size: int = 64):
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+        self.dim = None
+
+    def embed(self, texts: list):
+        import numpy as np
+        rows = []
+        for i in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=texts[i:i + self.batch_size])
+            rows.extend(item.embedding for item in response.data)
+        vectors = np.asarray(rows, dtype="float32")
+        self.dim = vectors.shape[1]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def get_embedder(client=None):
+    if EMBEDDER == 'openai':
+        return OpenAIEmbedder(client)
+    return HashingEmbedder()
+
+
+class _SessionIndex:
+    def __init__(self):
+        self.index = None
+        self.chunks = []  # (filename, texto)
+        self.signature = None  # (mtime_ns, size) del índice en disco del que se cargó
+
+    def add(self, vectors, chunks: list):
+        import faiss  # import diferido: faiss es pesado y sólo hace falta en modo local
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(vectors.shape[1])
+        self.index.add(vectors)
+        self.chunks.extend(chunks)
+
+
+class LocalRetrieval:
+    """
+    Índices FAISS, uno por sesión, en memoria y guardados en disco
+    (index_dir/<sesión>.faiss y sus fragmentos en <sesión>.json): tras un
+    reinicio, o desde otro proceso de la API, el índice se vuelve a cargar
+    del disco, y se recarga si otro proceso lo amplió. Los archivos
+    compartidos (plantilla, instructivo) se trocean y embeben una sola vez por
+    contenido y se copian al índice de cada sesión. Registra la latencia de
+    ingesta y de consulta.
+    """
+
+    def __init__(self, embedder, index_dir: str = LOCAL_INDEX_DIR):
+        self.embedder = embedder
+        self.index_dir = index_dir
+        self._sessions = {}
+        self._shared = {}  # sha256 -> (chunks, vectors)
+        self._lock = threading.Lock()
+        self._latency = {
+            "ingest": {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+            "query": {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+        }
+
+    def _record(self, kind: str, seconds: float):
+        with self._lock:
+            stats = self._latency[kind]
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def _paths(self, session_id: str):
+        if not _LOCAL_SESSION_RE.match(session_id or ""):
+            raise ValueError(f"Invalid local session id: {session_id!r}")
+        base = os.path.join(self.index_dir, session_id)
+        return base + ".faiss", base + ".json"
+
+    def _session(self, session_id: str):
+        """
+        Índice de la sesión (con el lock tomado): el de memoria si sigue al
+        día con el disco, si no el del disco. None si la sesión no tiene índice.
+        """
+        index_path, chunks_path = self._paths(session_id)
+        cached = self._sessions.get(session_id)
+        try:
+            stat = os.stat(index_path)
+        except FileNotFoundError:
+            return cached
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if cached is not None and cached.signature == signature:
+            return cached
+
+        import faiss
+        loaded = _SessionIndex()
+        with open(chunks_path, 'r', encoding='utf-8') as f:
+            loaded.chunks = [tuple(chunk) for chunk in json.load(f)]
+        loaded.index = faiss.read_index(index_path)
+        loaded.signature = signature
+        self._sessions[session_id] = loaded
+        return loaded
+
+    def _save(self, session_id: str, index: _SessionIndex):
+        """
+        Guarda el índice (con el lock tomado). Primero los fragmentos: quien
+        lea a la vez nunca ve un índice con ids que no estén en el .json.
+        """
+        import faiss
+        index_path, chunks_path = self._paths(session_id)
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(chunks_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(index.chunks, f, ensure_ascii=False)
+        os.replace(chunks_path + ".tmp", chunks_path)
+        faiss.write_index(index.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        stat = os.stat(index_path)
+        index.signature = (stat.st_mtime_ns, stat.st_size)
+
+    def _embed_file(self, filename: str, source, shared: bool):
+        if shared:
+            sha = source_sha256(source)
+            cached = self._shared.get(sha)
+            if cached is not None:
+                return cached
+        chunks = [(filename, chunk) for chunk in chunk_text(read_document_text(filename, source))]
+        vectors = self.embedder.embed([chunk for _, chunk in chunks]) if chunks else None
+        if shared:
+            self._shared[sha] = (chunks, vectors)
+        return chunks, vectors
+
+    def ingest_files(self, session_id: str, files: list, shared: bool = False) -> dict:
+        """
+        Indexa los archivos (lista de (filename, origen), con origen una ruta
+        o un SpooledUpload) en la sesión.
+        'shared' activa la reutilización de embeddings por contenido.
+        Devuelve un informe con tiempos y fallos, como file_ingestion.ingest_files.
+        """
+        started = time.perf_counter()
+        report = {"files": [], "file_ids": [], "failed": [], "chunks": 0}
+        for filename, source in files:
+            file_started = time.perf_counter()
+            try:
+                chunks, vectors = self._embed_file(filename, source, shared)
+                if chunks:
+                    with self._lock:
+                        index = self._session(session_id) or _SessionIndex()
+                        index.add(vectors, chunks)
+                        self._save(session_id, index)
+                        self._sessions[session_id] = index
+                report["chunks"] += len(chunks)
+                report["files"].append({"filename": filename, "chunks": len(chunks),
+                                        "index_seconds": round(time.perf_counter() - file_started, 3)})
+            except Exception as e:
+                report["failed"].append({"filename": filename, "stage": "indexing", "error": str(e)})
+                log("local_retrieval.index_error", filename=filename, error=str(e))
+        report["total_seconds"] = round(time.perf_counter() - started, 3)
+        self._record("ingest", report["total_seconds"])
+        return report
+
+    def search(self, session_id: str, query: str, k: int = SEARCH_TOP_K) -> list:
+        started = time.perf_counter()
+        try:
+            with self._lock:
+                index = self._session(session_id)
+        except Exception as e:
+            log("local_retrieval.load_error", session_id=session_id, error=str(e))
+            index = None
+        results = []
+        if index is not None and index.index is not None and index.index.ntotal:
+            vectors = self.embedder.embed([query])
+            scores, ids = index.index.search(vectors, min(k, index.index.ntotal))
+            for score, idx in zip(scores[0], ids[0]):
+                if idx < 0:
+                    continue
+                filename, text = index.chunks[idx]
+                results.append({"file": filename, "score": round(float(score), 4), "text": text})
+        self._record("query", time.perf_counter() - started)
+        return results
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            for path in self._paths(session_id):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            latency = {}
+            for kind, stats in self._latency.items():
+                latency[kind] = dict(stats)
+                latency[kind]["avg_seconds"] = (stats["total_seconds"] / stats["count"]) if stats["count"] else None
+            return {
+                "mode": RETRIEVAL_MODE,
+                "embedder": type(self.embedder).__name__,
+                "sessions": len(self._sessions),
+                "shared_files": len(self._shared),
+                "latency": latency,
+            }
+
+
+_local_retrieval = None
+_local_retrieval_lock = threading.Lock()
+
+
+def get_local_retrieval(client=None) -> LocalRetrieval:
+    """
+    Devuelve el motor local compartido (se crea al primer uso).
+    """
+    global _local_retrieval
+    with _local_retrieval_lock:
+        if _local_retrieval is None:
+            _local_retrieval = LocalRetrieval(get_embedder(client))
+        return _local_retrieval
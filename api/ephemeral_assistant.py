@@ -1,100 +1,162 @@
+import asyncio
 import os
-from openai import OpenAI
 from assistant_instructions import instructions  # Tus instrucciones base, si las tienes
-from dotenv import load_dotenv
-import shutil
-import threading
-
-# Cargamos las variables de entorno desde el archivo .env
-load_dotenv()
+from context_budget import context_budget
+from document_model import write_atomic
+from file_registry import file_registry
+from instrumentation import log
+from openai_client import client
+from text_preprocessing import upload_preprocessor
+from session_reaper import session_reaper
+from thread_history import thread_history
+from template_migration import new_document
+from embedding_pipeline import (
+    RETRIEVAL_MODE,
+    SEARCH_DOCUMENTS_TOOL,
+    LOCAL_RETRIEVAL_INSTRUCTIONS,
+    get_local_retrieval,
+    is_local_session,
+    new_local_session_id,
+)
 
 # Accedemos a las variables de entorno
-OPENAI_API_KEY = os.environ['OPEN_AI_API_KEY']
-UPLOADS_PATH = os.environ['UPLOADS_PATH']
 FILES_TO_UPLOAD_STRUCTURE_PATH = os.environ['FILES_TO_UPLOAD_STRUCTURE_PATH']
 FILES_TO_UPLOAD_STRUCTURE_COPY_TO_LOCAL = os.environ['FILES_TO_UPLOAD_STRUCTURE_COPY_TO_LOCAL'] == 'True'
 FILES_TO_UPLOAD_INSTRUCTIONS_PATH = os.environ['FILES_TO_UPLOAD_INSTRUCTIONS_PATH']
 FILES_TO_UPLOAD_INSTRUCTIONS_COPY_TO_LOCAL = os.environ['FILES_TO_UPLOAD_INSTRUCTIONS_COPY_TO_LOCAL'] == 'True'
 ASSISTANT_DURATION = os.environ['ASSISTANT_DURATION']
 
-# Creamos el cliente OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Archivos a subir, ahora con las rutas y copias basadas en las variables de entorno
+FILES_TO_UPLOAD = [
+    {
+        "path": FILES_TO_UPLOAD_STRUCTURE_PATH,
+        "copy_to_local": FILES_TO_UPLOAD_STRUCTURE_COPY_TO_LOCAL
+    },
+    {
+        "path": FILES_TO_UPLOAD_INSTRUCTIONS_PATH,
+        "copy_to_local": FILES_TO_UPLOAD_INSTRUCTIONS_COPY_TO_LOCAL
+    }
+]
 
-def start_ephemeral_conversation():
+MODIFY_DOCUMENT_TOOL = {
+    "type": "function", "function": {
+        "name": "modify_document",
+        "description": "Modify a LaTeX document section by replacing placeholder with given content.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "Section": {"type": "string"},
+                "Content": {"type": "string"}
+            },
+            "required": ["Section", "Content"]
+        }
+    }
+}
+
+
+def _index_templates_locally(vector_store_id: str):
+    get_local_retrieval(client).ingest_files(
+        vector_store_id,
+        [(os.path.basename(file_info["path"]), file_info["path"]) for file_info in FILES_TO_UPLOAD],
+        shared=True
+    )
+    log("session.local_index_created", vector_store_id=vector_store_id)
+
+
+def _attach_templates(vector_store_id: str):
+    # Asociamos los archivos al vector store, reutilizando los ya subidos si no cambiaron
+    try:
+        file_registry.attach(client, vector_store_id, [file_info["path"] for file_info in FILES_TO_UPLOAD])
+    except Exception as e:
+        log("session.attach_error", vector_store_id=vector_store_id, error=str(e))
+
+
+def _assistant_config(vector_store_id: str) -> dict:
+    """
+    Parámetros de assistants.create según el modo de recuperación.
     """
-    1) Crea un nuevo vector store.
+    if is_local_session(vector_store_id):
+        return {
+            "name": "EphemeralAssistant",
+            "instructions": instructions + LOCAL_RETRIEVAL_INSTRUCTIONS,
+            "model": "gpt-4o",
+            "tools": [SEARCH_DOCUMENTS_TOOL, MODIFY_DOCUMENT_TOOL],
+        }
+    return {
+        "name": "EphemeralAssistant",
+        "instructions": instructions,
+        "model": "gpt-4o",
+        "tools": [{"type": "file_search"}, MODIFY_DOCUMENT_TOOL],
+        "tool_resources": {
+            "file_search": {
+                "vector_store_ids": [vector_store_id]
+            }
+        },
+    }
+
+
+def create_ephemeral_resources():
+    """
+    1) Crea un nuevo vector store (o un índice local si RETRIEVAL_MODE=local).
     2) Crea un nuevo assistant que use ese vector store.
     3) Crea un nuevo hilo (thread).
     4) Devuelve (thread_id, assistant_id, vector_store_id).
+    No programa la eliminación ni copia el .tex: eso ocurre al activar la sesión.
     """
-    # (A) Creamos vector store
-    vs_response = client.beta.vector_stores.create(name="EphemeralStore")
-    vector_store_id = vs_response.id
-    print(f"[start_ephemeral_conversation] Created vector store: {vector_store_id}")
-
-    # Archivos a subir, ahora con las rutas y copias basadas en las variables de entorno
-    FILES_TO_UPLOAD = [
-        {
-            "path": FILES_TO_UPLOAD_STRUCTURE_PATH,
-            "copy_to_local": FILES_TO_UPLOAD_STRUCTURE_COPY_TO_LOCAL
-        },
-        {
-            "path": FILES_TO_UPLOAD_INSTRUCTIONS_PATH,
-            "copy_to_local": FILES_TO_UPLOAD_INSTRUCTIONS_COPY_TO_LOCAL
-        }
-    ]
-
-    # Subimos los archivos al vector store
-    for file_info in FILES_TO_UPLOAD:
-        path = file_info["path"]
-        try:
-            with open(path, "rb") as f:
-                file_response = client.files.create(file=f, purpose="assistants")
-                file_id = file_response.id
-                print(f"[start_ephemeral_conversation] Uploaded file {path} with ID: {file_id}")
-
-                client.beta.vector_stores.files.create(
-                    vector_store_id=vector_store_id,
-                    file_id=file_id
-                )
-                print(f"[start_ephemeral_conversation] Associated file to vector store")
-        except Exception as e:
-            print(f"[start_ephemeral_conversation] ERROR uploading file '{path}': {e}")
+    # (A) Creamos vector store (o un índice FAISS local en modo RETRIEVAL_MODE=local)
+    if RETRIEVAL_MODE == 'local':
+        vector_store_id = new_local_session_id()
+        _index_templates_locally(vector_store_id)
+    else:
+        vs_response = client.beta.vector_stores.create(name="EphemeralStore")
+        vector_store_id = vs_response.id
+        log("session.vector_store_created", vector_store_id=vector_store_id)
+        _attach_templates(vector_store_id)
 
     # (C) Creamos el assistant
-    new_assistant = client.beta.assistants.create(
-        name="EphemeralAssistant",
-        instructions=instructions,
-        model="gpt-4o",
-        tools=[{"type": "file_search"},
-               {"type": "function", "function": {
-                   "name": "modify_document",
-                   "description": "Modify a LaTeX document section by replacing placeholder with given content.",
-                   "parameters": {
-                       "type": "object",
-                       "properties": {
-                           "Section": {"type": "string"},
-                           "Content": {"type": "string"}
-                       },
-                       "required": ["Section", "Content"]
-                   }
-               }}],
-        tool_resources={
-            "file_search": {
-                "vector_store_ids": [vector_store_id]
-            }
-        }
-    )
+    new_assistant = client.beta.assistants.create(**_assistant_config(vector_store_id))
     assistant_id = new_assistant.id
 
     # Creamos el thread
     thread = client.beta.threads.create()
     thread_id = thread.id
-    print(f"[start_ephemeral_conversation] Created thread: {thread_id}")
+    log("session.thread_created", thread_id=thread_id)
+
+    return thread_id, assistant_id, vector_store_id
 
-    # (E) Programar la eliminación del asistente después de 2 horas (7200 segundos)
-    timer = threading.Timer(int(ASSISTANT_DURATION), end_ephemeral_conversation, [assistant_id, vector_store_id])
-    timer.start()
+
+async def create_ephemeral_resources_async(async_client):
+    """
+    Versión asíncrona de create_ephemeral_resources (AsyncOpenAI): el thread
+    se crea en paralelo con el vector store.
+    """
+    if RETRIEVAL_MODE == 'local':
+        vector_store_id = new_local_session_id()
+        _, thread = await asyncio.gather(
+            asyncio.to_thread(_index_templates_locally, vector_store_id),
+            async_client.beta.threads.create()
+        )
+    else:
+        vs_response, thread = await asyncio.gather(
+            async_client.beta.vector_stores.create(name="EphemeralStore"),
+            async_client.beta.threads.create()
+        )
+        vector_store_id = vs_response.id
+        log("session.vector_store_created", vector_store_id=vector_store_id)
+        await asyncio.to_thread(_attach_templates, vector_store_id)
+
+    new_assistant = await async_client.beta.assistants.create(**_assistant_config(vector_store_id))
+    log("session.thread_created", thread_id=thread.id)
+    return thread.id, new_assistant.id, vector_store_id
+
+
+def activate_ephemeral_conversation(thread_id: str, assistant_id: str, vector_store_id: str):
+    """
+    Programa la eliminación del asistente y copia localmente la plantilla .tex
+    para el thread. Se llama cuando la sesión se entrega al usuario.
+    """
+    # (E) Programar la eliminación de la sesión después de ASSISTANT_DURATION segundos
+    session_reaper.schedule(thread_id, assistant_id, vector_store_id, int(ASSISTANT_DURATION))
 
     # Copiamos localmente SOLO el .tex para edición en frontend
     try:
@@ -102,19 +164,79 @@ def start_ephemeral_conversation():
             tex_file = FILES_TO_UPLOAD[0]["path"]  # Asumimos que el .tex es el primero
             os.makedirs("generatedDocuments", exist_ok=True)
             local_copy = f"generatedDocuments/{thread_id}.tex"
-            shutil.copyfile(tex_file, local_copy)
-            print(f"[start_ephemeral_conversation] Copied LaTeX to: {local_copy}")
+            # Copia con la marca de la plantilla (ver template_migration)
+            with open(tex_file, 'r', encoding='utf-8') as f:
+                write_atomic(local_copy, new_document(f.read()))
+            log("session.document_created", thread_id=thread_id, path=local_copy)
     except Exception as e:
-        print(f"[start_ephemeral_conversation] ERROR copying LaTeX locally: {e}")
+        log("session.document_error", thread_id=thread_id, error=str(e))
+
 
+def start_ephemeral_conversation():
+    """
+    Crea los recursos efímeros y activa la sesión en el momento.
+    Devuelve (thread_id, assistant_id, vector_store_id).
+    """
+    thread_id, assistant_id, vector_store_id = create_ephemeral_resources()
+    activate_ephemeral_conversation(thread_id, assistant_id, vector_store_id)
     return thread_id, assistant_id, vector_store_id
 
-def end_ephemeral_conversation(assistant_id: str, vector_store_id: str):
+
+def _delete_remote(description: str, delete, **ids) -> bool:
+    """
+    Borra un recurso de OpenAI. Si ya no existe (p. ej. lo borró un intento
+    anterior de la limpieza) cuenta como borrado. Devuelve False si falló.
+    """
+    import openai
+    try:
+        delete(**ids)
+    except openai.NotFoundError:
+        log("session.cleanup_already_deleted", resource=description)
+    except Exception as e:
+        log("session.cleanup_error", resource=description, error=str(e))
+        return False
+    return True
+
+
+def end_ephemeral_conversation(assistant_id: str, vector_store_id: str, thread_id: str = None, file_ids=()):
     """
     Elimina el assistant y el vector store, para que no quede nada guardado.
+    Si se indican, también borra el thread y los archivos subidos en la sesión.
+    Los archivos compartidos (plantilla, instructivo) sólo se borran cuando
+    ningún otro vector store los usa y su contenido ya no es el actual.
+    Cada paso se intenta aunque falle otro, y lo que ya no existe cuenta como
+    borrado, así que se puede repetir: si algo falla, lanza RuntimeError al
+    final para que el reaper la reintente.
     """
+    failed = []
+
     # (1) Borramos el asistente
-    client.beta.assistants.delete(assistant_id=assistant_id)
+    if not _delete_remote(f"assistant {assistant_id}", client.beta.assistants.delete, assistant_id=assistant_id):
+        failed.append(f"assistant {assistant_id}")
+    upload_preprocessor.forget(vector_store_id)
+
+    # (2) Borramos el thread y los archivos subidos por el usuario
+    if thread_id:
+        if not _delete_remote(f"thread {thread_id}", client.beta.threads.delete, thread_id=thread_id):
+            failed.append(f"thread {thread_id}")
+        thread_history.forget(thread_id)
+        context_budget.forget(thread_id)
+    for file_id in file_ids:
+        if not _delete_remote(f"file {file_id}", client.files.delete, file_id=file_id):
+            failed.append(f"file {file_id}")
+
+    # En modo local no hay nada remoto que borrar: basta con soltar el índice
+    if is_local_session(vector_store_id):
+        get_local_retrieval(client).drop(vector_store_id)
+    # (3) Borramos el vector store
+    elif _delete_remote(f"vector store {vector_store_id}", client.beta.vector_stores.delete,
+                        vector_store_id=vector_store_id):
+        # (4) Borramos los archivos compartidos que ya nadie referencia
+        for file_id in file_registry.release(vector_store_id):
+            if _delete_remote(f"file {file_id}", client.files.delete, file_id=file_id):
+                log("session.shared_file_deleted", file_id=file_id)
+    else:
+        failed.append(f"vector store {vector_store_id}")
 
-    # (2) Borramos el vector store
-    client.beta.vector_stores.delete(vector_store_id=vector_store_id)
+    if failed:
+        raise RuntimeError(f"Could not delete {', '.join(failed)}")
@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import log, span
+from upload_streaming import open_source
+
+# Número máximo de subidas simultáneas a OpenAI
+INGESTION_MAX_WORKERS = int(os.environ.get('INGESTION_MAX_WORKERS', '4'))
+# Segundos máximos que esperamos a que el vector store termine de indexar
+INGESTION_INDEX_DEADLINE = float(os.environ.get('INGESTION_INDEX_DEADLINE', '30'))
+# Intervalo de consulta del estado del batch
+INGESTION_POLL_INTERVAL = float(os.environ.get('INGESTION_POLL_INTERVAL', '0.5'))
+
+
+def ingested_filenames(report: dict) -> set:
+    """
+    Nombres de los archivos del informe de ingesta (de OpenAI o del índice
+    local) que se subieron e indexaron sin error.
+    """
+    failed = {failure["filename"] for failure in report["failed"]}
+    if None in failed:
+        # Falló el batch entero
+        return set()
+    return {result["filename"] for result in report["files"]
+            if not result.get("error") and result["filename"] not in failed}
+
+
+def _new_report() -> dict:
+    return {
+        "files": [],
+        "file_ids": [],
+        "failed": [],
+        "batch_id": None,
+        "batch_status": None,
+        "timed_out": False,
+        "upload_seconds": 0.0,
+        "indexing_seconds": 0.0,
+        "total_seconds": 0.0,
+    }
+
+
+def _add_uploads(report: dict, results: list) -> dict:
+    """
+    Añade al informe el resultado de cada subida. Devuelve {file_id: resultado}
+    de las que se subieron.
+    """
+    by_file_id = {}
+    for result in results:
+        report["files"].append(result)
+        if result["file_id"]:
+            report["file_ids"].append(result["file_id"])
+            by_file_id[result["file_id"]] = result
+        else:
+            report["failed"].append({"filename": result["filename"], "stage": "upload", "error": result["error"]})
+    return by_file_id
+
+
+def _add_batch(report: dict, vector_store_id: str, batch, by_file_id: dict, vs_files: list):
+    """
+    Añade al informe el estado final del batch y, si no se completó, el
+    detalle por archivo ('vs_files') para el resumen de fallos.
+    """
+    report["batch_status"] = batch.status
+    report["timed_out"] = batch.status == "in_progress"
+    log("ingestion.batch", vector_store_id=vector_store_id, batch_id=batch.id, status=batch.status,
+        file_counts=batch.file_counts)
+    for vs_file in vs_files:
+        result = by_file_id.get(vs_file.id)
+        if result is None:
+            continue
+        result["index_status"] = vs_file.status
+        if vs_file.status == "failed":
+            error = vs_file.last_error.message if vs_file.last_error else "indexing failed"
+            report["failed"].append({"filename": result["filename"], "stage": "indexing", "error": error})
+
+
+def _add_batch_error(report: dict, vector_store_id: str, error: Exception):
+    report["batch_status"] = "error"
+    report["failed"].append({"filename": None, "stage": "batch", "error": str(error)})
+    log("ingestion.batch_error", vector_store_id=vector_store_id, error=str(error))
+
+
+def _upload_one(client, filename: str, source) -> dict:
+    started = time.perf_counter()
+    result = {"filename": filename, "file_id": None, "error": None}
+    try:
+        with span("openai.files.create"), open_source(source) as f:
+            result["file_id"] = client.files.create(file=(filename, f), purpose="assistants").id
+        log("ingestion.uploaded", filename=filename, file_id=result["file_id"])
+    except Exception as e:
+        result["error"] = str(e)
+        log("ingestion.upload_error", filename=filename, error=str(e))
+    result["upload_seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _wait_for_batch(client, vector_store_id: str, batch_id: str, deadline: float):
+    """
+    Consulta el batch hasta que deja de estar 'in_progress' o vence el plazo.
+    """
+    batch = client.beta.vector_stores.file_batches.retrieve(vector_store_id=vector_store_id, batch_id=batch_id)
+    while batch.status == "in_progress" and time.monotonic() < deadline:
+        time.sleep(INGESTION_POLL_INTERVAL)
+        batch = client.beta.vector_stores.file_batches.retrieve(vector_store_id=vector_store_id, batch_id=batch_id)
+    return batch
+
+
+def ingest_files(client, vector_store_id: str, files: list, max_workers: int = None,
+                 index_deadline: float = None) -> dict:
+    """
+    Sube los archivos en paralelo (pool acotado), los registra en el vector store
+    con un único file batch y espera a que terminen de indexarse antes de
+    devolver, con un plazo máximo.
+
+    'files' es una lista de (filename, origen), con origen una ruta o un
+    SpooledUpload (se envía directamente desde el buffer). Devuelve un informe
+    con tiempos por archivo, los file IDs subidos y el resumen de fallos.
+    """
+    max_workers = max_workers or INGESTION_MAX_WORKERS
+    index_deadline = INGESTION_INDEX_DEADLINE if index_deadline is None else index_deadline
+    started = time.perf_counter()
+
+    report = _new_report()
+    if not files:
+        return report
+
+    # (1) Subidas concurrentes (cada una con el contexto de la petición, para la traza)
+    contexts = [contextvars.copy_context() for _ in files]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+        results = list(executor.map(lambda context, item: context.run(_upload_one, client, *item), contexts, files))
+    report["upload_seconds"] = round(time.perf_counter() - started, 3)
+
+    by_file_id = _add_uploads(report, results)
+    if not report["file_ids"]:
+        report["total_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    # (2) Un único batch para todo el lote y espera de indexación
+    indexing_started = time.perf_counter()
+    try:
+        batch = client.beta.vector_stores.file_batches.create(
+            vector_store_id=vector_store_id,
+            file_ids=report["file_ids"]
+        )
+        report["batch_id"] = batch.id
+        with span("openai.vector_store.indexing", files=len(report["file_ids"])):
+            batch = _wait_for_batch(client, vector_store_id, batch.id, time.monotonic() + index_deadline)
+        vs_files = [] if batch.status == "completed" else list(
+            client.beta.vector_stores.file_batches.list_files(vector_store_id=vector_store_id, batch_id=batch.id))
+        _add_batch(report, vector_store_id, batch, by_file_id, vs_files)
+    except Exception as e:
+        _add_batch_error(report, vector_store_id, e)
+
+    report["indexing_seconds"] = round(time.perf_counter() - indexing_started, 3)
+    report["total_seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+async def _upload_one_async(async_client, semaphore, filename: str, source) -> dict:
+    async with semaphore:
+        started = time.perf_counter()
+        result = {"filename": filename, "file_id": None, "error": None}
+        try:
+            with span("openai.files.create"), open_source(source) as f:
+                result["file_id"] = (await async_client.files.create(file=(filename, f), purpose="assistants")).id
+            log("ingestion.uploaded", filename=filename, file_id=result["file_id"])
+        except Exception as e:
+            result["error"] = str(e)
+            log("ingestion.upload_error", filename=filename, error=str(e))
+        result["upload_seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+
+async def ingest_files_async(async_client, vector_store_id: str, files: list, max_workers: int = None,
+                             index_deadline: float = None) -> dict:
+    """
+    Versión asíncrona de ingest_files (AsyncOpenAI): mismas etapas y mismo
+    informe, sin ocupar un hilo mientras se espera a la red.
+    """
+    max_workers = max_workers or INGESTION_MAX_WORKERS
+    index_deadline = INGESTION_INDEX_DEADLINE if index_deadline is None else index_deadline
+    started = time.perf_counter()
+
+    report = _new_report()
+    if not files:
+        return report
+
+    semaphore = asyncio.Semaphore(max_workers)
+    results = await asyncio.gather(*(_upload_one_async(async_client, semaphore, *item) for item in files))
+    report["upload_seconds"] = round(time.perf_counter() - started, 3)
+
+    by_file_id = _add_uploads(report, results)
+    if not report["file_ids"]:
+        report["total_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    indexing_started = time.perf_counter()
+    try:
+        batches = async_client.beta.vector_stores.file_batches
+        batch = await batches.create(vector_store_id=vector_store_id, file_ids=report["file_ids"])
+        report["batch_id"] = batch.id
+        deadline = time.monotonic() + index_deadline
+        with span("openai.vector_store.indexing", files=len(report["file_ids"])):
+            while batch.status == "in_progress" and time.monotonic() < deadline:
+                await asyncio.sleep(INGESTION_POLL_INTERVAL)
+                batch = await batches.retrieve(vector_store_id=vector_store_id, batch_id=batch.id)
+        vs_files = [] if batch.status == "completed" else [
+            vs_file async for vs_file in batches.list_files(vector_store_id=vector_store_id, batch_id=batch.id)]
+        _add_batch(report, vector_store_id, batch, by_file_id, vs_files)
+    except Exception as e:
+        _add_batch_error(report, vector_store_id, e)
+
+    report["indexing_seconds"] = round(time.perf_counter() - indexing_started, 3)
+    report["total_seconds"] = round(time.perf_counter() - started, 3)
+    return report
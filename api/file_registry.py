@@ -0,0 +1,222 @@
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+
+from instrumentation import log
+
+# Registro persistente (SQLite, compartido por los procesos de la API) de
+# archivos subidos a OpenAI, indexado por SHA-256
+FILE_REGISTRY_PATH = os.environ.get('FILE_REGISTRY_PATH', 'file_registry.db')
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_of_file(path: str) -> str:
+    """
+    Calcula el SHA-256 de un archivo leyéndolo por bloques.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileRegistry:
+    """
+    Reutiliza los file IDs de OpenAI para archivos cuyo contenido no ha cambiado
+    (plantilla .tex e instructivo .md) y cuenta cuántos vector stores usan cada
+    uno, para saber cuándo un archivo compartido puede borrarse de verdad.
+
+    Tablas (SQLite, así varios workers comparten el registro sin pisarse):
+      - files:              sha256 -> file_id, path, size, refs, current
+      - paths:              ruta -> sha256, size, mtime_ns  (evita re-hashear si no cambió)
+      - vector_store_files: (vector_store_id, sha256) por cada archivo asociado
+    Las subidas y el file batch se hacen fuera de las transacciones.
+    """
+
+    def __init__(self, registry_path: str):
+        self.registry_path = registry_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(registry_path, timeout=30, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                sha256 TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                refs INTEGER NOT NULL DEFAULT 0,
+                current INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE TABLE IF NOT EXISTS paths (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS vector_store_files (
+                vector_store_id TEXT NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS vector_store_files_by_store ON vector_store_files (vector_store_id);
+        """)
+        self._db.commit()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        Transacción de escritura: bloquea la base de datos también frente a
+        otros procesos hasta el commit.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._db.commit()
+
+    def _current_sha(self, path: str) -> str:
+        """
+        Devuelve el hash actual del archivo en disco. Si la ruta apuntaba a otro
+        contenido, invalida la entrada anterior.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            known = self._db.execute("SELECT sha256, size, mtime_ns FROM paths WHERE path = ?", (path,)).fetchone()
+        if known and known[1] == stat.st_size and known[2] == stat.st_mtime_ns:
+            return known[0]
+
+        sha = sha256_of_file(path)
+        with self._transaction() as db:
+            if known and known[0] != sha:
+                db.execute("UPDATE files SET current = 0 WHERE sha256 = ?", (known[0],))
+                log("file_registry.invalidated", path=path, sha256=known[0][:12])
+            db.execute("INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)",
+                       (path, sha, stat.st_size, stat.st_mtime_ns))
+        return sha
+
+    def get_or_upload(self, client, path: str) -> str:
+        """
+        Devuelve el file ID de OpenAI para 'path', subiéndolo sólo si su
+        contenido no está registrado todavía.
+        """
+        return self._get_or_upload(client, path)[1]
+
+    def _get_or_upload(self, client, path: str):
+        """
+        (sha256, file_id) del contenido actual de 'path'.
+        """
+        sha = self._current_sha(path)
+        with self._lock:
+            entry = self._db.execute("SELECT file_id, current FROM files WHERE sha256 = ?", (sha,)).fetchone()
+        if entry is not None:
+            if not entry[1]:
+                with self._transaction() as db:
+                    db.execute("UPDATE files SET current = 1 WHERE sha256 = ?", (sha,))
+            return sha, entry[0]
+
+        with open(path, 'rb') as f:
+            file_response = client.files.create(file=f, purpose="assistants")
+        with self._transaction() as db:
+            db.execute("INSERT OR IGNORE INTO files (sha256, file_id, path, size) VALUES (?, ?, ?, ?)",
+                       (sha, file_response.id, path, os.path.getsize(path)))
+            file_id = db.execute("SELECT file_id FROM files WHERE sha256 = ?", (sha,)).fetchone()[0]
+        if file_id != file_response.id:
+            # Otro proceso lo subió a la vez: nos quedamos con el suyo
+            _delete_quietly(client, file_response.id)
+        else:
+            log("file_registry.uploaded", path=path, file_id=file_id)
+        return sha, file_id
+
+    def evict(self, file_id: str):
+        """
+        Olvida un file ID que ya no existe en OpenAI (se volverá a subir).
+        """
+        with self._transaction() as db:
+            db.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+        log("file_registry.evicted", file_id=file_id)
+
+    def _evict_missing(self, client, file_ids: list) -> bool:
+        """
+        Comprueba en OpenAI los file IDs y olvida los que ya no existen.
+        Devuelve True si había alguno.
+        """
+        import openai
+        evicted = False
+        for file_id in file_ids:
+            try:
+                client.files.retrieve(file_id)
+            except openai.NotFoundError:
+                self.evict(file_id)
+                evicted = True
+        return evicted
+
+    def attach(self, client, vector_store_id: str, paths: list) -> list:
+        """
+        Asocia los archivos al vector store con una sola llamada batch y
+        registra la referencia. Si algún file ID registrado se borró en
+        OpenAI, se vuelve a subir y se reintenta. Devuelve los file IDs asociados.
+        """
+        import openai
+        for attempt in range(2):
+            file_ids = []
+            shas = []
+            for path in paths:
+                try:
+                    sha, file_id = self._get_or_upload(client, path)
+                    shas.append(sha)
+                    file_ids.append(file_id)
+                except Exception as e:
+                    log("file_registry.upload_error", path=path, error=str(e))
+
+            if not file_ids:
+                return []
+
+            try:
+                client.beta.vector_stores.file_batches.create(
+                    vector_store_id=vector_store_id,
+                    file_ids=file_ids
+                )
+                break
+            except openai.APIStatusError:
+                if attempt or not self._evict_missing(client, file_ids):
+                    raise
+
+        with self._transaction() as db:
+            db.executemany("UPDATE files SET refs = refs + 1 WHERE sha256 = ?", [(sha,) for sha in shas])
+            db.executemany("INSERT INTO vector_store_files VALUES (?, ?)",
+                           [(vector_store_id, sha) for sha in shas])
+        log("file_registry.attached", vector_store_id=vector_store_id, files=len(file_ids))
+        return file_ids
+
+    def release(self, vector_store_id: str) -> list:
+        """
+        Libera las referencias del vector store. Devuelve los file IDs que ya no
+        usa nadie y cuyo contenido dejó de ser el actual: esos se pueden borrar.
+        """
+        with self._transaction() as db:
+            shas = [sha for (sha,) in db.execute(
+                "SELECT sha256 FROM vector_store_files WHERE vector_store_id = ?", (vector_store_id,))]
+            db.executemany("UPDATE files SET refs = MAX(0, refs - 1) WHERE sha256 = ?", [(sha,) for sha in shas])
+            db.execute("DELETE FROM vector_store_files WHERE vector_store_id = ?", (vector_store_id,))
+
+            # Barremos también entradas invalidadas que ya no tenían referencias
+            deletable = [file_id for (file_id,) in db.execute(
+                "SELECT file_id FROM files WHERE refs = 0 AND current = 0")]
+            db.execute("DELETE FROM files WHERE refs = 0 AND current = 0")
+        return deletable
+
+
+def _delete_quietly(client, file_id: str):
+    try:
+        client.files.delete(file_id=file_id)
+    except Exception as e:
+        log("file_registry.delete_error", file_id=file_id, error=str(e))
+
+
+# Registro compartido por el proceso
+file_registry = FileRegistry(FILE_REGISTRY_PATH)
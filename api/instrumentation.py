@@ -0,0 +1,348 @@
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+# Fracción de peticiones cuya traza se escribe en el log (las fallidas y lentas siempre)
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))
+# Peticiones más lentas que esto (segundos) se registran aunque no salgan en el muestreo
+TRACE_SLOW_SECONDS = float(os.environ.get('TRACE_SLOW_SECONDS', '20'))
+# Trazas recientes que se guardan por thread_id (consultables en /traces)
+TRACE_RECENT_PER_THREAD = int(os.environ.get('TRACE_RECENT_PER_THREAD', '20'))
+TRACE_MAX_THREADS = int(os.environ.get('TRACE_MAX_THREADS', '256'))
+
+METRICS_PREFIX = "idv2"
+# Buckets de latencia en segundos (de una escritura en disco a un run completo)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, callback=None):
+        self.name = name
+        self.help = help_text
+        self.callback = callback  # opcional: total acumulado leído en el momento del scrape
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] += amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []
+            return lines + [f"{self.name} {float(value or 0)}"]
+        with self._lock:
+            lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, callback=None):
+        self.name = name
+        self.help = help_text
+        self.callback = callback  # opcional: valor leído en el momento del scrape
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] += amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []
+            return lines + [f"{self.name} {float(value or 0)}"]
+        with self._lock:
+            lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [conteos por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Métricas del proceso en formato de texto de Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, callback=None) -> Counter:
+        return self._register(Counter(f"{METRICS_PREFIX}_{name}", help_text, callback))
+
+    def gauge(self, name: str, help_text: str, callback=None) -> Gauge:
+        return self._register(Gauge(f"{METRICS_PREFIX}_{name}", help_text, callback))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{METRICS_PREFIX}_{name}", help_text, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+# Registro compartido por el proceso
+metrics = MetricsRegistry()
+
+_span_seconds = metrics.histogram("span_duration_seconds", "Duración de cada operación instrumentada.")
+_span_errors = metrics.counter("span_errors_total", "Operaciones instrumentadas que lanzaron una excepción.")
+_spans_in_flight = metrics.gauge("spans_in_flight", "Operaciones instrumentadas en curso.")
+_request_seconds = metrics.histogram("http_request_duration_seconds", "Duración de las peticiones HTTP.")
+_requests_total = metrics.counter("http_requests_total", "Peticiones HTTP atendidas.")
+_requests_in_flight = metrics.gauge("http_requests_in_flight", "Peticiones HTTP en curso.")
+_traces_logged = metrics.counter("traces_logged_total", "Trazas escritas en el log.")
+
+
+def _is_error_event(event: str) -> bool:
+    return "error" in event or "failed" in event
+
+
+class Trace:
+    """
+    Spans y eventos de una petición. Al terminar se guarda junto a las
+    anteriores del mismo thread_id y, si sale en el muestreo o registró algún
+    error, se escribe en el log como una línea JSON.
+    """
+
+    def __init__(self, route: str, thread_id: str = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+        self.events = []
+        self.sampled = random.random() < TRACE_SAMPLE_RATE
+        self.has_error = False  # algún span falló o algún evento es de error: se escribe siempre
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def add_span(self, record: dict):
+        with self._lock:
+            self.spans.append(record)
+            if "error" in record:
+                self.has_error = True
+
+    def add_event(self, record: dict):
+        with self._lock:
+            self.events.append(record)
+            if _is_error_event(record["event"]):
+                self.has_error = True
+
+    def to_dict(self, status=None) -> dict:
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "route": self.route,
+                "thread_id": self.thread_id,
+                "status": status,
+                "started_at": self.started_at,
+                "duration_ms": self.elapsed_ms(),
+                "spans": list(self.spans),
+                "events": list(self.events),
+            }
+
+
+class _RecentTraces:
+    def __init__(self, per_thread: int, max_threads: int):
+        self.per_thread = per_thread
+        self.max_threads = max_threads
+        self._by_thread = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, thread_id: str, record: dict):
+        if not thread_id:
+            return
+        with self._lock:
+            recent = self._by_thread.get(thread_id)
+            if recent is None:
+                recent = self._by_thread[thread_id] = collections.deque(maxlen=self.per_thread)
+            self._by_thread.move_to_end(thread_id)
+            recent.append(record)
+            while len(self._by_thread) > self.max_threads:
+                self._by_thread.popitem(last=False)
+
+    def get(self, thread_id: str) -> list:
+        with self._lock:
+            return list(self._by_thread.get(thread_id, ()))
+
+
+_recent = _RecentTraces(TRACE_RECENT_PER_THREAD, TRACE_MAX_THREADS)
+
+
+def _emit(record: dict):
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+def start_trace(route: str, thread_id: str = None) -> Trace:
+    """
+    Abre la traza de una petición en el contexto actual.
+    """
+    trace = Trace(route, thread_id)
+    _current_trace.set(trace)
+    _requests_in_flight.inc(route=route)
+    return trace
+
+
+def finish_trace(trace: Trace, status: int):
+    """
+    Cierra la traza: métricas HTTP, historial por thread_id y log (muestreado,
+    salvo las trazas lentas, con status 5xx o con algún error).
+    """
+    duration = time.perf_counter() - trace.started
+    _requests_in_flight.dec(route=trace.route)
+    _requests_total.inc(route=trace.route, status=status)
+    _request_seconds.observe(duration, route=trace.route)
+
+    record = trace.to_dict(status)
+    _recent.add(trace.thread_id, record)
+    if (trace.sampled or trace.has_error or (isinstance(status, int) and status >= 500)
+            or duration >= TRACE_SLOW_SECONDS):
+        _traces_logged.inc()
+        _emit(record)
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def set_thread_id(thread_id: str):
+    """
+    Asocia la petición en curso a un thread_id (si no se conocía al abrirla).
+    """
+    trace = _current_trace.get()
+    if trace is not None and thread_id:
+        trace.thread_id = thread_id
+
+
+@contextlib.contextmanager
+def span(name: str, thread_id: str = None, **attrs):
+    """
+    Mide un bloque (llamada a OpenAI, tool call, E/S de disco, compilación):
+    histograma de latencia, errores y operaciones en curso. Dentro de una
+    petición el span se añade a su traza; fuera (hilos de fondo) se guarda
+    directamente en el historial del thread_id.
+    """
+    trace = _current_trace.get()
+    started = time.perf_counter()
+    offset_ms = trace.elapsed_ms() if trace is not None else None
+    error = None
+    _spans_in_flight.inc(span=name)
+    try:
+        yield attrs
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        _span_errors.inc(span=name)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _spans_in_flight.dec(span=name)
+        _span_seconds.observe(duration, span=name)
+        record = {"span": name, "duration_ms": round(duration * 1000, 1)}
+        if offset_ms is not None:
+            record["offset_ms"] = offset_ms
+        if attrs:
+            record["attrs"] = attrs
+        if error:
+            record["error"] = error
+        if trace is not None:
+            trace.add_span(record)
+        else:
+            record["thread_id"] = thread_id
+            record["at"] = time.time()
+            _recent.add(thread_id, record)
+
+
+def log(event: str, **fields):
+    """
+    Evento estructurado. Dentro de una petición va a su traza (y sale en el
+    log si la traza se muestrea; los eventos de error, '*error*' o '*failed*',
+    siempre); fuera de una petición se escribe directamente.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_event({"event": event, "offset_ms": trace.elapsed_ms(), **fields})
+        return
+    _emit({"event": event, "at": time.time(), **fields})
+
+
+def recent_traces(thread_id: str) -> list:
+    return _recent.get(thread_id)
+
+
+def render_metrics() -> str:
+    return metrics.render()
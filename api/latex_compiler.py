@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from build_cache import build_cache
+from document_model import write_atomic
+from instrumentation import log
+from tex_engine import tex_engine
+
+# Copia adicional del PDF en la carpeta pública del frontend (el PDF se sirve en GET /pdf/<thread_id>)
+PUBLISH_PDF_TO_FRONTEND = os.environ.get('PUBLISH_PDF_TO_FRONTEND', 'False') == 'True'
+# Fichero (en la carpeta de salida del thread) que apunta al último PDF publicado
+PUBLISHED_MARKER = "published.json"
+
+
+class CompileError(Exception):
+    """
+    pdflatex terminó con error (o fue cancelado).
+    """
+
+    def __init__(self, message: str, stdout: str = "", stderr: str = ""):
+        super().__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def compile_document(thread_id: str, on_process=None):
+    """
+    Compila generatedDocuments/<thread_id>.tex con pdflatex en
+    BACKEND_OUTPUT_DIR/<thread_id> y publica el PDF resultante (ver published_pdf).
+    'on_process(proc)' recibe el proceso lanzado, para poder cancelarlo.
+    Si el mismo fuente ya se compiló antes, se publica el PDF de la caché sin
+    ejecutar pdflatex. Devuelve {"cache_hit", "build_hash", "timings"}.
+    Lanza CompileError si pdflatex falla.
+    """
+    started = time.perf_counter()
+    tex_path = f"generatedDocuments/{thread_id}.tex"
+
+    # 📍 Carpeta de salida en el backend (para compilación temporal)
+    backend_output_dir = output_dir(thread_id)
+    os.makedirs(backend_output_dir, exist_ok=True)
+    pdf_path = os.path.join(backend_output_dir, f"{thread_id}.pdf")
+
+    with open(tex_path, 'rb') as f:
+        tex_source = f.read()
+    build_hash = build_cache.key_for(tex_source, tex_engine.build_id())
+
+    cached_pdf = build_cache.get(build_hash)
+    if cached_pdf is not None:
+        log("compile.cache_hit", thread_id=thread_id)
+        _publish_pdf(thread_id, cached_pdf, build_hash, move=False)
+        timings = {"total_seconds": round(time.perf_counter() - started, 3)}
+        return {"cache_hit": True, "build_hash": build_hash, "timings": timings}
+
+    # ✅ Compilar el PDF (formato precompilado y carpeta de salida reutilizada por thread)
+    returncode, stdout, stderr, timings = tex_engine.compile(
+        tex_path, backend_output_dir, thread_id, on_process=on_process)
+    if returncode < 0:
+        raise CompileError(f"pdflatex cancelled (signal {-returncode})", stdout, stderr)
+    if returncode != 0:
+        log("compile.error", thread_id=thread_id, returncode=returncode, stderr=stderr, stdout=stdout[-2000:])
+        raise CompileError(f"pdflatex exited with code {returncode}", stdout, stderr)
+
+    log("compile.built", thread_id=thread_id, tex_seconds=timings["tex_seconds"], format=timings["format"])
+
+    # Sólo guardamos en caché si el fuente no cambió durante la compilación
+    with open(tex_path, 'rb') as f:
+        if f.read() == tex_source:
+            build_cache.put(build_hash, pdf_path)
+
+    _publish_pdf(thread_id, pdf_path, build_hash, move=True)
+    timings["total_seconds"] = round(time.perf_counter() - started, 3)
+    return {"cache_hit": False, "build_hash": build_hash, "timings": timings}
+
+
+def output_dir(thread_id: str) -> str:
+    return os.path.join(os.getenv("BACKEND_OUTPUT_DIR"), thread_id)
+
+
+def published_pdf(thread_id: str):
+    """
+    Devuelve (ruta, build_hash) del último PDF publicado del thread, o None.
+    """
+    try:
+        with open(os.path.join(output_dir(thread_id), PUBLISHED_MARKER), 'r', encoding='utf-8') as f:
+            published = json.load(f)
+    except (OSError, ValueError):
+        return None
+    path = os.path.join(output_dir(thread_id), published["file"])
+    return (path, published["build_hash"]) if os.path.exists(path) else None
+
+
+def _copy_atomic(source: str, target: str):
+    """
+    Copia a través de un temporal en el directorio de destino y lo renombra
+    (como write_atomic): quien esté sirviendo 'target' nunca lo ve a medias.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)), prefix=".tmp-", suffix=".pdf")
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _publish_pdf(thread_id: str, pdf_path: str, build_hash: str, move: bool):
+    """
+    Deja el PDF en BACKEND_OUTPUT_DIR/<thread_id>/<thread_id>-<hash>.pdf y
+    actualiza el marcador. Cada build tiene su propio nombre, así que una
+    descarga en curso nunca ve el fichero a medio escribir; se conserva el
+    PDF anterior y se borran los más viejos.
+    """
+    backend_output_dir = output_dir(thread_id)
+    file_name = f"{thread_id}-{build_hash[:16]}.pdf"
+    target = os.path.join(backend_output_dir, file_name)
+    if move:
+        os.replace(pdf_path, target)
+    else:
+        _copy_atomic(pdf_path, target)
+
+    previous = published_pdf(thread_id)
+    write_atomic(os.path.join(backend_output_dir, PUBLISHED_MARKER),
+                 json.dumps({"file": file_name, "build_hash": build_hash, "published_at": time.time()}))
+
+    keep = {file_name, os.path.basename(previous[0]) if previous else None}
+    for name in os.listdir(backend_output_dir):
+        if name.startswith(f"{thread_id}-") and name.endswith(".pdf") and name not in keep:
+            try:
+                os.remove(os.path.join(backend_output_dir, name))
+            except OSError:
+                pass
+
+    if not PUBLISH_PDF_TO_FRONTEND:
+        return
+
+    # 📍 Ruta destino en carpeta pública del frontend
+    frontend_public_path = os.path.join(os.getenv("FRONTEND_PUBLIC_PATH"), thread_id)
+    os.makedirs(frontend_public_path, exist_ok=True)
+
+    # ✅ Copiar PDF al frontend
+    _copy_atomic(target, os.path.join(frontend_public_path, f"{thread_id}.pdf"))
+
+    log("compile.published_to_frontend", thread_id=thread_id)
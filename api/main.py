@@ -1,26 +1,282 @@
-from openai import OpenAI
+# openai_client carga el .env: se importa antes que los módulos que leen variables de entorno
+from openai_client import client, openai_factory
 import os
-from dotenv import load_dotenv
 import document_manipulation
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 import json
+import re
 from flask_cors import CORS
-from ephemeral_assistant import start_ephemeral_conversation, end_ephemeral_conversation
-import threading
+from ephemeral_assistant import MODIFY_DOCUMENT_TOOL, end_ephemeral_conversation
+from session_pool import session_pool
+from session_reaper import session_reaper
+from run_streaming import stream_run, format_sse
+from file_ingestion import ingest_files, ingested_filenames
+from compile_scheduler import compile_scheduler
+from build_cache import build_cache
+from tex_engine import tex_engine
+from latex_compiler import published_pdf
+from build_retention import retention_sweeper
+from document_model import document_store
+from embedding_pipeline import SEARCH_DOCUMENTS_TOOL, get_local_retrieval, is_local_session
+from section_drafting import draft_sections, unknown_sections
+from context_budget import context_budget, usage_of
+from run_scheduler import run_scheduler
+from thread_history import HistoryFetchError, thread_history
+from text_preprocessing import PREPROCESS_UPLOADS, upload_preprocessor, remove_temporary_files
+from upload_streaming import UploadRequest, UploadTooLarge, UPLOAD_MAX_REQUEST_BYTES, spool_uploads, close_uploads
+from instrumentation import (
+    metrics, span, log, start_trace, finish_trace, set_thread_id, recent_traces, render_metrics
+)
 
+app = Flask(__name__)
+# Los archivos del multipart se escriben en buffers acotados con hash incremental
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_REQUEST_BYTES
+# El frontend lee el ETag de /pdf (hash del build) para recargar la vista previa sólo si cambió
+CORS(app, expose_headers=["ETag"])
+# Con un proxy delante (nginx/Apache) el PDF lo envía el propio proxy con X-Sendfile
+app.config['USE_X_SENDFILE'] = os.environ.get('PDF_USE_X_SENDFILE', 'False') == 'True'
 
-# Carga variables de entorno
-load_dotenv('.env')
-OPENAI_API_KEY = os.environ['OPEN_AI_API_KEY']
+# Máximo de segundos que /readTextFile puede esperar a una edición (long-poll)
+READ_LONG_POLL_MAX_SECONDS = float(os.environ.get('READ_LONG_POLL_MAX_SECONDS', '25'))
 
-# Creamos cliente
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Identificadores de thread válidos en rutas de archivos
+THREAD_ID_RE = re.compile(r'^[A-Za-z0-9_-]+$')
 
-app = Flask(__name__)
-CORS(app)
+# Arrancamos los workers de TeX antes que los demás hilos y preparamos el formato del preámbulo
+tex_engine.start()
+
+# Primera conexión con OpenAI en segundo plano (después del fork de los workers de TeX)
+openai_factory.warm_up()
+
+# Arrancamos el planificador de limpieza (retoma las sesiones pendientes de ejecuciones anteriores)
+session_reaper.start(end_ephemeral_conversation)
+
+# Arrancamos el pool de sesiones precalentadas (no hace nada si SESSION_POOL_SIZE=0)
+session_pool.start()
+
+# Borrado periódico de documentos y builds de threads inactivos (RETENTION_MAX_AGE_DAYS)
+retention_sweeper.start(session_reaper.active_threads)
+
+# Estado de los componentes de fondo, leído en cada scrape de /metrics
+metrics.gauge("session_pool_ready", "Sesiones precalentadas listas para /start.",
+              lambda: session_pool.stats()["ready"])
+metrics.gauge("reaper_pending_sessions", "Sesiones pendientes de limpieza.",
+              lambda: session_reaper.stats()["pending"])
+metrics.counter("build_cache_hits_total", "Builds servidos desde la caché.", lambda: build_cache.stats()["hits"])
+metrics.counter("build_cache_misses_total", "Builds que pasaron por pdflatex.", lambda: build_cache.stats()["misses"])
+
+# Rutas que no se trazan (las consulta el propio sistema de monitorización)
+UNTRACED_ROUTES = {'/metrics', '/traces'}
+
+
+@app.before_request
+def open_request_trace():
+    if request.path in UNTRACED_ROUTES:
+        return
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    thread_id = request.args.get('thread_id') or request.form.get('thread_id')
+    if not thread_id and request.is_json:
+        thread_id = (request.get_json(silent=True) or {}).get('thread_id')
+    request.trace = start_trace(route, thread_id)
 
 
+@app.after_request
+def close_request_trace(response):
+    trace = getattr(request, 'trace', None)
+    if trace is not None:
+        # Al cerrar la respuesta, para que los endpoints en streaming cuenten entero
+        status = response.status_code
+        response.call_on_close(lambda: finish_trace(trace, status))
+    return response
+
+
+@app.errorhandler(413)
+@app.errorhandler(UploadTooLarge)
+def uploads_too_large(e):
+    log("upload.too_large", limit=UPLOAD_MAX_REQUEST_BYTES)
+    return jsonify({"error": f"Uploads exceed the limit of {UPLOAD_MAX_REQUEST_BYTES} bytes per request"}), 413
+
+
+# --------------------------------------------------------------------------------
+# 1) Helpers compartidos por /chat, /chat/stream y el servidor asíncrono
+# --------------------------------------------------------------------------------
+
+def spool_request_uploads(uploaded_files):
+    """
+    Buffers de los archivos subidos (no se guardan en una carpeta de uploads).
+    Devuelve [(filename, SpooledUpload)].
+    """
+    with span("spool_uploads", files=len(uploaded_files)):
+        spooled = spool_uploads(uploaded_files)
+    for filename, upload in spooled:
+        log("upload.spooled", filename=filename, size=upload.size, sha256=upload.sha256,
+            spilled=upload.buffer.spilled)
+    return spooled
+
+
+def preprocess_uploads(saved_files, vector_store_id):
+    """
+    Reduce los archivos a texto compacto y deduplicado (si PREPROCESS_UPLOADS).
+    Devuelve (archivos a subir, temporales a borrar, informe o None, hashes
+    para record_preprocessed).
+    """
+    if PREPROCESS_UPLOADS and saved_files:
+        with span("preprocess_uploads", files=len(saved_files)):
+            return upload_preprocessor.preprocess(vector_store_id, saved_files)
+    return saved_files, [], None, {}
+
+
+def record_preprocessed(vector_store_id, hashes, report):
+    """
+    Marca como vistos (para la deduplicación) sólo los archivos que se
+    subieron bien: si la subida falla, reintentarla no se toma por duplicado.
+    """
+    if hashes:
+        upload_preprocessor.record(vector_store_id, hashes, ingested_filenames(report))
+
+
+def upload_files_to_vector_store(uploaded_files, vector_store_id):
+    """
+    Pasa cada archivo subido a un buffer acotado, lo reduce a texto compacto
+    y deduplicado, y los ingesta en el vector store en paralelo (un único
+    file batch, esperando a que se indexen). Los buffers se liberan al acabar.
+    Devuelve (file_ids, informe de ingesta).
+    """
+    spooled_files = spool_request_uploads(uploaded_files)
+    temporary_files = []
+    try:
+        saved_files, temporary_files, preprocessing_report, hashes = preprocess_uploads(
+            spooled_files, vector_store_id)
+        if is_local_session(vector_store_id):
+            # Modo local: se indexan en FAISS; no hay file IDs de OpenAI que adjuntar
+            with span("local_retrieval.ingest", files=len(saved_files)):
+                report = get_local_retrieval(client).ingest_files(vector_store_id, saved_files)
+        else:
+            with span("ingestion", files=len(saved_files)):
+                report = ingest_files(client, vector_store_id, saved_files)
+        record_preprocessed(vector_store_id, hashes, report)
+    finally:
+        remove_temporary_files(temporary_files)
+        close_uploads(spooled_files)
+
+    if preprocessing_report is not None:
+        report["preprocessing"] = preprocessing_report
+    if uploaded_files:
+        log("upload.ingested", vector_store_id=vector_store_id, files=len(saved_files),
+            uploaded=len(uploaded_files), seconds=report['total_seconds'], failures=len(report['failed']))
+    return report["file_ids"], report
+
+
+def create_user_message(thread_id, user_input, files_info):
+    """
+    Crea el mensaje del usuario en el thread, con los archivos como adjuntos.
+    """
+    with span("openai.messages.create"):
+        client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=user_input,
+            attachments=[
+                {"file_id": fid, "tools": [{"type": "file_search"}]}
+                for fid in files_info
+            ]
+        )
+
+
+def send_user_messages(batch, thread_id):
+    """
+    Crea en el thread los mensajes del lote (run_scheduler) que aún no se
+    enviaron: si el lote se reintenta, no se duplican.
+    """
+    for queued in batch:
+        if not queued.sent:
+            create_user_message(thread_id, queued.content, queued.file_ids)
+            queued.sent = True
+
+
+# Tools que ofrece el assistant. El nombre de una tool call lo elige el modelo:
+# cualquier otro va al span 'tool.unknown', para no abrir una serie por nombre
+KNOWN_TOOLS = {SEARCH_DOCUMENTS_TOOL["function"]["name"], MODIFY_DOCUMENT_TOOL["function"]["name"]}
+
+
+def execute_tool_call(tool_call, thread_id, batch=None, vector_store_id=None):
+    """
+    Ejecuta una function call del assistant y devuelve su tool output.
+    Si se pasa un 'batch' (document_manipulation.SectionBatch), los cambios de
+    sección se acumulan y se escriben/compilan una sola vez al cerrar el lote;
+    su tool output lo completa execute_tool_calls con el resultado real.
+    """
+    name = tool_call.function.name if tool_call.function.name in KNOWN_TOOLS else "unknown"
+    with span(f"tool.{name}"):
+        return _execute_tool_call(tool_call, thread_id, batch, vector_store_id)
+
+
+def _execute_tool_call(tool_call, thread_id, batch, vector_store_id):
+    if tool_call.function.name == 'search_documents':
+        arguments = json.loads(tool_call.function.arguments)
+        results = get_local_retrieval(client).search(vector_store_id, arguments['Query'])
+        log("tool.search_documents", query=arguments['Query'], results=len(results))
+        return {
+            "tool_call_id": tool_call.id,
+            "output": json.dumps({"results": results}, ensure_ascii=False)
+        }
+
+    if tool_call.function.name == 'modify_document':
+        arguments = json.loads(tool_call.function.arguments)
+        section = arguments['Section']
+        content = arguments['Content']
+        log("tool.modify_document", section=section, content_length=len(content))
+
+        response = modify_latex_document(section, content, thread_id, batch)
+        if batch is not None:
+            # El resultado real se conoce al cerrar el lote (execute_tool_calls)
+            return {"tool_call_id": tool_call.id, "section": response["section"]}
+        return section_tool_output(tool_call.id, response)
+
+    log("tool.unknown_function", name=tool_call.function.name)
+    return {
+        "tool_call_id": tool_call.id,
+        "output": json.dumps({"error": f"Unknown function {tool_call.function.name}"})
+    }
+
+
+def execute_tool_calls(tool_calls, thread_id, vector_store_id=None):
+    """
+    Ejecuta todas las function calls de un run. Las secciones modificadas se
+    aplican en una sola escritura y una compilación.
+    """
+    tool_outputs = []
+    with document_manipulation.batch_edit(thread_id) as batch:
+        for tool_call in tool_calls:
+            tool_outputs.append(execute_tool_call(tool_call, thread_id, batch, vector_store_id))
+    return [section_tool_output(tool_output["tool_call_id"], batch.result(tool_output["section"]))
+            if "section" in tool_output else tool_output
+            for tool_output in tool_outputs]
+
+
+def section_tool_output(tool_call_id, response):
+    """
+    Tool output de modify_document con el resultado real de la sección.
+    """
+    if "error" in response:
+        log("tool.modify_document.error", error=response["error"])
+    return {
+        "tool_call_id": tool_call_id,
+        "output": json.dumps(response)
+    }
+
+
+def find_assistant_response(messages):
+    """
+    Devuelve el texto del último mensaje del assistant (la lista viene del más
+    reciente al más antiguo).
+    """
+    for message in messages:
+        if message.role == 'assistant' and 'text' in message.content[0].type:
+            return message.content[0].text.value
+    return "[No assistant response found]"
+
 
 # --------------------------------------------------------------------------------
 # 2) Endpoints
@@ -29,12 +285,14 @@ CORS(app)
 @app.route('/start', methods=['GET'])
 def start_conversation():
     """
-    - Crea un vector store, un assistant y un thread EFÍMEROS (desde módulo externo).
+    - Entrega un vector store, un assistant y un thread EFÍMEROS del pool
+      precalentado (o los crea en el momento si el pool está vacío).
     - Devuelve: thread_id, assistant_id, vector_store_id
     """
-    print("[/start] Starting new ephemeral conversation...")
-    thread_id, assistant_id, vector_store_id = start_ephemeral_conversation()
-    print(f"[/start] ephemeral conversation: thread_id={thread_id}, assistant_id={assistant_id}, vector_store_id={vector_store_id}")
+    with span("session.acquire"):
+        thread_id, assistant_id, vector_store_id = session_pool.acquire()
+    set_thread_id(thread_id)
+    log("session.started", thread_id=thread_id, assistant_id=assistant_id, vector_store_id=vector_store_id)
 
     return jsonify({
         "thread_id": thread_id,
@@ -52,66 +310,125 @@ def end_conversation():
     vector_store_id = request.form.get('vector_store_id')
 
     if not assistant_id or not vector_store_id:
-        print("[/end] Missing IDs")
+        log("session.end.missing_ids")
         return jsonify({"error": "Missing assistant_id or vector_store_id"}), 400
 
-    print(f"[/end] Ending ephemeral conversation for assistant_id={assistant_id}, vector_store_id={vector_store_id}")
-    end_ephemeral_conversation(assistant_id, vector_store_id)
+    log("session.ending", assistant_id=assistant_id, vector_store_id=vector_store_id)
+    # Si la sesión está registrada, se borran también su thread y sus archivos
+    with span("session.end"):
+        if not session_reaper.reap_now(assistant_id, vector_store_id):
+            end_ephemeral_conversation(assistant_id, vector_store_id)
     return jsonify({"success": True, "message": "Conversation ended. Assistant & vector store deleted."})
 
-import subprocess
-import os
-import shutil
-from flask import jsonify, request
+
+@app.route('/poolStats', methods=['GET'])
+def pool_stats():
+    """
+    Devuelve el estado del pool de sesiones (hits/misses) para dimensionarlo.
+    """
+    return jsonify(session_pool.stats())
+
+
+@app.route('/reaperStats', methods=['GET'])
+def reaper_stats():
+    """
+    Sesiones pendientes de limpieza y limpiezas realizadas/fallidas.
+    """
+    return jsonify(session_reaper.stats())
 
 @app.route('/compile', methods=['POST'])
 def compile_latex():
-    data = request.get_json()
+    """
+    Encola la compilación del .tex del thread. La compilación se hace en
+    segundo plano; el estado se consulta en /compile/status.
+    """
+    data = request.get_json(silent=True) or {}
     thread_id = data.get("thread_id")
+    if not thread_id:
+        return jsonify({"status": "error", "message": "Missing thread_id"}), 400
+    if not isinstance(thread_id, str) or not THREAD_ID_RE.match(thread_id):
+        return jsonify({"status": "error", "message": "Invalid thread_id"}), 400
 
-    tex_path = f"generatedDocuments/{thread_id}.tex"
-    
-    # 📍 Carpeta de salida en el backend (para compilación temporal)
-    backend_output_dir = os.path.join(os.getenv("BACKEND_OUTPUT_DIR"), thread_id)
-    os.makedirs(backend_output_dir, exist_ok=True)
+    job = compile_scheduler.submit(thread_id)
+    log("compile.queued", thread_id=thread_id)
+    return jsonify(job), 202
+
+
+@app.route('/compile/status', methods=['GET'])
+def compile_status():
+    """
+    Devuelve el estado del último build del thread: queued, running, done o failed,
+    junto con la duración de la compilación.
+    """
+    thread_id = request.args.get('thread_id')
+    job = compile_scheduler.status(thread_id)
+    if job is None:
+        return jsonify({"error": "No compilation found for this thread"}), 404
+    return jsonify(job)
+
+
+@app.route('/compile/cacheStats', methods=['GET'])
+def compile_cache_stats():
+    """
+    Devuelve los contadores de la caché de builds (hits/misses/expulsiones).
+    """
+    return jsonify(build_cache.stats())
+
+
+@app.route('/compile/engineStats', methods=['GET'])
+def compile_engine_stats():
+    """
+    Devuelve el compilador en uso, el formato del preámbulo y los tiempos de build.
+    """
+    return jsonify(tex_engine.stats())
 
+
+@app.route('/pdf/<thread_id>', methods=['GET'])
+def serve_pdf(thread_id):
+    """
+    Sirve el último PDF compilado del thread directamente desde la carpeta de
+    builds: admite peticiones Range (visor por páginas) y GET condicional con
+    un ETag fuerte igual al hash del build.
+    """
+    published = published_pdf(thread_id) if THREAD_ID_RE.match(thread_id) else None
+    if published is None:
+        return jsonify({"error": "No PDF built for this thread"}), 404
+
+    path, build_hash = published
     try:
-        # ✅ Compilar el PDF usando pdflatex
-        result = subprocess.run(
-            ["C:/Program Files/MiKTeX/miktex/bin/x64/pdflatex.exe",
-             "-interaction=nonstopmode",
-             "-output-directory", backend_output_dir,
-             tex_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
+        response = send_file(path, mimetype='application/pdf', conditional=True, etag=build_hash,
+                             download_name=f"{thread_id}.pdf", max_age=0)
+    except FileNotFoundError:
+        # Sustituido por un build más nuevo entre la lectura del marcador y la apertura
+        return jsonify({"error": "No PDF built for this thread"}), 404
+    # El navegador revalida siempre (304 si el build no cambió)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-        print(f"[compile] ✅ PDF generado para thread_id={thread_id} en backend")
 
-        # 📍 Ruta destino en carpeta pública del frontend
-        frontend_public_path = os.path.join(os.getenv("FRONTEND_PUBLIC_PATH"),
-            thread_id
-        )
-        os.makedirs(frontend_public_path, exist_ok=True)
+@app.route('/retentionStats', methods=['GET'])
+def retention_stats():
+    """
+    Barridos de retención realizados y espacio liberado.
+    """
+    return jsonify(retention_sweeper.stats())
 
-        # ✅ Copiar PDF al frontend
-        shutil.copyfile(
-            os.path.join(backend_output_dir, f"{thread_id}.pdf"),
-            os.path.join(frontend_public_path, f"{thread_id}.pdf")
-        )
 
-        print(f"[compile] ✅ PDF copiado a frontend/public/pdf/{thread_id}/{thread_id}.pdf")
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Histogramas de latencia, contadores y operaciones en curso en formato Prometheus.
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
-        return jsonify({"status": "success"})
 
-    except subprocess.CalledProcessError as e:
-        print(f"[compile] ❌ Error pdflatex:\nSTDERR:\n{e.stderr}\nSTDOUT:\n{e.stdout}")
-        return jsonify({"status": "error", "message": e.stderr}), 500
-    except Exception as general_error:
-        print(f"[compile] ❌ Error al copiar PDF al frontend: {general_error}")
-        return jsonify({"status": "error", "message": str(general_error)}), 500
+@app.route('/traces', methods=['GET'])
+def thread_traces():
+    """
+    Últimas trazas (peticiones y compilaciones) de un thread, con sus spans.
+    """
+    thread_id = request.args.get('thread_id')
+    return jsonify(recent_traces(thread_id))
 
 
 @app.route('/chat', methods=['POST'])
@@ -126,6 +443,8 @@ def chat():
       - (Opcional) files
     Subimos archivos a la API, los indexamos en 'vector_store_id',
     y enviamos el mensaje. Hacemos poll hasta obtener respuesta.
+    Si el thread ya tiene un run en marcha, el mensaje espera y se envía
+    junto con los demás en cola en el siguiente run (run_scheduler).
     """
     thread_id = request.form.get('thread_id')
     assistant_id = request.form.get('assistant_id')
@@ -133,151 +452,307 @@ def chat():
     user_input = request.form.get('message', '')
 
     if not thread_id or not assistant_id or not vector_store_id:
-        print("[/chat] Error: missing one of thread_id, assistant_id, vector_store_id")
+        log("chat.missing_ids")
         return jsonify({"error": "Missing required IDs"}), 400
 
     uploaded_files = request.files.getlist('files')
-    files_info = []
-
-    # Subimos cada archivo y lo asociamos al vector store
-    for file in uploaded_files:
-        uploads_path = os.environ.get('UPLOADS_PATH')
-        file_path = os.path.join(uploads_path, file.filename)
-        file.save(file_path)
-        print(f"[/chat] Saved file: {file_path}")
-
-        # 1) Subir a OpenAI
-        my_file = client.files.create(file=open(file_path, "rb"), purpose="assistants")
-        file_id = my_file.id
-        files_info.append(file_id)
-        print(f"[/chat] Created file in OpenAI: {file_id}")
-
-        # 2) Asociar al vector store
-        client.beta.vector_stores.files.create(
-            vector_store_id=vector_store_id,
-            file_id=file_id
-        )
-        print(f"[/chat] Added file {file_id} to vector store {vector_store_id}")
-
-    print(f"[/chat] Received message: '{user_input}' for thread ID: {thread_id}, assistant ID: {assistant_id}")
-
-    # Creamos el mensaje del usuario
-    client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=user_input,
-        attachments=[
-            {"file_id": fid, "tools": [{"type": "file_search"}]}
-            for fid in files_info
-        ]
-    )
+    files_info, ingestion_report = upload_files_to_vector_store(uploaded_files, vector_store_id)
+    session_reaper.track_files(thread_id, files_info)
+
+    log("chat.received", thread_id=thread_id, assistant_id=assistant_id, message_length=len(user_input))
 
-    # Iniciamos un 'run'
-    run = client.beta.threads.runs.create_and_poll(
-        thread_id=thread_id,
-        assistant_id=assistant_id,
+    # Un run por thread: si ya hay uno en marcha, el mensaje va en el siguiente lote
+    outcome = run_scheduler.run(
+        thread_id, assistant_id, user_input, files_info,
+        lambda batch: run_chat_batch(batch, thread_id, assistant_id, vector_store_id)
     )
 
+    if outcome["status"] == 'completed':
+        log("chat.completed", response_length=len(outcome["response"]))
+        result = {"response": outcome["response"]}
+        if uploaded_files:
+            result["ingestion"] = ingestion_report
+        return jsonify(result)
+
+    else:
+        log("chat.run_not_completed", status=outcome["status"])
+        result = {"error": "Run did not complete successfully"}
+        if uploaded_files:
+            result["ingestion"] = ingestion_report
+        return jsonify(result), 500
+
+
+def run_chat_batch(batch, thread_id, assistant_id, vector_store_id):
+    """
+    Envía los mensajes en cola del thread (batch de run_scheduler) y lanza un
+    único run. Devuelve {"status", "response"} para todas las peticiones del lote.
+    """
+    send_user_messages(batch, thread_id)
+    if len(batch) > 1:
+        log("chat.batched", messages=len(batch))
+
+    # Iniciamos un 'run' (con truncado y límites de tokens) y lo consultamos según su duración esperada
+    clock = run_scheduler.clock()
+    with span("openai.runs.create_and_poll"):
+        run = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            **context_budget.run_options(thread_id)
+        )
+        run = run_scheduler.poll(client, thread_id, run, clock)
+
     # Si la IA requiere function calls
     if run.status == 'requires_action':
-        print("[/chat] Run requires_action -> function calls")
-        tool_outputs = []
-        for tool_call in run.required_action.submit_tool_outputs.tool_calls:
-            if tool_call.function.name == 'modify_document':
-                arguments = json.loads(tool_call.function.arguments)
-                section = arguments['Section']
-                content = arguments['Content']
-                print(f"[modify_document] Called with section='{section}', content='{content}'")
-
-                response = modify_latex_document(section, content, thread_id)
-                if "error" in response:
-                    print(f"[modify_document] Error in section={section}")
-                    tool_outputs.append({
-                        "tool_call_id": tool_call.id,
-                        "output": json.dumps({"error": f"Failed for section {section}"})
-                    })
-                else:
-                    tool_outputs.append({
-                        "tool_call_id": tool_call.id,
-                        "output": json.dumps(response)
-                    })
+        log("chat.requires_action", tool_calls=len(run.required_action.submit_tool_outputs.tool_calls))
+        tool_outputs = execute_tool_calls(run.required_action.submit_tool_outputs.tool_calls,
+                                          thread_id, vector_store_id)
 
         # Enviamos resultados de las tool calls
         if tool_outputs:
             try:
-                run = client.beta.threads.runs.submit_tool_outputs_and_poll(
-                    thread_id=thread_id,
-                    run_id=run.id,
-                    tool_outputs=tool_outputs
-                )
-                print("[/chat] Tool outputs submitted successfully.")
+                with span("openai.runs.submit_tool_outputs_and_poll"):
+                    run = client.beta.threads.runs.submit_tool_outputs(
+                        thread_id=thread_id,
+                        run_id=run.id,
+                        tool_outputs=tool_outputs
+                    )
+                    run = run_scheduler.poll(client, thread_id, run, clock)
+                log("chat.tool_outputs_submitted")
             except Exception as e:
-                print(f"[/chat] Failed to submit tool outputs: {e}")
+                log("chat.tool_outputs_failed", error=str(e))
+
+    usage = usage_of(run)
+    context_budget.record(client, thread_id, assistant_id, usage)
+    log("chat.usage", **(usage or {}))
 
+    response_text = None
     if run.status == 'completed':
-        print("[/chat] Run completed, retrieving final assistant response...")
-        messages = client.beta.threads.messages.list(thread_id=thread_id)
-        response_text = None
-        for message in messages.data:
-            if message.role == 'assistant' and 'text' in message.content[0].type:
-                response_text = message.content[0].text.value
-                break
-
-        if response_text is None:
-            response_text = "[No assistant response found]"
-        print(f"[/chat] Assistant response: {response_text}")
-        return jsonify({"response": response_text})
+        with span("openai.messages.list"):
+            messages = client.beta.threads.messages.list(thread_id=thread_id)
+        response_text = find_assistant_response(messages.data)
+    return {"status": run.status, "response": response_text}
 
-    else:
-        print(f"[/chat] Run did NOT complete, status = {run.status}")
-        return jsonify({"error": "Run did not complete successfully"}), 500
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Variante en streaming de /chat (Server-Sent Events).
+    Mismos parámetros que /chat. Emite los eventos:
+      - delta:           fragmentos de texto del assistant
+      - tool_call:       progreso de las tool calls
+      - tool_output:     resultado de cada function call (se ejecutan en línea)
+      - ingestion:       informe de subida/indexación de los archivos (si los hay)
+      - section_updated: sección del documento modificada por modify_document
+      - message / done / error
+    Si el mensaje se envía en el run de otra petición del mismo thread, sólo
+    se emite done / error con "batched": true.
+    """
+    thread_id = request.form.get('thread_id')
+    assistant_id = request.form.get('assistant_id')
+    vector_store_id = request.form.get('vector_store_id')
+    user_input = request.form.get('message', '')
+
+    if not thread_id or not assistant_id or not vector_store_id:
+        log("chat.missing_ids")
+        return jsonify({"error": "Missing required IDs"}), 400
+
+    uploaded_files = request.files.getlist('files')
+    files_info, ingestion_report = upload_files_to_vector_store(uploaded_files, vector_store_id)
+    session_reaper.track_files(thread_id, files_info)
+
+    log("chat.received", thread_id=thread_id, assistant_id=assistant_id, message_length=len(user_input))
+
+    def handle_tool_calls(tool_calls):
+        # Como en /chat: todas las secciones del run en una escritura y una compilación
+        return execute_tool_calls(tool_calls, thread_id, vector_store_id=vector_store_id)
+
+    def generate():
+        if uploaded_files:
+            yield format_sse("ingestion", ingestion_report)
+
+        # Un run por thread: si ya hay uno en marcha esperamos turno (o su respuesta, si nos incluye)
+        ticket = run_scheduler.enqueue(thread_id, assistant_id, user_input, files_info)
+        if not run_scheduler.wait_turn(ticket):
+            try:
+                outcome = ticket.outcome()
+            except Exception as e:
+                yield format_sse("error", {"status": "error", "message": str(e)})
+                return
+            if outcome["status"] == "completed":
+                yield format_sse("done", {"response": outcome["response"], "batched": True})
+            else:
+                yield format_sse("error", {"status": outcome["status"], "message": None, "batched": True})
+            return
+
+        batch = run_scheduler.take_batch(ticket)
+        outcome, error = {"status": "failed", "response": None}, None
+        try:
+            # Si otro worker tiene un run activo en el thread, se espera a que termine
+            run_scheduler.retry_while_active(thread_id, lambda: send_user_messages(batch, thread_id))
+            with span("openai.runs.stream"):
+                run_options = context_budget.run_options(thread_id)
+                deadline = run_scheduler.clock().deadline
+                for event, payload in stream_run(client, thread_id, assistant_id, handle_tool_calls, run_options,
+                                                 deadline=deadline):
+                    if event in ("done", "error"):
+                        context_budget.record(client, thread_id, assistant_id, payload.get("usage"))
+                        outcome = {"status": "completed" if event == "done" else payload.get("status"),
+                                   "response": payload.get("response")}
+                    yield format_sse(event, payload)
+                    if event == "tool_output" and payload["output"].get("section"):
+                        yield format_sse("section_updated", {"thread_id": thread_id,
+                                                             "section": payload["output"]["section"]})
+        except Exception as e:
+            error = e
+            log("chat.stream_error", error=str(e))
+            yield format_sse("error", {"status": "error", "message": str(e)})
+        finally:
+            # También si el cliente se desconecta: el turno pasa al siguiente mensaje en cola
+            run_scheduler.complete(ticket, batch, outcome, error)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/draft', methods=['POST'])
+def draft_all_sections():
+    """
+    Redacta en paralelo todas las secciones vacías del documento (o las
+    indicadas en 'sections') a partir de los documentos de la sesión, y las
+    escribe de una vez con una sola compilación (Server-Sent Events).
+    Eventos: plan, section_drafted, section_failed, applied, done / error.
+    """
+    params = request.get_json(silent=True) or request.form
+    thread_id = params.get('thread_id')
+    assistant_id = params.get('assistant_id')
+    vector_store_id = params.get('vector_store_id')
+    sections = params.get('sections')
+
+    if not thread_id or not assistant_id or not vector_store_id:
+        log("draft.missing_ids")
+        return jsonify({"error": "Missing required IDs"}), 400
+    if not THREAD_ID_RE.match(thread_id):
+        return jsonify({"error": "Invalid thread_id"}), 400
+    if isinstance(sections, str):
+        sections = [section for section in sections.split(",") if section.strip()]
+    if sections is not None:
+        if not isinstance(sections, list) or not all(isinstance(section, str) for section in sections):
+            return jsonify({"error": "'sections' must be a list of section names"}), 400
+        sections = [normalize_section(section.strip()) for section in sections]
+        try:
+            unknown = unknown_sections(thread_id, sections)
+        except FileNotFoundError:
+            return jsonify({"error": "Document not found"}), 404
+        if unknown:
+            return jsonify({"error": "Unknown sections", "sections": unknown}), 400
+
+    log("draft.received", thread_id=thread_id, sections=sections)
+
+    def generate():
+        try:
+            for event, payload in draft_sections(client, thread_id, assistant_id, vector_store_id, sections):
+                yield format_sse(event, payload)
+        except FileNotFoundError:
+            yield format_sse("error", {"status": "error", "message": "Document not found"})
+        except Exception as e:
+            log("draft.error", error=str(e))
+            yield format_sse("error", {"status": "error", "message": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route('/readTextFile', methods=['GET'])
 def read_text_file():
     """
     Lee un archivo .tex (por ejemplo, cuando la IA modifica secciones),
-    y devuelve su contenido al frontend.
+    y devuelve su contenido al frontend. Se sirve desde el documento parseado
+    en memoria.
+    - Sin 'since': {"response": texto completo, "version"}.
+    - Con 'since=<version>': sólo las secciones cambiadas desde esa versión,
+      {"version", "full", "sections": {SECTION_KEY: contenido}}.
+    - Con 'since' y 'wait=<segundos>': si no hay cambios, espera (long-poll)
+      a la siguiente edición antes de responder (las hechas desde otro
+      proceso se notan con hasta DOCUMENT_WAIT_RECHECK_SECONDS de retraso).
     """
     thread_id = request.args.get('thread_id')
+    since = request.args.get('since', type=int)
+    wait = min(request.args.get('wait', 0, type=float), READ_LONG_POLL_MAX_SECONDS)
     try:
-        with open(f"generatedDocuments/{thread_id}.tex", 'r', encoding='utf-8') as file:
-            content = file.read()
-        return jsonify({"response": content})
+        if since is not None:
+            with span("document.changes_since", wait=wait):
+                if wait > 0:
+                    return jsonify(document_store.wait_for_version(thread_id, since, wait))
+                return jsonify(document_store.changes_since(thread_id, since))
+
+        with span("disk.read_document"):
+            content, version = document_store.read_versioned(thread_id)
+        return jsonify({"response": content, "version": version})
     except FileNotFoundError:
-        print("[readTextFile] No .tex file found for this thread")
+        log("document.not_found")
         return jsonify({"response": ""})
     except Exception as e:
-        print(f"[readTextFile] Error reading file: {e}")
+        log("document.read_error", error=str(e))
         return jsonify({"error": str(e), "response": ""})
 
 
 @app.route('/threadHistory', methods=['GET'])
 def get_thread_history():
     """
-    Devuelve el historial de mensajes para un thread dado.
+    Devuelve el historial de mensajes para un thread dado (del más antiguo al
+    más reciente). Sólo se piden a OpenAI los mensajes nuevos; si el frontend
+    envía If-None-Match y no hay cambios, responde 304.
     """
     thread_id = request.args.get('thread_id')
-    url = f"https://api.openai.com/v1/threads/{thread_id}/messages"
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "OpenAI-Beta": "assistants=v2",
-    }
 
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        if isinstance(data.get('data'), list):
-            data['data'] = data['data'][::-1]  # invertir para ver más recientes arriba
-        return jsonify(data), 200
-    else:
-        print("[threadHistory] Error fetching thread history: ", response.text)
+    try:
+        with span("openai.thread_history"):
+            data, etag = thread_history.get(thread_id)
+    except HistoryFetchError as e:
+        log("thread_history.error", status_code=e.status_code, details=e.details)
         return jsonify({
             "error": "Failed to fetch thread history",
-            "details": response.text,
-        }), response.status_code
+            "details": e.details,
+        }), e.status_code
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    response = jsonify(data)
+    response.set_etag(etag)
+    return response, 200
+
+
+@app.route('/retrievalStats', methods=['GET'])
+def retrieval_stats():
+    """
+    Latencias de ingesta y consulta del motor de recuperación local (FAISS).
+    """
+    return jsonify(get_local_retrieval(client).stats())
+
+
+@app.route('/usageStats', methods=['GET'])
+def usage_stats():
+    """
+    Tokens consumidos por los runs: de un thread (?thread_id=...) o el
+    resumen por assistant junto con los límites de contexto configurados.
+    """
+    thread_id = request.args.get('thread_id')
+    if thread_id:
+        usage = context_budget.thread_usage(thread_id)
+        if usage is None:
+            return jsonify({"error": "No usage recorded for this thread"}), 404
+        return jsonify(usage)
+    return jsonify(context_budget.stats())
+
+
+@app.route('/runSchedulerStats', methods=['GET'])
+def run_scheduler_stats():
+    """
+    Estado del planificador de runs: threads con run en marcha, mensajes en
+    cola, lotes enviados, runs cancelados y duración esperada por assistant.
+    """
+    return jsonify(run_scheduler.stats())
 
 
 @app.route('/listAssistants', methods=['GET'])
@@ -286,13 +761,14 @@ def list_available_assistants():
     Lista todos los asistentes creados en tu cuenta, para debugging.
     """
     try:
-        assistants = client.beta.assistants.list().data
+        with span("openai.assistants.list"):
+            assistants = client.beta.assistants.list().data
         for asst in assistants:
-            print(f"Assistant Name: {asst.name}, ID: {asst.id}")
+            log("assistant.listed", name=asst.name, assistant_id=asst.id)
         # Devolvemos la lista de IDs
         return jsonify([asst.id for asst in assistants])
     except Exception as e:
-        print(f"[listAssistants] Error retrieving assistants: {e}")
+        log("assistant.list_error", error=str(e))
         return jsonify({"error": str(e)}), 500
 
 
@@ -307,15 +783,21 @@ SECTION_MAP = {
     
 }
 
-def modify_latex_document(section, new_content, thread_id):
-
+def normalize_section(section):
     std_section = section.upper().replace(" ", "_").replace("<<", "").replace(">>", "")
-    std_section = SECTION_MAP.get(std_section, std_section)
+    return SECTION_MAP.get(std_section, std_section)
+
+
+def modify_latex_document(section, new_content, thread_id, batch=None):
+
+    std_section = normalize_section(section)
 
-    print(f"[modify_latex_document] Modifying section: {std_section}")
-    document_manipulation.update_latex_section(std_section, new_content, thread_id)
-    return {"success": True}
+    log("document.modify_section", section=std_section)
+    if batch is not None:
+        batch.set(std_section, new_content)
+        return {"section": std_section}
+    return document_manipulation.update_latex_section(std_section, new_content, thread_id)
 
 if __name__ == '__main__':
-    print("[main] Starting Flask server...")
+    log("server.starting")
     app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import random
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from instrumentation import log
+
+# Carga variables de entorno (una sola vez para toda la API)
+load_dotenv('.env')
+OPENAI_API_KEY = os.environ['OPEN_AI_API_KEY']
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+
+# Conexiones keep-alive del pool compartido (SDK y llamadas REST directas)
+OPENAI_POOL_SIZE = int(os.environ.get('OPENAI_POOL_SIZE', os.environ.get('HTTP_POOL_SIZE', '20')))
+# Segundos que una conexión ociosa se mantiene abierta (evita repetir el handshake TLS)
+OPENAI_KEEPALIVE_SECONDS = float(os.environ.get('OPENAI_KEEPALIVE_SECONDS', '90'))
+# Timeouts en segundos: conexión y resto de la petición (subidas de archivos incluidas)
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', '5'))
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '120'))
+# Reintentos con backoff exponencial ante 408/409/429/5xx y errores de red
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '3'))
+# Si está activo, al arrancar se abre una conexión con OpenAI en segundo plano
+OPENAI_WARMUP = os.environ.get('OPENAI_WARMUP', 'True') == 'True'
+
+_RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+_BACKOFF_BASE_SECONDS = 0.5
+_BACKOFF_MAX_SECONDS = 8.0
+
+
+def _backoff_seconds(attempt: int, response=None) -> float:
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), _BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    delay = min(_BACKOFF_BASE_SECONDS * (2 ** attempt), _BACKOFF_MAX_SECONDS)
+    return delay * (0.5 + random.random() / 2)
+
+
+class RestSession:
+    """
+    Llamadas REST directas a la API (las que no pasan por el SDK, como el
+    historial paginado de /threadHistory), sobre el mismo pool de conexiones
+    que el cliente síncrono y con la misma política de reintentos.
+    """
+
+    def __init__(self, factory: "OpenAIClientFactory"):
+        self._factory = factory
+        self._headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {factory.api_key}",
+            "OpenAI-Beta": "assistants=v2",
+        }
+
+    def get(self, url: str, params: dict = None):
+        import httpx
+        http = self._factory.http_client()
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            response = None
+            try:
+                response = http.get(url, params=params, headers=self._headers)
+            except httpx.TransportError:
+                if attempt == OPENAI_MAX_RETRIES:
+                    raise
+            else:
+                if response.status_code not in _RETRY_STATUSES or attempt == OPENAI_MAX_RETRIES:
+                    return response
+            time.sleep(_backoff_seconds(attempt, response))
+
+
+class OpenAIClientFactory:
+    """
+    Clientes de OpenAI compartidos por el proceso. openai y httpx se importan
+    la primera vez que se usa un cliente, no al importar la API, de modo que
+    los procesos (y los workers que los copian con fork) arrancan rápido.
+    Tras un fork el hijo descarta los clientes heredados: las conexiones TLS
+    no se pueden compartir entre procesos.
+    """
+
+    def __init__(self, api_key: str, base_url: str):
+        self.api_key = api_key
+        self.base_url = base_url
+        self._http = None
+        self._client = None
+        self._async_client = None
+        self._rest = None
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._http = None
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _limits():
+        import httpx
+        return httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE,
+                            keepalive_expiry=OPENAI_KEEPALIVE_SECONDS)
+
+    @staticmethod
+    def _timeout():
+        import httpx
+        return httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+    def http_client(self):
+        """
+        Pool httpx síncrono compartido (keep-alive).
+        """
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    import httpx
+                    from openai import DefaultHttpxClient
+                    self._http = DefaultHttpxClient(
+                        timeout=self._timeout(),
+                        # Reintento de conexión en el transporte; el resto lo reintenta el SDK
+                        transport=httpx.HTTPTransport(limits=self._limits(), retries=1),
+                    )
+        return self._http
+
+    def client(self):
+        if self._client is None:
+            http = self.http_client()
+            with self._lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http,
+                                          timeout=self._timeout(), max_retries=OPENAI_MAX_RETRIES)
+        return self._client
+
+    def async_client(self):
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    import httpx
+                    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                    http = DefaultAsyncHttpxClient(
+                        timeout=self._timeout(),
+                        transport=httpx.AsyncHTTPTransport(limits=self._limits(), retries=1),
+                    )
+                    self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                     http_client=http, timeout=self._timeout(),
+                                                     max_retries=OPENAI_MAX_RETRIES)
+        return self._async_client
+
+    def rest(self) -> RestSession:
+        if self._rest is None:
+            self._rest = RestSession(self)
+        return self._rest
+
+    def warm_up(self):
+        """
+        En segundo plano, importa openai, crea el cliente y abre la primera
+        conexión (DNS + TLS) del pool, para que la primera petición real no
+        pague ni la importación ni el handshake.
+        """
+        if not OPENAI_WARMUP:
+            return
+
+        def connect():
+            started = time.perf_counter()
+            try:
+                self.client()
+                self.rest().get(f"{self.base_url}/models", params={"limit": 1})
+                log("openai.warmed_up", seconds=round(time.perf_counter() - started, 3))
+            except Exception as e:
+                log("openai.warm_up_error", error=str(e))
+
+        threading.Thread(target=connect, name="openai-warmup", daemon=True).start()
+
+
+class _LazyClient:
+    """
+    Se comporta como el cliente de OpenAI pero no lo crea hasta el primer uso.
+    """
+
+    def __init__(self, getter):
+        self._getter = getter
+
+    def __getattr__(self, name):
+        return getattr(self._getter(), name)
+
+
+# Fábrica compartida por el proceso
+openai_factory = OpenAIClientFactory(OPENAI_API_KEY, OPENAI_BASE_URL)
+client = _LazyClient(openai_factory.client)
+async_client = _LazyClient(openai_factory.async_client)
@@ -0,0 +1,417 @@
+import asyncio
+import collections
+import os
+import threading
+import time
+
+from instrumentation import log, metrics
+
+# Segundos máximos de un run (tool calls incluidas); pasado ese tiempo se cancela
+RUN_DEADLINE_SECONDS = float(os.environ.get('RUN_DEADLINE_SECONDS', '180'))
+# Segundos que se espera a que un run cancelado termine de cancelarse
+RUN_CANCEL_GRACE_SECONDS = float(os.environ.get('RUN_CANCEL_GRACE_SECONDS', '10'))
+# Intervalo mínimo y máximo entre dos consultas del estado de un run
+RUN_POLL_MIN_SECONDS = float(os.environ.get('RUN_POLL_MIN_SECONDS', '0.5'))
+RUN_POLL_MAX_SECONDS = float(os.environ.get('RUN_POLL_MAX_SECONDS', '5'))
+# Factor de crecimiento del intervalo cuando el run ya tarda más de lo esperado
+RUN_POLL_BACKOFF = float(os.environ.get('RUN_POLL_BACKOFF', '1.5'))
+# Peso de cada tramo nuevo en la media móvil (EWMA) de duración por tipo de run y modelo
+RUN_DURATION_EWMA_ALPHA = float(os.environ.get('RUN_DURATION_EWMA_ALPHA', '0.3'))
+# Medias de duración (tipo de run y modelo) que se guardan en memoria
+RUN_DURATION_MAX_KEYS = int(os.environ.get('RUN_DURATION_MAX_KEYS', '64'))
+# Mensajes en cola de un mismo thread que se envían juntos en el siguiente run
+RUN_BATCH_MAX_MESSAGES = int(os.environ.get('RUN_BATCH_MAX_MESSAGES', '10'))
+
+# Estados en los que el run sigue en marcha y hay que volver a consultarlo
+_ACTIVE_STATUSES = {"queued", "in_progress", "cancelling"}
+
+_polls_total = metrics.counter("run_polls_total", "Consultas del estado de un run.")
+_batches_total = metrics.counter("run_batches_total", "Runs lanzados por el planificador.")
+_batched_messages_total = metrics.counter("run_batched_messages_total",
+                                          "Mensajes de usuario enviados en runs del planificador.")
+_cancelled_total = metrics.counter("runs_cancelled_total", "Runs cancelados por superar el plazo.")
+_active_elsewhere_total = metrics.counter("run_active_elsewhere_total",
+                                          "Lotes que esperaron a un run activo lanzado por otro proceso.")
+
+
+def is_active_run_conflict(error: Exception) -> bool:
+    """
+    400 de OpenAI porque el thread ya tiene un run activo ("already has an
+    active run", "while a run ... is active"): lo lanzó otro proceso.
+    """
+    message = str(error)
+    return getattr(error, "status_code", None) == 400 and "active" in message and "run" in message
+
+
+class _Ticket:
+    """
+    Mensaje de usuario en cola para un thread. El primero de la cola es el
+    líder: envía los mensajes del lote y lanza el run; los demás esperan el
+    resultado.
+    """
+
+    def __init__(self, thread_id: str, assistant_id: str, content: str, file_ids: list):
+        self.thread_id = thread_id
+        self.assistant_id = assistant_id
+        self.content = content
+        self.file_ids = file_ids or []
+        self.enqueued_at = time.monotonic()
+        self.turn = threading.Event()
+        self.leader = False
+        self.done = False
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.sent = False  # mensaje ya creado en el thread: un reintento del lote no lo repite
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class RunClock:
+    """
+    Reloj de un run: cuánto esperar hasta la siguiente consulta y cuándo
+    vence el plazo. Cada tramo (desde que se crea el run o se envían los
+    tool outputs hasta que cambia de estado) se consulta poco antes de su
+    duración esperada y, si tarda más (o aún no hay media), cada vez menos
+    a menudo. 'kind' separa las medias de runs de distinta naturaleza
+    (turnos de chat, redacciones).
+    """
+
+    def __init__(self, kind: str, deadline_seconds: float):
+        self.kind = kind
+        self.key = None
+        self.expected = None
+        self.deadline = time.monotonic() + deadline_seconds
+        self.cancel_requested = False
+        self.begin_step()
+
+    def begin_step(self, key: str = None, expected: float = None):
+        self.key = key or self.key
+        self.expected = expected
+        self.step_started = time.monotonic()
+        self._late_polls = 0
+
+    def step_elapsed(self) -> float:
+        return time.monotonic() - self.step_started
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def next_delay(self) -> float:
+        if self.cancel_requested:
+            return RUN_POLL_MIN_SECONDS
+        remaining = self.expected - self.step_elapsed() if self.expected else 0
+        if remaining > RUN_POLL_MIN_SECONDS:
+            # Primera consulta a 3/4 de lo que falta: si el tramo acaba antes no se espera de más
+            delay = remaining * 0.75
+        else:
+            delay = RUN_POLL_MIN_SECONDS * (RUN_POLL_BACKOFF ** self._late_polls)
+            self._late_polls += 1
+        until_deadline = self.deadline - time.monotonic()
+        return max(RUN_POLL_MIN_SECONDS, min(delay, RUN_POLL_MAX_SECONDS, until_deadline))
+
+
+class RunScheduler:
+    """
+    Runs de los threads de la API:
+      - un solo run activo por thread: los mensajes que llegan mientras hay
+        un run en marcha se encolan y se envían juntos en el siguiente run
+        (todas las peticiones del lote reciben la misma respuesta). La cola
+        es por proceso: si el run activo es de otro worker, OpenAI responde
+        400 y el lote se reintenta cuando ese run termina (retry_while_active);
+      - el estado del run se consulta según la duración media (EWMA) de los
+        runs del mismo tipo y modelo, en lugar de a intervalo fijo (los
+        assistants son efímeros: una media por assistant no llegaría a servir);
+      - los runs que superan RUN_DEADLINE_SECONDS se cancelan; si tampoco
+        terminan de cancelarse en RUN_CANCEL_GRACE_SECONDS se dan por
+        vencidos (status 'expired').
+    Sirve tanto a las rutas de Flask (hilos) como a las de asgi_app (asyncio).
+    """
+
+    def __init__(self, batch_max_messages: int):
+        self.batch_max_messages = batch_max_messages
+        self._queues = {}  # thread_id -> deque de _Ticket en espera
+        self._running = set()  # threads con un líder lanzando su run
+        self._durations = collections.OrderedDict()  # "tipo:modelo" -> EWMA de la duración de los tramos
+        self._batches = 0
+        self._batched_messages = 0
+        self._cancelled = 0
+        self._lock = threading.Lock()
+
+    # ---- cola por thread ---------------------------------------------------
+
+    def enqueue(self, thread_id: str, assistant_id: str, content: str, file_ids: list = None) -> _Ticket:
+        ticket = _Ticket(thread_id, assistant_id, content, file_ids)
+        with self._lock:
+            queue = self._queues.get(thread_id)
+            if queue is None:
+                queue = self._queues[thread_id] = collections.deque()
+            queue.append(ticket)
+            if thread_id not in self._running:
+                self._running.add(thread_id)
+                ticket.leader = True
+                ticket.turn.set()
+        return ticket
+
+    def wait_turn(self, ticket: _Ticket) -> bool:
+        """
+        Bloquea hasta que el mensaje sea el líder de la cola (True: hay que
+        lanzar el run del lote) o hasta que otro run lo haya respondido (False).
+        """
+        ticket.turn.wait()
+        return ticket.leader and not ticket.done and not ticket.abandoned
+
+    def take_batch(self, ticket: _Ticket) -> list:
+        """
+        Saca de la cola el lote del líder: sus mensajes pendientes para el
+        mismo assistant, en orden de llegada. Los abandonados se descartan.
+        """
+        with self._lock:
+            queue = self._queues[ticket.thread_id]
+            batch, rest = [], collections.deque()
+            for queued in queue:
+                if queued.abandoned:
+                    queued.turn.set()
+                elif queued.assistant_id == ticket.assistant_id and len(batch) < self.batch_max_messages:
+                    batch.append(queued)
+                else:
+                    rest.append(queued)
+            self._queues[ticket.thread_id] = rest
+            self._batches += 1
+            self._batched_messages += len(batch)
+        _batches_total.inc()
+        _batched_messages_total.inc(len(batch))
+        return batch
+
+    def complete(self, ticket: _Ticket, batch: list, result=None, error: Exception = None):
+        """
+        Entrega el resultado del run a todo el lote y cede el turno al
+        siguiente mensaje en cola del thread.
+        """
+        with self._lock:
+            self._hand_off(ticket.thread_id)
+        for queued in batch:
+            queued.result = result
+            queued.error = error
+            queued.done = True
+            queued.turn.set()
+
+    def abandon(self, ticket: _Ticket):
+        """
+        La petición del mensaje se ha cancelado mientras esperaba turno. Si
+        ya era el líder, el turno pasa al siguiente. Se despierta al hilo que
+        espera el turno (wait_turn devuelve False) para que no quede colgado.
+        """
+        with self._lock:
+            ticket.abandoned = True
+            if ticket.leader and not ticket.done:
+                self._hand_off(ticket.thread_id)
+        ticket.turn.set()
+
+    def _hand_off(self, thread_id: str):
+        # Con el lock tomado. Los líderes abandonados se descartan (nadie espera su respuesta)
+        queue = self._queues.get(thread_id)
+        while queue and queue[0].abandoned:
+            queue.popleft().turn.set()
+        if queue:
+            queue[0].leader = True
+            queue[0].turn.set()
+            return
+        self._queues.pop(thread_id, None)
+        self._running.discard(thread_id)
+
+    def run(self, thread_id: str, assistant_id: str, content: str, file_ids: list, execute):
+        """
+        Envía un mensaje al thread y devuelve el resultado de su run.
+        'execute(batch)' lo ejecuta el líder: crea los mensajes del lote
+        (lista de _Ticket con content y file_ids), lanza el run y devuelve el
+        resultado que reciben todas las peticiones del lote.
+        """
+        ticket = self.enqueue(thread_id, assistant_id, content, file_ids)
+        if self.wait_turn(ticket):
+            batch = self.take_batch(ticket)
+            try:
+                result = self.retry_while_active(thread_id, lambda: execute(batch))
+            except Exception as e:
+                self.complete(ticket, batch, error=e)
+                raise
+            self.complete(ticket, batch, result)
+        return ticket.outcome()
+
+    async def run_async(self, thread_id: str, assistant_id: str, content: str, file_ids: list, execute):
+        """
+        Igual que run(), con 'execute' asíncrono. La espera del turno ocupa
+        un hilo sólo mientras hay otro run del mismo thread en marcha.
+        """
+        ticket = self.enqueue(thread_id, assistant_id, content, file_ids)
+        try:
+            leader = ticket.leader or await asyncio.to_thread(self.wait_turn, ticket)
+        except asyncio.CancelledError:
+            self.abandon(ticket)
+            raise
+        if leader:
+            batch = self.take_batch(ticket)
+            try:
+                result = await self.retry_while_active_async(thread_id, lambda: execute(batch))
+            except asyncio.CancelledError:
+                self.complete(ticket, batch, error=RuntimeError("Run request was cancelled"))
+                raise
+            except Exception as e:
+                self.complete(ticket, batch, error=e)
+                raise
+            self.complete(ticket, batch, result)
+        return ticket.outcome()
+
+    # ---- runs activos de otros procesos ------------------------------------
+
+    def retry_while_active(self, thread_id: str, call):
+        """
+        Ejecuta 'call()' y, mientras falle porque otro proceso tiene un run
+        activo en el thread, espera (con el mismo backoff que las consultas)
+        y lo repite. Se rinde pasado el plazo de un run más su cancelación.
+        """
+        started, attempt = time.monotonic(), 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                delay = self._active_run_delay(thread_id, e, started, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+
+    async def retry_while_active_async(self, thread_id: str, call):
+        """
+        Igual que retry_while_active(), con 'call' asíncrono.
+        """
+        started, attempt = time.monotonic(), 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._active_run_delay(thread_id, e, started, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _active_run_delay(thread_id: str, error: Exception, started: float, attempt: int):
+        # Segundos hasta el siguiente intento, o None si hay que propagar el error
+        if not is_active_run_conflict(error):
+            return None
+        if time.monotonic() - started >= RUN_DEADLINE_SECONDS + RUN_CANCEL_GRACE_SECONDS:
+            return None
+        if attempt == 0:
+            _active_elsewhere_total.inc()
+            log("run.active_elsewhere", thread_id=thread_id, error=str(error))
+        return min(RUN_POLL_MIN_SECONDS * (RUN_POLL_BACKOFF ** attempt), RUN_POLL_MAX_SECONDS)
+
+    # ---- consulta adaptativa y plazo ---------------------------------------
+
+    def clock(self, kind: str = "chat") -> RunClock:
+        return RunClock(kind, RUN_DEADLINE_SECONDS)
+
+    def observe(self, key: str, seconds: float):
+        """
+        Suma la duración de un tramo de run a la media de su clave (tipo de
+        run y modelo).
+        """
+        with self._lock:
+            previous = self._durations.get(key)
+            self._durations[key] = seconds if previous is None else (
+                RUN_DURATION_EWMA_ALPHA * seconds + (1 - RUN_DURATION_EWMA_ALPHA) * previous)
+            self._durations.move_to_end(key)
+            while len(self._durations) > RUN_DURATION_MAX_KEYS:
+                self._durations.popitem(last=False)
+
+    def poll(self, client, thread_id: str, run, clock: RunClock):
+        """
+        Consulta el run hasta que deja de estar en marcha (completed,
+        requires_action, failed...). Si vence el plazo lo cancela; si
+        tampoco termina de cancelarse, lo devuelve como 'expired'.
+        """
+        self._begin_step(clock, run)
+        while run.status in _ACTIVE_STATUSES:
+            if self._should_cancel(clock):
+                run = client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+                self._cancelled_run(thread_id, run, clock)
+                continue
+            if self._cancel_timed_out(clock):
+                run = self._expired(thread_id, run)
+                break
+            time.sleep(clock.next_delay())
+            run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+            _polls_total.inc()
+        self._finished(run, clock)
+        return run
+
+    async def poll_async(self, client, thread_id: str, run, clock: RunClock):
+        """
+        Igual que poll(), con el cliente asíncrono.
+        """
+        self._begin_step(clock, run)
+        while run.status in _ACTIVE_STATUSES:
+            if self._should_cancel(clock):
+                run = await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+                self._cancelled_run(thread_id, run, clock)
+                continue
+            if self._cancel_timed_out(clock):
+                run = self._expired(thread_id, run)
+                break
+            await asyncio.sleep(clock.next_delay())
+            run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+            _polls_total.inc()
+        self._finished(run, clock)
+        return run
+
+    def _begin_step(self, clock: RunClock, run):
+        key = f"{clock.kind}:{getattr(run, 'model', None) or 'default'}"
+        with self._lock:
+            expected = self._durations.get(key)
+        clock.begin_step(key, expected)
+
+    @staticmethod
+    def _should_cancel(clock: RunClock) -> bool:
+        return not clock.cancel_requested and clock.expired()
+
+    @staticmethod
+    def _cancel_timed_out(clock: RunClock) -> bool:
+        return clock.cancel_requested and time.monotonic() >= clock.deadline + RUN_CANCEL_GRACE_SECONDS
+
+    def _cancelled_run(self, thread_id: str, run, clock: RunClock):
+        clock.cancel_requested = True
+        with self._lock:
+            self._cancelled += 1
+        _cancelled_total.inc()
+        log("run.deadline_cancelled", thread_id=thread_id, run_id=run.id, deadline_seconds=RUN_DEADLINE_SECONDS)
+
+    @staticmethod
+    def _expired(thread_id: str, run):
+        # El run puede seguir activo en OpenAI, pero quien espera no debe tratarlo como en marcha
+        log("run.cancel_timed_out", thread_id=thread_id, run_id=run.id, status=run.status,
+            grace_seconds=RUN_CANCEL_GRACE_SECONDS)
+        return run.model_copy(update={"status": "expired"})
+
+    def _finished(self, run, clock: RunClock):
+        if run.status in ("completed", "requires_action") and not clock.cancel_requested:
+            self.observe(clock.key, clock.step_elapsed())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active_threads": len(self._queues),
+                "queued_messages": sum(len(queue) for queue in self._queues.values()),
+                "batches": self._batches,
+                "batched_messages": self._batched_messages,
+                "cancelled_runs": self._cancelled,
+                "expected_seconds": {key: round(seconds, 3) for key, seconds in self._durations.items()},
+            }
+
+
+# Planificador de runs compartido por el proceso
+run_scheduler = RunScheduler(RUN_BATCH_MAX_MESSAGES)
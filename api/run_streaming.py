@@ -0,0 +1,149 @@
+import json
+import time
+
+from context_budget import usage_of
+from instrumentation import log
+
+# Estados finales de un run que no son 'completed'
+_FAILED_RUN_EVENTS = {
+    "thread.run.failed": "failed",
+    "thread.run.cancelled": "cancelled",
+    "thread.run.expired": "expired",
+    "thread.run.incomplete": "incomplete",
+}
+_FINISHED_RUN_EVENTS = {"thread.run.completed", *_FAILED_RUN_EVENTS}
+
+
+def format_sse(event: str, payload: dict) -> str:
+    """
+    Serializa un evento en formato Server-Sent Events.
+    """
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _stream_options(deadline) -> dict:
+    """
+    Timeout de lectura del stream hasta el plazo del run: un stream que deja
+    de enviar eventos no espera más allá del deadline.
+    """
+    if deadline is None:
+        return {}
+    import httpx
+    from openai_client import OPENAI_CONNECT_TIMEOUT, OPENAI_TIMEOUT
+    read = max(0.1, deadline - time.monotonic())
+    return {"timeout": httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT, read=read)}
+
+
+def _cancel(client, thread_id: str, run_id: str):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        log("run.deadline_cancelled", thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        log("run.cancel_error", thread_id=thread_id, run_id=run_id, error=str(e))
+
+
+def stream_run(client, thread_id: str, assistant_id: str, tool_handler, run_options=None, deadline=None):
+    """
+    Lanza un run en modo streaming y va devolviendo (evento, payload) a medida
+    que llegan:
+      - 'delta':           fragmento de texto del assistant
+      - 'tool_call':       progreso de una tool call (file_search o function)
+      - 'tool_output':     resultado de una function call ejecutada en línea
+      - 'message':         mensaje completo del assistant
+      - 'done' / 'error':  fin del run (con el 'usage' de tokens si lo hay)
+
+    'tool_handler(tool_calls)' ejecuta juntas las function calls que pide el
+    run y devuelve sus tool outputs ({"tool_call_id", "output"}) en el mismo
+    orden; se llama en cuanto el run pide la acción.
+    Si se pasa 'deadline' (time.monotonic()) y el run sigue en marcha al
+    llegar, se cancela; el stream termina con un 'error' de estado
+    'cancelled'. También si el stream se queda sin eventos hasta el plazo.
+    """
+    import httpx
+    import openai
+
+    response_text = None
+    run_id = None
+    cancel_requested = False
+
+    try:
+        stream = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            stream=True,
+            **(run_options or {}),
+            **_stream_options(deadline)
+        )
+        while stream is not None:
+            next_stream = None
+            with stream:
+                for event in stream:
+                    name = event.event
+                    if name.startswith("thread.run.") and not name.startswith("thread.run.step."):
+                        run_id = event.data.id
+                    if (deadline is not None and not cancel_requested and run_id and time.monotonic() >= deadline
+                            and name not in _FINISHED_RUN_EVENTS):
+                        cancel_requested = True
+                        _cancel(client, thread_id, run_id)
+
+                    if name == "thread.message.delta":
+                        for part in event.data.delta.content or []:
+                            if part.type == "text" and part.text and part.text.value:
+                                yield "delta", {"text": part.text.value}
+
+                    elif name == "thread.message.completed":
+                        for part in event.data.content:
+                            if part.type == "text":
+                                response_text = part.text.value
+                                yield "message", {"message_id": event.data.id, "text": response_text}
+                                break
+
+                    elif name == "thread.run.step.delta":
+                        step_details = event.data.delta.step_details
+                        if step_details is not None and step_details.type == "tool_calls":
+                            for tool_call in step_details.tool_calls or []:
+                                progress = {"index": tool_call.index, "id": tool_call.id, "type": tool_call.type,
+                                            "status": "in_progress"}
+                                if tool_call.type == "function" and tool_call.function is not None:
+                                    progress["name"] = tool_call.function.name
+                                yield "tool_call", progress
+
+                    elif name == "thread.run.requires_action":
+                        run = event.data
+                        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                        for tool_call in tool_calls:
+                            yield "tool_call", {"id": tool_call.id, "type": "function",
+                                                "name": tool_call.function.name, "status": "running"}
+                        tool_outputs = tool_handler(tool_calls)
+                        for tool_call, tool_output in zip(tool_calls, tool_outputs):
+                            yield "tool_output", {"id": tool_call.id, "name": tool_call.function.name,
+                                                  "output": json.loads(tool_output["output"])}
+
+                        next_stream = client.beta.threads.runs.submit_tool_outputs(
+                            thread_id=thread_id,
+                            run_id=run.id,
+                            tool_outputs=tool_outputs,
+                            stream=True,
+                            **_stream_options(deadline)
+                        )
+
+                    elif name == "thread.run.completed":
+                        yield "done", {"run_id": event.data.id,
+                                       "response": response_text or "[No assistant response found]",
+                                       "usage": usage_of(event.data)}
+
+                    elif name in _FAILED_RUN_EVENTS:
+                        last_error = event.data.last_error
+                        yield "error", {"run_id": event.data.id, "status": _FAILED_RUN_EVENTS[name],
+                                        "message": last_error.message if last_error else None,
+                                        "usage": usage_of(event.data)}
+
+                    elif name == "error":
+                        yield "error", {"status": "error", "message": event.data.message}
+
+            stream = next_stream
+    except (httpx.TimeoutException, openai.APITimeoutError):
+        # El stream se quedó sin eventos hasta el plazo: se cancela el run
+        if run_id and not cancel_requested:
+            _cancel(client, thread_id, run_id)
+        yield "error", {"run_id": run_id, "status": "cancelled", "message": "Run timed out", "usage": None}
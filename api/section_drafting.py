@@ -0,0 +1,163 @@
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import document_manipulation
+from document_model import document_store
+from embedding_pipeline import SEARCH_DOCUMENTS_TOOL, get_local_retrieval, is_local_session
+from instrumentation import log, span
+from run_scheduler import run_scheduler
+
+# Secciones que se redactan a la vez (cada una es un run independiente)
+DRAFT_MAX_WORKERS = int(os.environ.get('DRAFT_MAX_WORKERS', '6'))
+
+DRAFT_INSTRUCTIONS = (
+    "\nYou are drafting a single section of the invention disclosure from the documents "
+    "uploaded in this session. Search the documents, then reply ONLY with the text of the "
+    "requested section, in English, without headings, LaTeX commands or comments. If the "
+    "documents contain nothing relevant for this section, reply with an empty message."
+)
+
+
+def empty_sections(thread_id: str) -> list:
+    """
+    Secciones de la plantilla que todavía no tienen contenido.
+    """
+    document = document_store.get(thread_id)
+    return [key for key in document.sections() if not (document.get_section(key) or "").strip()]
+
+
+def unknown_sections(thread_id: str, sections: list) -> list:
+    """
+    Secciones de 'sections' que la plantilla del documento no tiene.
+    """
+    known = set(document_store.get(thread_id).sections())
+    return [key for key in sections if key not in known]
+
+
+def _draft_prompt(section_key: str) -> str:
+    title = section_key.replace("_", " ").title()
+    return (f"Draft the '{title}' section (marker <<{section_key}>>) of the invention disclosure "
+            f"using the uploaded documents.")
+
+
+def _last_assistant_text(client, thread_id: str) -> str:
+    for message in client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=5).data:
+        if message.role == "assistant":
+            for part in message.content:
+                if part.type == "text":
+                    return part.text.value
+    return ""
+
+
+def draft_section(client, assistant_id: str, vector_store_id: str, section_key: str) -> str:
+    """
+    Redacta una sección en un thread propio y desechable, con el assistant de
+    la sesión limitado a la búsqueda en documentos (no puede modificar el
+    documento por su cuenta). Devuelve el texto propuesto.
+    """
+    local = is_local_session(vector_store_id)
+    tools = [SEARCH_DOCUMENTS_TOOL] if local else [{"type": "file_search"}]
+
+    # Las redacciones tardan distinto que los turnos de chat: su duración media se lleva aparte
+    clock = run_scheduler.clock("draft")
+    thread = client.beta.threads.create(messages=[{"role": "user", "content": _draft_prompt(section_key)}])
+    try:
+        run = client.beta.threads.runs.create(
+            thread_id=thread.id,
+            assistant_id=assistant_id,
+            tools=tools,
+            additional_instructions=DRAFT_INSTRUCTIONS,
+        )
+        run = run_scheduler.poll(client, thread.id, run, clock)
+        while run.status == "requires_action":
+            tool_outputs = []
+            for tool_call in run.required_action.submit_tool_outputs.tool_calls:
+                if local and tool_call.function.name == "search_documents":
+                    query = json.loads(tool_call.function.arguments)["Query"]
+                    output = {"results": get_local_retrieval(client).search(vector_store_id, query)}
+                else:
+                    output = {"error": f"Function {tool_call.function.name} is not available while drafting"}
+                tool_outputs.append({"tool_call_id": tool_call.id, "output": json.dumps(output, ensure_ascii=False)})
+            run = client.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread.id, run_id=run.id, tool_outputs=tool_outputs)
+            run = run_scheduler.poll(client, thread.id, run, clock)
+
+        if run.status != "completed":
+            raise RuntimeError(f"Draft run ended with status '{run.status}'")
+        return _last_assistant_text(client, thread.id).strip()
+    finally:
+        try:
+            client.beta.threads.delete(thread_id=thread.id)
+        except Exception as e:
+            log("draft.cleanup_error", thread_id=thread.id, error=str(e))
+
+
+def _timed_draft(client, assistant_id: str, vector_store_id: str, section_key: str) -> tuple:
+    started = time.perf_counter()
+    with span("draft.section", section=section_key):
+        content = draft_section(client, assistant_id, vector_store_id, section_key)
+    return content, round(time.perf_counter() - started, 3)
+
+
+def draft_sections(client, thread_id: str, assistant_id: str, vector_store_id: str,
+                   sections: list = None, max_workers: int = None):
+    """
+    Redacta en paralelo (pool acotado) las secciones vacías del documento, o
+    las indicadas en 'sections', y va devolviendo (evento, payload):
+      - 'plan':            secciones que se van a redactar
+      - 'section_drafted': texto propuesto para una sección, en cuanto termina
+      - 'section_failed':  la sección no se pudo redactar
+      - 'applied':         secciones escritas (una sola escritura y una compilación)
+                           y las descartadas porque se editaron mientras tanto
+      - 'done':            resumen con el tiempo total
+    """
+    started = time.perf_counter()
+    document = document_store.get(thread_id)
+    targets = sections if sections is not None else empty_sections(thread_id)
+    # Contenido de cada sección al empezar: el borrador sólo se escribe si no cambió
+    expected = {key: document.get_section(key) for key in targets}
+    yield "plan", {"thread_id": thread_id, "sections": targets}
+
+    drafts = {}
+    failed = []
+    if targets:
+        max_workers = max_workers or DRAFT_MAX_WORKERS
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets)), thread_name_prefix="draft") as executor:
+            # Cada tarea con el contexto de la petición, para que sus spans entren en la traza
+            futures = {
+                executor.submit(contextvars.copy_context().run, _timed_draft,
+                                client, assistant_id, vector_store_id, section_key): section_key
+                for section_key in targets
+            }
+            for future in as_completed(futures):
+                section_key = futures[future]
+                try:
+                    content, seconds = future.result()
+                except Exception as e:
+                    failed.append(section_key)
+                    log("draft.error", section=section_key, error=str(e))
+                    yield "section_failed", {"section": section_key, "error": str(e)}
+                    continue
+                if content:
+                    drafts[section_key] = content
+                yield "section_drafted", {"section": section_key, "content": content, "seconds": seconds}
+
+    # Todas las secciones en una única escritura atómica y una sola compilación
+    applied = []
+    if drafts:
+        with document_manipulation.batch_edit(thread_id, expected=expected) as batch:
+            for section_key, content in drafts.items():
+                batch.set(section_key, content)
+        if batch.error is not None:
+            raise batch.error
+        applied = batch.applied
+    yield "applied", {"sections": applied, "skipped": [key for key in drafts if key not in applied]}
+
+    yield "done", {
+        "drafted": len(drafts),
+        "failed": failed,
+        "total_seconds": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,195 @@
+import asyncio
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from ephemeral_assistant import (
+    create_ephemeral_resources,
+    create_ephemeral_resources_async,
+    activate_ephemeral_conversation,
+)
+from instrumentation import log
+from session_reaper import session_reaper
+
+# Configuración del pool (0 = pool desactivado, /start crea todo en el momento).
+# Es el total compartido por todos los procesos de la API, no por proceso.
+SESSION_POOL_SIZE = int(os.environ.get('SESSION_POOL_SIZE', '0'))
+# Segundos de espera entre dos creaciones consecutivas del hilo de relleno
+SESSION_POOL_REFILL_INTERVAL = float(os.environ.get('SESSION_POOL_REFILL_INTERVAL', '1'))
+# Segundos que una sesión puede esperar en el pool antes de descartarse
+SESSION_POOL_MAX_IDLE = float(os.environ.get('SESSION_POOL_MAX_IDLE', '3600'))
+# Duración (segundos) de la concesión de relleno: si el proceso que rellena
+# muere, otro toma el relevo pasado este tiempo
+SESSION_POOL_LEASE_SECONDS = float(os.environ.get('SESSION_POOL_LEASE_SECONDS', '30'))
+
+
+class SessionPool:
+    """
+    Mantiene N tripletas (thread_id, assistant_id, vector_store_id) listas para
+    entregar en /start. Las sesiones precalentadas se guardan en la base de
+    datos del reaper (marcadas como 'pooled'): quedan registradas para su
+    limpieza desde que se crean (si el proceso muere, el reaper las borra al
+    caducar) y cualquier proceso de la API puede entregarlas. Sólo rellena el
+    pool el proceso que tiene la concesión de relleno, así que con varios
+    workers sigue habiendo N sesiones en espera, no N por worker.
+    """
+
+    def __init__(self, size: int, refill_interval: float, max_idle: float, lease_seconds: float):
+        self.size = size
+        self.refill_interval = refill_interval
+        self.max_idle = max_idle
+        self.lease_seconds = lease_seconds
+        self._owner = uuid.uuid4().hex
+        self._db = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._worker = None
+        self.refilling = False
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.errors = 0
+
+    def start(self):
+        """
+        Arranca el hilo de relleno (idempotente).
+        """
+        if self.size <= 0 or self._worker is not None:
+            return
+        self._db = sqlite3.connect(session_reaper.db_path, timeout=30, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS pool_lease (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                owner TEXT,
+                expires_at REAL NOT NULL
+            );
+            INSERT OR IGNORE INTO pool_lease (id, owner, expires_at) VALUES (1, NULL, 0);
+        """)
+        self._db.commit()
+        self._worker = threading.Thread(target=self._refill_loop, name="session-pool-refill", daemon=True)
+        self._worker.start()
+        log("session_pool.started", size=self.size, refill_interval=self.refill_interval)
+
+    def stop(self):
+        """
+        Detiene el relleno y cede la concesión a otro proceso. Las sesiones
+        que no llegaron a entregarse siguen en el pool compartido; el reaper
+        las borra cuando caducan.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("UPDATE pool_lease SET owner = NULL, expires_at = 0 WHERE id = 1 AND owner = ?",
+                                 (self._owner,))
+                self._db.commit()
+
+    def acquire(self):
+        """
+        Entrega una sesión activada. Si el pool está vacío, la crea en el momento
+        (miss) para que /start nunca falle por falta de sesiones precalentadas.
+        """
+        session = self._take()
+        if session is None:
+            session = create_ephemeral_resources()
+
+        thread_id, assistant_id, vector_store_id = session
+        activate_ephemeral_conversation(thread_id, assistant_id, vector_store_id)
+        return thread_id, assistant_id, vector_store_id
+
+    async def acquire_async(self, async_client):
+        """
+        Igual que acquire(), pero en un miss crea la sesión con AsyncOpenAI. Lo
+        que bloquea (SQLite del reaper, copia de la plantilla) va en un hilo
+        para no parar el event loop.
+        """
+        session = await asyncio.to_thread(self._take)
+        if session is None:
+            session = await create_ephemeral_resources_async(async_client)
+
+        thread_id, assistant_id, vector_store_id = session
+        await asyncio.to_thread(activate_ephemeral_conversation, thread_id, assistant_id, vector_store_id)
+        return thread_id, assistant_id, vector_store_id
+
+    def _take(self):
+        """
+        Saca una sesión del pool (o None) y contabiliza el hit/miss.
+        """
+        session = session_reaper.claim_pooled() if self.size > 0 else None
+        with self._lock:
+            if session is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        # Avisamos al hilo de relleno de que hay hueco (si rellena este proceso)
+        self._wakeup.set()
+        return session
+
+    def stats(self) -> dict:
+        ready = session_reaper.pooled_count() if self.size > 0 else 0
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": self.size,
+                "ready": ready,
+                "refilling": self.refilling,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else None,
+                "created": self.created,
+                "errors": self.errors,
+                "refill_interval": self.refill_interval,
+            }
+
+    def _hold_lease(self) -> bool:
+        """
+        Toma o renueva la concesión de relleno. True si este proceso rellena.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE pool_lease SET owner = ?, expires_at = ? WHERE id = 1 AND (owner = ? OR expires_at < ?)",
+                (self._owner, now + self.lease_seconds, self._owner, now)
+            )
+            self._db.commit()
+            self.refilling = cursor.rowcount == 1
+        return self.refilling
+
+    def _refill_loop(self):
+        while not self._stopped.is_set():
+            try:
+                missing = self.size - session_reaper.pooled_count() if self._hold_lease() else 0
+            except sqlite3.Error as e:
+                log("session_pool.state_error", error=str(e))
+                missing = 0
+
+            if missing <= 0:
+                # Pool lleno (u otro proceso rellena): se vuelve a mirar antes de que caduque la concesión
+                self._wakeup.wait(timeout=self.lease_seconds / 3)
+                self._wakeup.clear()
+                continue
+
+            try:
+                thread_id, assistant_id, vector_store_id = create_ephemeral_resources()
+                # Registrada desde ya: si el proceso muere, el reaper la limpia al caducar
+                session_reaper.schedule(thread_id, assistant_id, vector_store_id, self.max_idle, pooled=True)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                log("session_pool.create_error", error=str(e))
+            else:
+                with self._lock:
+                    self.created += 1
+
+            self._stopped.wait(timeout=self.refill_interval)
+
+
+# Pool compartido por la aplicación
+session_pool = SessionPool(SESSION_POOL_SIZE, SESSION_POOL_REFILL_INTERVAL, SESSION_POOL_MAX_IDLE,
+                           SESSION_POOL_LEASE_SECONDS)
+atexit.register(session_pool.stop)
@@ -0,0 +1,316 @@
+import heapq
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import log
+
+# Base de datos local con las sesiones pendientes de limpiar (sobrevive a reinicios)
+REAPER_DB_PATH = os.environ.get('REAPER_DB_PATH', 'sessions.db')
+# Sesiones que se limpian en paralelo y máximo de sesiones limpiadas por segundo
+REAPER_MAX_CONCURRENCY = int(os.environ.get('REAPER_MAX_CONCURRENCY', '4'))
+REAPER_RATE_LIMIT = float(os.environ.get('REAPER_RATE_LIMIT', '5'))
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', '20'))
+# Reintento (segundos) de las sesiones cuya limpieza falló
+REAPER_RETRY_DELAY = float(os.environ.get('REAPER_RETRY_DELAY', '60'))
+REAPER_MAX_ATTEMPTS = int(os.environ.get('REAPER_MAX_ATTEMPTS', '5'))
+# Segundos tras los que la limpieza reclamada por un proceso que no la terminó
+# (p. ej. porque murió) puede reclamarla otro
+REAPER_CLAIM_TIMEOUT = float(os.environ.get('REAPER_CLAIM_TIMEOUT', '300'))
+
+# Vida mínima (segundos) que debe quedarle a una sesión del pool para entregarla
+_CLAIM_MARGIN_SECONDS = 60
+
+
+class _RateLimiter:
+    """
+    Token bucket sencillo: como mucho 'rate' adquisiciones por segundo.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SessionReaper:
+    """
+    Planificador único de la limpieza de sesiones efímeras: un heap ordenado por
+    expiración y un solo hilo, en lugar de un threading.Timer por sesión. Las
+    sesiones (y los archivos subidos en ellas) se guardan en SQLite, así que la
+    limpieza pendiente no se pierde al reiniciar el proceso. Si varios procesos
+    comparten la base de datos, cada sesión la limpia el que la reclama primero.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                thread_id TEXT PRIMARY KEY,
+                assistant_id TEXT NOT NULL,
+                vector_store_id TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                pooled INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                claimed_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS session_files (
+                thread_id TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                PRIMARY KEY (thread_id, file_id)
+            );
+        """)
+        # Bases de datos anteriores a las sesiones del pool y a la reclamación
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+        for column, definition in (("pooled", "INTEGER NOT NULL DEFAULT 0"), ("owner", "TEXT"),
+                                   ("claimed_at", "REAL")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE sessions ADD COLUMN {column} {definition}")
+        self._db.commit()
+        self._owner = uuid.uuid4().hex
+        self._lock = threading.Condition()
+        self._heap = []        # (expires_at, thread_id)
+        self._expiry = {}      # thread_id -> expires_at vigente (para descartar entradas viejas del heap)
+        self._cleanup = None
+        self._worker = None
+        self._stopped = False
+        self._limiter = _RateLimiter(REAPER_RATE_LIMIT)
+        self._executor = ThreadPoolExecutor(max_workers=REAPER_MAX_CONCURRENCY, thread_name_prefix="reaper")
+        self.reaped = 0
+        self.failed = 0
+
+    def start(self, cleanup):
+        """
+        Carga las sesiones pendientes y arranca el hilo planificador.
+        'cleanup(assistant_id, vector_store_id, thread_id, file_ids)' borra los
+        recursos de una sesión.
+        """
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._cleanup = cleanup
+            for thread_id, expires_at in self._db.execute("SELECT thread_id, expires_at FROM sessions"):
+                self._expiry[thread_id] = expires_at
+                heapq.heappush(self._heap, (expires_at, thread_id))
+            self._worker = threading.Thread(target=self._loop, name="session-reaper", daemon=True)
+            self._worker.start()
+            log("session_reaper.started", pending=len(self._expiry))
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+
+    def schedule(self, thread_id: str, assistant_id: str, vector_store_id: str, ttl_seconds: float,
+                 pooled: bool = False):
+        """
+        Registra (o reprograma) la limpieza de una sesión. Las sesiones
+        precalentadas (pooled) quedan además disponibles para claim_pooled().
+        """
+        expires_at = time.time() + ttl_seconds
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (thread_id, assistant_id, vector_store_id, expires_at, pooled) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (thread_id, assistant_id, vector_store_id, expires_at, int(pooled))
+            )
+            self._db.commit()
+            self._expiry[thread_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, thread_id))
+            self._lock.notify()
+
+    def claim_pooled(self):
+        """
+        Saca del pool compartido (lo haya llenado este proceso u otro) la sesión
+        precalentada más antigua que no haya caducado. Devuelve
+        (thread_id, assistant_id, vector_store_id) o None.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT thread_id, assistant_id, vector_store_id FROM sessions "
+                    "WHERE pooled = 1 AND expires_at > ? ORDER BY expires_at LIMIT 1", (time.time() + _CLAIM_MARGIN_SECONDS,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE sessions SET pooled = 0 WHERE thread_id = ?", (row[0],))
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+        return row
+
+    def pooled_count(self) -> int:
+        """
+        Sesiones precalentadas sin entregar y sin caducar (de todos los procesos).
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions WHERE pooled = 1 AND expires_at > ?",
+                                    (time.time() + _CLAIM_MARGIN_SECONDS,)).fetchone()[0]
+
+    def track_files(self, thread_id: str, file_ids: list):
+        """
+        Registra archivos subidos en la sesión para borrarlos al expirar.
+        """
+        if not file_ids:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO session_files (thread_id, file_id) VALUES (?, ?)",
+                [(thread_id, file_id) for file_id in file_ids]
+            )
+            self._db.commit()
+
+    def reap_now(self, assistant_id: str, vector_store_id: str) -> bool:
+        """
+        Limpia en el momento la sesión de ese assistant (p. ej. desde /end).
+        Devuelve False si la sesión no estaba registrada.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT thread_id FROM sessions WHERE assistant_id = ? AND vector_store_id = ?",
+                (assistant_id, vector_store_id)
+            ).fetchone()
+            if row is None:
+                return False
+            self._expiry.pop(row[0], None)
+        self._reap(row[0], force=True)
+        return True
+
+    def active_threads(self) -> set:
+        """
+        Threads de sesiones que aún no se han limpiado.
+        """
+        with self._lock:
+            return {thread_id for (thread_id,) in self._db.execute("SELECT thread_id FROM sessions")}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._expiry),
+                "next_expiry_in": (min(self._expiry.values()) - time.time()) if self._expiry else None,
+                "reaped": self.reaped,
+                "failed": self.failed,
+            }
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._stopped:
+                    self._discard_stale_heads()
+                    if self._heap and self._heap[0][0] <= time.time():
+                        break
+                    timeout = (self._heap[0][0] - time.time()) if self._heap else None
+                    self._lock.wait(timeout=timeout)
+                if self._stopped:
+                    return
+
+                due = []
+                now = time.time()
+                while self._heap and len(due) < REAPER_BATCH_SIZE:
+                    self._discard_stale_heads()
+                    if not self._heap or self._heap[0][0] > now:
+                        break
+                    _, thread_id = heapq.heappop(self._heap)
+                    self._expiry.pop(thread_id, None)
+                    due.append(thread_id)
+
+            # Lote concurrente (acotado por el pool y el rate limit)
+            list(self._executor.map(self._reap, due))
+
+    def _discard_stale_heads(self):
+        while self._heap and self._expiry.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _claim(self, thread_id: str, force: bool):
+        """
+        Reclama la limpieza de la sesión para este proceso, en una sola
+        sentencia: si otro proceso la tiene reclamada (y no ha caducado su
+        reclamación) o se reprogramó, no se toca. Devuelve la fila
+        (assistant_id, vector_store_id, attempts) o None.
+        """
+        now = time.time()
+        claimed = self._db.execute(
+            "UPDATE sessions SET owner = ?, claimed_at = ? WHERE thread_id = ? AND (expires_at <= ? OR ?) "
+            "AND (owner IS NULL OR owner = ? OR claimed_at < ?)",
+            (self._owner, now, thread_id, now, int(force), self._owner, now - REAPER_CLAIM_TIMEOUT)
+        ).rowcount
+        self._db.commit()
+        row = self._db.execute(
+            "SELECT assistant_id, vector_store_id, attempts, expires_at, owner, claimed_at FROM sessions "
+            "WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if not claimed:
+            # Otro proceso la reprogramó (p. ej. una sesión del pool que se entregó)
+            # o la está limpiando: se vuelve a mirar cuando caduque su reclamación
+            retry_at = row[3] if row[4] is None else row[5] + REAPER_CLAIM_TIMEOUT
+            self._expiry[thread_id] = retry_at
+            heapq.heappush(self._heap, (retry_at, thread_id))
+            self._lock.notify()
+            return None
+        return row[:3]
+
+    def _reap(self, thread_id: str, force: bool = False):
+        with self._lock:
+            row = self._claim(thread_id, force)
+            if row is None:
+                return
+            file_ids = [file_id for (file_id,) in self._db.execute(
+                "SELECT file_id FROM session_files WHERE thread_id = ?", (thread_id,))]
+        assistant_id, vector_store_id, attempts = row
+
+        self._limiter.acquire()
+        try:
+            self._cleanup(assistant_id, vector_store_id, thread_id, file_ids)
+        except Exception as e:
+            log("session_reaper.error", thread_id=thread_id, attempts=attempts + 1, error=str(e))
+            with self._lock:
+                self.failed += 1
+                if attempts + 1 < REAPER_MAX_ATTEMPTS:
+                    expires_at = time.time() + REAPER_RETRY_DELAY
+                    self._db.execute("UPDATE sessions SET expires_at = ?, attempts = ?, owner = NULL "
+                                     "WHERE thread_id = ?", (expires_at, attempts + 1, thread_id))
+                    self._db.commit()
+                    self._expiry[thread_id] = expires_at
+                    heapq.heappush(self._heap, (expires_at, thread_id))
+                    self._lock.notify()
+                    return
+                # Demasiados intentos: dejamos de reintentar y lo olvidamos
+                self._forget(thread_id)
+            return
+
+        with self._lock:
+            self._forget(thread_id)
+            self.reaped += 1
+        log("session_reaper.reaped", thread_id=thread_id)
+
+    def _forget(self, thread_id: str):
+        self._db.execute("DELETE FROM sessions WHERE thread_id = ?", (thread_id,))
+        self._db.execute("DELETE FROM session_files WHERE thread_id = ?", (thread_id,))
+        self._db.commit()
+
+
+# Planificador compartido por el proceso
+session_reaper = SessionReaper(REAPER_DB_PATH)
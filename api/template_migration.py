@@ -0,0 +1,183 @@
+# Migración de los documentos de generatedDocuments/ a la plantilla actual.
+# Desde la carpeta api/:
+#     python template_migration.py --dry-run        # qué documentos están desactualizados
+#     python template_migration.py                  # migrarlos todos
+#     python template_migration.py --export thread_abc thread_def
+# Cada documento lleva al final (después de \end{document}) la marca
+# '% --- template:<hash> ---' de la plantilla de la que salió. Sólo se procesan
+# los que no llevan la marca de la plantilla actual: de cada uno se extraen en
+# una pasada las secciones rellenas, se colocan en la plantilla actual y se
+# reescribe el archivo. Se puede lanzar con la API en marcha: un documento que
+# cambia mientras se migra no se sobrescribe (se compara su hash justo antes
+# del rename y queda como 'changed' para la siguiente pasada) y DocumentStore
+# vuelve a leer los archivos que cambian en disco.
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from document_model import (GENERATED_DOCUMENTS_DIR, DocumentChanged, LatexDocument, content_hash, document_path,
+                            iter_sections, write_atomic)
+from instrumentation import log
+
+_TEMPLATE_MARKER_RE = re.compile(r"^[ \t]*% --- template:([0-9a-f]+) ---[ \t]*\n?", re.MULTILINE)
+# Bytes del final del archivo en los que se busca la marca
+_MARKER_TAIL_BYTES = 512
+
+
+def template_hash(template_text: str) -> str:
+    return hashlib.sha256(template_text.encode('utf-8')).hexdigest()[:16]
+
+
+def stamp_template(text: str, digest: str) -> str:
+    """
+    Añade (o sustituye) la marca de plantilla al final del documento.
+    """
+    text = _TEMPLATE_MARKER_RE.sub("", text).rstrip("\n")
+    return f"{text}\n% --- template:{digest} ---\n"
+
+
+def new_document(template_text: str) -> str:
+    """
+    Texto de un documento nuevo: la plantilla con su marca.
+    """
+    return stamp_template(template_text, template_hash(template_text))
+
+
+def document_template_hash(path: str):
+    """
+    Hash de la plantilla de la que salió el documento (leyendo sólo el final
+    del archivo), o None si no lleva marca.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - _MARKER_TAIL_BYTES))
+        tail = f.read().decode('utf-8', errors='replace')
+    markers = _TEMPLATE_MARKER_RE.findall(tail)
+    return markers[-1] if markers else None
+
+
+def migrate_document(thread_id: str, template_text: str, digest: str, drop_missing: bool = False,
+                     dry_run: bool = False) -> dict:
+    """
+    Pasa un documento a la plantilla actual. Las secciones con contenido que
+    la plantilla ya no tiene impiden la migración (status 'conflict') salvo
+    con drop_missing. El texto fuera de las secciones es el de la plantilla.
+    """
+    started = time.perf_counter()
+    path = document_path(thread_id)
+    result = {"thread_id": thread_id}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        filled = {}
+        for key, content in iter_sections(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')):
+            if content.strip():
+                filled.setdefault(key, content)
+
+        document = LatexDocument.parse(template_text)
+        missing = [key for key in filled if key not in document.slots]
+        result["sections"] = sorted(filled)
+        if missing:
+            result["missing_sections"] = missing
+        if missing and not drop_missing:
+            result["status"] = "conflict"
+        elif dry_run:
+            result["status"] = "outdated"
+        else:
+            for key, content in filled.items():
+                document.set_section(key, content)
+            try:
+                write_atomic(path, stamp_template(document.render(), digest), expected_hash=content_hash(data))
+                result["status"] = "migrated"
+            except DocumentChanged:
+                # Se editó mientras lo migrábamos: se deja para la siguiente pasada
+                result["status"] = "changed"
+    except Exception as e:
+        result.update(status="failed", error=f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def outdated_documents(digest: str, thread_ids: list = None) -> list:
+    """
+    thread_ids cuyo documento no lleva la marca de la plantilla 'digest'.
+    """
+    if not thread_ids:
+        thread_ids = sorted(name[:-4] for name in os.listdir(GENERATED_DOCUMENTS_DIR) if name.endswith(".tex"))
+    return [thread_id for thread_id in thread_ids
+            if os.path.exists(document_path(thread_id)) and document_template_hash(document_path(thread_id)) != digest]
+
+
+def migrate_documents(thread_ids: list, template_text: str, workers: int, drop_missing: bool = False,
+                      dry_run: bool = False) -> list:
+    """
+    Migra en paralelo los documentos indicados y registra (log) el progreso.
+    """
+    digest = template_hash(template_text)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(migrate_document, thread_id, template_text, digest, drop_missing, dry_run)
+                   for thread_id in thread_ids]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results.append(result)
+            log("template_migration.document", done=done, pending=len(thread_ids), thread_id=result["thread_id"],
+                status=result["status"], missing_sections=result.get("missing_sections"), error=result.get("error"))
+    return sorted(results, key=lambda result: result["thread_id"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move existing documents to the current LaTeX template")
+    parser.add_argument("thread_ids", nargs="*", help="documents to migrate (default: all in generatedDocuments/)")
+    parser.add_argument("--template", help="current template (default: FILES_TO_UPLOAD_STRUCTURE_PATH)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--dry-run", action="store_true", help="only report which documents are outdated")
+    parser.add_argument("--drop-missing", action="store_true",
+                        help="migrate even if filled sections are not in the template (their content is lost)")
+    parser.add_argument("--export", action="store_true", help="compile the migrated documents with batch_export")
+    parser.add_argument("--report", help="JSON report path")
+    args = parser.parse_args()
+
+    load_dotenv('.env')
+    args.template = args.template or os.environ.get('FILES_TO_UPLOAD_STRUCTURE_PATH', 'invention-disclosure-structure.tex')
+    started = time.perf_counter()
+    with open(args.template, 'r', encoding='utf-8') as f:
+        template_text = f.read()
+    digest = template_hash(template_text)
+    thread_ids = outdated_documents(digest, args.thread_ids)
+    log("template_migration.started", template_hash=digest, outdated=len(thread_ids))
+
+    results = migrate_documents(thread_ids, template_text, max(1, args.workers), args.drop_missing, args.dry_run)
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    report = {"template": args.template, "template_hash": digest, "dry_run": args.dry_run,
+              "wall_seconds": round(time.perf_counter() - started, 3), **counts, "results": results}
+    log("template_migration.finished", wall_seconds=report["wall_seconds"], **counts)
+
+    exit_code = 1 if counts.get("failed") or counts.get("conflict") else 0
+    migrated = [result["thread_id"] for result in results if result["status"] == "migrated"]
+    if args.export and migrated:
+        import batch_export
+        batch_export.prepare_environment()
+        report["export"] = batch_export.export_documents(migrated, max(1, args.workers))
+        exit_code = exit_code or (1 if report["export"]["failed"] else 0)
+
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        log("template_migration.report_written", report=args.report)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# Configuración común de las pruebas. Desde la carpeta api/:
+#     python -m pytest -q
+# Las pruebas corren contra el servidor falso de OpenAI (benchmarks.fake_openai)
+# y el compilador stub, en un directorio de trabajo temporal: no hace falta
+# cuenta de OpenAI ni TeX instalado. Los módulos de la API leen el entorno al
+# importarse, por eso todo se prepara aquí antes de que se importe ninguno.
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from benchmarks.fake_openai import DEFAULT_REPLY, FakeOpenAIState, start_fake_openai  # noqa: E402
+
+# Latencias del servidor falso en las pruebas (segundos)
+TEST_LATENCIES = {"default": 0.0, "files.create": 0.0, "batch.index": 0.0, "run": 0.05}
+TEST_POLL_MS = 10
+
+WORKDIR = tempfile.mkdtemp(prefix="idv2-tests-")
+for name in ("output", "public", "generatedDocuments"):
+    os.makedirs(os.path.join(WORKDIR, name), exist_ok=True)
+
+_server, _base_url = start_fake_openai(latencies=TEST_LATENCIES, poll_ms=TEST_POLL_MS)
+
+os.environ.update({
+    "OPENAI_BASE_URL": _base_url,
+    "OPEN_AI_API_KEY": "sk-test",
+    "OPENAI_WARMUP": "False",
+    "OPENAI_MAX_RETRIES": "0",
+    "BACKEND_OUTPUT_DIR": os.path.join(WORKDIR, "output"),
+    "FRONTEND_PUBLIC_PATH": os.path.join(WORKDIR, "public"),
+    "FILES_TO_UPLOAD_STRUCTURE_PATH": os.path.join(API_DIR, "invention-disclosure-structure.tex"),
+    "FILES_TO_UPLOAD_STRUCTURE_COPY_TO_LOCAL": "True",
+    "FILES_TO_UPLOAD_INSTRUCTIONS_PATH": os.path.join(API_DIR, "invention-disclosure-instructions.md"),
+    "FILES_TO_UPLOAD_INSTRUCTIONS_COPY_TO_LOCAL": "False",
+    "ASSISTANT_DURATION": "7200",
+    "REAPER_DB_PATH": os.path.join(WORKDIR, "sessions.db"),
+    "FILE_REGISTRY_PATH": os.path.join(WORKDIR, "file_registry.db"),
+    "CONTEXT_SUMMARY_DB_PATH": os.path.join(WORKDIR, "context_summaries.db"),
+    "BUILD_CACHE_DIR": os.path.join(WORKDIR, "buildCache"),
+    "TEX_FORMAT_DIR": os.path.join(WORKDIR, "texFormats"),
+    "TEX_BINARY": "stub",
+    "SESSION_POOL_SIZE": "0",
+    "TRACE_SAMPLE_RATE": "0",
+})
+os.chdir(WORKDIR)
+
+
+@pytest.fixture
+def fake_openai():
+    """
+    Servidor falso con el estado vacío en cada prueba. Devuelve el estado
+    (objetos creados, guion de tool calls y llamadas por endpoint).
+    """
+    _server.state = FakeOpenAIState(TEST_LATENCIES, None, DEFAULT_REPLY, TEST_POLL_MS)
+    return _server.state
+
+
+@pytest.fixture
+def workdir():
+    return WORKDIR
+
+
+@pytest.fixture
+def template():
+    with open(os.environ["FILES_TO_UPLOAD_STRUCTURE_PATH"], encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def thread_id(template):
+    """
+    Documento nuevo (la plantilla actual) en generatedDocuments/.
+    """
+    from document_model import document_path, write_atomic
+    from template_migration import new_document
+
+    thread_id = f"thread_{uuid.uuid4().hex[:12]}"
+    write_atomic(document_path(thread_id), new_document(template))
+    return thread_id
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    """
+    Sustituye el envío al compile_scheduler: devuelve la lista de thread_ids enviados.
+    """
+    import compile_scheduler
+
+    submitted = []
+    monkeypatch.setattr(compile_scheduler.compile_scheduler, "submit", lambda thread_id: submitted.append(thread_id))
+    return submitted
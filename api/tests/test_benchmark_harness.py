@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from benchmarks.run_benchmarks import percentile, summarize
+
+
+@pytest.fixture
+def api(fake_openai):
+    import main
+    return main.app.test_client()
+
+
+def test_percentile_and_summary():
+    values = list(range(1, 101))
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) is None
+
+    result = summarize([(0.1, True), (0.2, True), (0.3, False)], wall_seconds=1.5)
+    assert result["requests"] == 3
+    assert result["errors"] == 1
+    assert result["max_ms"] == 200.0
+    assert result["rps"] == 2.0
+
+
+def test_fake_server_runs_the_tool_script(fake_openai):
+    from openai_client import client
+
+    fake_openai.tool_script = [[{"name": "modify_document", "arguments": {"Section": "PURPOSE", "Content": "x"}}]]
+    assistant = client.beta.assistants.create(model="gpt-4o", name="test")
+    thread = client.beta.threads.create()
+    client.beta.threads.messages.create(thread_id=thread.id, role="user", content="hola")
+
+    run = client.beta.threads.runs.create_and_poll(thread_id=thread.id, assistant_id=assistant.id)
+    assert run.status == "requires_action"
+    call = run.required_action.submit_tool_outputs.tool_calls[0]
+    assert call.function.name == "modify_document"
+
+    run = client.beta.threads.runs.submit_tool_outputs_and_poll(
+        thread_id=thread.id, run_id=run.id, tool_outputs=[{"tool_call_id": call.id, "output": "ok"}])
+    assert run.status == "completed"
+    assert run.usage.total_tokens > 0
+    messages = client.beta.threads.messages.list(thread_id=thread.id)
+    assert messages.data[0].role == "assistant"
+    assert fake_openai.calls["submit_tool_outputs"] == 1
+
+
+def test_start_chat_read_and_compile(api, fake_openai):
+    session = api.get("/start").get_json()
+    assert set(session) == {"thread_id", "assistant_id", "vector_store_id"}
+
+    response = api.post("/chat", data={**session, "message": "Rellena el propósito"})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["response"] == fake_openai.reply
+
+    text = api.get("/readTextFile", query_string={"thread_id": session["thread_id"]}).get_json()["response"]
+    assert "Benchmark purpose text." in text
+
+    assert api.post("/compile", json={"thread_id": session["thread_id"]}).status_code == 202
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        job = api.get("/compile/status", query_string={"thread_id": session["thread_id"]}).get_json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done", job
+    assert api.get(f"/pdf/{session['thread_id']}").data.startswith(b"%PDF")
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from build_cache import BUILD_CACHE_ASSETS, BuildCache
+from tex_engine import TexEngine
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / "template.tex"
+    path.write_text("\\documentclass{article}\n\\usepackage{amsmath}\n\\begin{document}\nx\n\\end{document}\n",
+                    encoding="utf-8")
+    return path
+
+
+def test_template_is_part_of_the_key_by_default():
+    assert os.environ["FILES_TO_UPLOAD_STRUCTURE_PATH"] in BUILD_CACHE_ASSETS
+
+
+def test_template_change_invalidates_cached_builds(tmp_path, template):
+    cache = BuildCache(str(tmp_path / "cache"), 10, 10 ** 9, [str(template)])
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF-1.4\n")
+    key = cache.key_for(b"source", "pdflatex|format:none")
+    cache.put(key, str(pdf))
+    assert cache.get(cache.key_for(b"source", "pdflatex|format:none")) is not None
+
+    template.write_text(template.read_text(encoding="utf-8") + "% v2\n", encoding="utf-8")
+    os.utime(template, ns=(1, 1))
+    assert cache.key_for(b"source", "pdflatex|format:none") != key
+
+
+def test_preamble_format_is_part_of_the_build_id(tmp_path, template):
+    engine = TexEngine("pdflatex", 0, True, str(tmp_path / "formats"), str(template))
+    before = engine.build_id()
+    assert before.startswith("pdflatex|format:") and not before.endswith("none")
+
+    template.write_text(template.read_text(encoding="utf-8").replace("amsmath", "amssymb"), encoding="utf-8")
+    assert engine.build_id() != before
+    assert TexEngine("pdflatex", 0, False, str(tmp_path / "formats"), str(template)).build_id() == "pdflatex|format:none"
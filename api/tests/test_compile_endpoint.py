@@ -0,0 +1,94 @@
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def api(fake_openai, monkeypatch):
+    import compile_scheduler
+    import main
+
+    submitted = []
+    monkeypatch.setattr(compile_scheduler.compile_scheduler, "submit",
+                        lambda thread_id: submitted.append(thread_id) or {"thread_id": thread_id, "status": "queued"})
+    client = main.app.test_client()
+    client.submitted = submitted
+    return client
+
+
+@pytest.mark.parametrize("thread_id", ["../generatedDocuments/x", "thread/../../etc", "thread id", 42])
+def test_compile_rejects_invalid_thread_ids(api, thread_id):
+    response = api.post("/compile", json={"thread_id": thread_id})
+    assert response.status_code == 400
+    assert api.submitted == []
+
+
+def test_compile_without_a_json_body_is_a_bad_request(api):
+    assert api.post("/compile", data="thread_abc").status_code == 400
+    assert api.submitted == []
+
+
+def test_compile_queues_valid_thread_ids(api):
+    response = api.post("/compile", json={"thread_id": "thread_abc-123"})
+    assert response.status_code == 202
+    assert api.submitted == ["thread_abc-123"]
+
+
+def test_retention_is_off_by_default():
+    import main
+    from build_retention import RETENTION_MAX_AGE_DAYS
+
+    assert RETENTION_MAX_AGE_DAYS == 0
+    assert main.retention_sweeper.stats()["max_age_days"] == 0
+    assert main.retention_sweeper._worker is None
+
+
+@pytest.fixture
+def published(tmp_path):
+    """
+    Thread con un PDF publicado por copia (como desde la caché de builds).
+    """
+    from latex_compiler import _publish_pdf, output_dir
+
+    thread_id = f"thread_{uuid.uuid4().hex[:12]}"
+    os.makedirs(output_dir(thread_id), exist_ok=True)
+    pdf = tmp_path / "build.pdf"
+    pdf.write_bytes(b"%PDF-1.4\n" + b"0123456789" * 100)
+    build_hash = uuid.uuid4().hex
+    _publish_pdf(thread_id, str(pdf), build_hash, move=False)
+    return thread_id, build_hash, pdf.read_bytes()
+
+
+def test_pdf_is_served_with_the_build_hash_as_etag(api, published):
+    thread_id, build_hash, data = published
+    from latex_compiler import output_dir
+
+    response = api.get(f"/pdf/{thread_id}")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{build_hash}"'
+    assert response.data == data
+    # El temporal de la copia no queda en la carpeta del thread
+    assert not [name for name in os.listdir(output_dir(thread_id)) if name.startswith(".tmp-")]
+
+
+def test_pdf_with_matching_etag_is_not_modified(api, published):
+    thread_id, build_hash, _ = published
+
+    response = api.get(f"/pdf/{thread_id}", headers={"If-None-Match": f'"{build_hash}"'})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_pdf_range_request_returns_partial_content(api, published):
+    thread_id, _, data = published
+
+    response = api.get(f"/pdf/{thread_id}", headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.data == data[:8]
+    assert response.headers["Content-Range"] == f"bytes 0-7/{len(data)}"
+
+
+def test_pdf_of_an_unknown_thread_is_not_found(api):
+    assert api.get("/pdf/thread_unknown").status_code == 404
+    assert api.get("/pdf/..").status_code == 404
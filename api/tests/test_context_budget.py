@@ -0,0 +1,115 @@
+import os
+import subprocess
+import sys
+
+import context_budget
+from context_budget import ContextBudget
+
+
+def _thread_with_messages(client, count):
+    thread = client.beta.threads.create()
+    for i in range(count):
+        client.beta.threads.messages.create(thread_id=thread.id, role="user", content=f"mensaje {i}")
+    return thread.id
+
+
+def _message_ids(client, thread_id):
+    return [message.id for message in client.beta.threads.messages.list(thread_id=thread_id, order="asc")]
+
+
+def test_default_run_options_send_no_limits(tmp_path):
+    budget = ContextBudget(10, str(tmp_path / "summaries.db"))
+
+    assert budget.run_options("thread_x") == {"truncation_strategy": {"type": "auto"}}
+
+
+def _imported_keep_messages(tmp_path, **env):
+    """
+    CONTEXT_SUMMARY_KEEP_MESSAGES tal como queda al importar el módulo con 'env'.
+    """
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import context_budget; print(context_budget.CONTEXT_SUMMARY_KEEP_MESSAGES)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=api_dir, capture_output=True, text=True, check=True,
+                            env={**os.environ, "CONTEXT_SUMMARY_DB_PATH": str(tmp_path / "summaries.db"), **env})
+    return int(result.stdout.splitlines()[-1])
+
+
+def test_kept_messages_fit_in_the_truncation_window(tmp_path):
+    assert _imported_keep_messages(tmp_path, RUN_TRUNCATION_LAST_MESSAGES="5",
+                                   CONTEXT_SUMMARY_KEEP_MESSAGES="8") == 5
+    assert _imported_keep_messages(tmp_path, RUN_TRUNCATION_LAST_MESSAGES="20",
+                                   CONTEXT_SUMMARY_KEEP_MESSAGES="8") == 8
+    assert _imported_keep_messages(tmp_path, RUN_TRUNCATION_LAST_MESSAGES="0",
+                                   CONTEXT_SUMMARY_KEEP_MESSAGES="8") == 8
+
+
+def test_summary_is_stored_and_messages_are_kept_by_default(fake_openai, tmp_path, monkeypatch):
+    from openai_client import client
+
+    monkeypatch.setattr(context_budget, "CONTEXT_SUMMARY_KEEP_MESSAGES", 2)
+    db_path = str(tmp_path / "summaries.db")
+    thread_id = _thread_with_messages(client, 5)
+    ids = _message_ids(client, thread_id)
+
+    ContextBudget(10, db_path)._summarize(client, thread_id)
+
+    assert _message_ids(client, thread_id) == ids
+    assert fake_openai.calls["delete_message"] == 0
+    # Otro proceso (o un reinicio) ve el mismo resumen
+    summary, next_message_id = ContextBudget(10, db_path).summary(thread_id)
+    assert summary.startswith("Summary of")
+    assert next_message_id == ids[3]
+    options = ContextBudget(10, db_path).run_options(thread_id)
+    assert summary in options["additional_instructions"]
+
+
+def test_messages_are_deleted_only_after_the_summary_is_stored(fake_openai, tmp_path, monkeypatch):
+    from openai_client import client
+
+    monkeypatch.setattr(context_budget, "CONTEXT_SUMMARY_KEEP_MESSAGES", 2)
+    monkeypatch.setattr(context_budget, "CONTEXT_SUMMARY_DELETE_MESSAGES", True)
+    budget = ContextBudget(10, str(tmp_path / "summaries.db"))
+    thread_id = _thread_with_messages(client, 5)
+    ids = _message_ids(client, thread_id)
+
+    delete = client.beta.threads.messages.delete
+    stored_at_delete = []
+
+    def checked_delete(*args, **kwargs):
+        stored_at_delete.append(budget.summary(thread_id) is not None)
+        return delete(*args, **kwargs)
+
+    monkeypatch.setattr(client.beta.threads.messages, "delete", checked_delete)
+    budget._summarize(client, thread_id)
+
+    assert stored_at_delete == [True, True, True]
+    assert _message_ids(client, thread_id) == ids[3:]
+
+    # La segunda pasada empieza en el primer mensaje sin resumir
+    for i in range(3):
+        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=f"nuevo {i}")
+    budget._summarize(client, thread_id)
+
+    assert len(stored_at_delete) == 6
+    remaining = _message_ids(client, thread_id)
+    assert len(remaining) == 2 and ids[3] not in remaining
+    assert budget.summary(thread_id)[1] == remaining[0]
+
+
+def test_failed_summary_deletes_nothing(fake_openai, tmp_path, monkeypatch):
+    from openai_client import client
+
+    monkeypatch.setattr(context_budget, "CONTEXT_SUMMARY_KEEP_MESSAGES", 2)
+    monkeypatch.setattr(context_budget, "CONTEXT_SUMMARY_DELETE_MESSAGES", True)
+    budget = ContextBudget(10, str(tmp_path / "summaries.db"))
+    thread_id = _thread_with_messages(client, 5)
+    ids = _message_ids(client, thread_id)
+
+    def failing_create(*args, **kwargs):
+        raise RuntimeError("completion failed")
+
+    monkeypatch.setattr(client.chat.completions, "create", failing_create)
+    budget._summarize(client, thread_id)
+
+    assert budget.summary(thread_id) is None
+    assert _message_ids(client, thread_id) == ids
@@ -0,0 +1,44 @@
+import json
+from types import SimpleNamespace
+
+from document_model import document_store
+
+
+def _modify(section, content):
+    arguments = json.dumps({"Section": section, "Content": content})
+    return SimpleNamespace(id=f"call_{section}", function=SimpleNamespace(name="modify_document", arguments=arguments))
+
+
+def _outputs(tool_outputs):
+    return [json.loads(tool_output["output"]) for tool_output in tool_outputs]
+
+
+def test_reports_each_section_result_and_compiles_once(thread_id, compiles):
+    from main import execute_tool_calls
+
+    outputs = _outputs(execute_tool_calls([_modify("Purpose", "Texto."), _modify("NO_SUCH_SECTION", "x")], thread_id))
+
+    assert outputs[0] == {"success": True, "section": "PURPOSE"}
+    assert "not found" in outputs[1]["error"]
+    assert compiles == [thread_id]
+
+
+def test_no_compile_when_nothing_was_applied(thread_id, compiles):
+    from main import execute_tool_calls, modify_latex_document
+
+    [output] = _outputs(execute_tool_calls([_modify("NO_SUCH_SECTION", "x")], thread_id))
+    assert "error" in output
+    assert "error" in modify_latex_document("OTHER_MISSING", "x", thread_id)
+    assert compiles == []
+
+
+def test_write_failure_is_reported(thread_id, compiles, monkeypatch):
+    from main import execute_tool_calls
+
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(document_store, "update_sections", fail)
+
+    [output] = _outputs(execute_tool_calls([_modify("PURPOSE", "Texto.")], thread_id))
+    assert "disk full" in output["error"]
+    assert compiles == []
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+import document_model
+from document_model import DocumentStore
+
+
+def test_update_writes_through(thread_id):
+    store = DocumentStore(8)
+    assert store.update_sections(thread_id, {"PURPOSE": "Nuevo propósito.\n", "MISSING": "x"}) == ["PURPOSE"]
+    assert "Nuevo propósito." in DocumentStore(8).read_text(thread_id)
+
+
+def test_failed_write_does_not_leave_the_cache_ahead_of_disk(thread_id, monkeypatch):
+    store = DocumentStore(8)
+    original = store.read_text(thread_id)
+
+    def fail(path, text):
+        raise OSError("disk full")
+    monkeypatch.setattr(document_model, "write_atomic", fail)
+    with pytest.raises(OSError):
+        store.update_sections(thread_id, {"PURPOSE": "No se guarda.\n"})
+
+    assert store.read_text(thread_id) == original
+    assert "No se guarda." not in store.get(thread_id).get_section("PURPOSE")
+
+
+def test_wait_notices_edits_from_other_processes(thread_id, template, monkeypatch):
+    from template_migration import new_document
+
+    monkeypatch.setattr(document_model, "DOCUMENT_WAIT_RECHECK_SECONDS", 0.05)
+    store = DocumentStore(8)
+    _, version = store.read_versioned(thread_id)
+
+    # Otro proceso reescribe el archivo (no pasa por este DocumentStore)
+    edited = new_document(template.replace("% --- start:PURPOSE ---\n", "% --- start:PURPOSE ---\nDesde fuera.\n"))
+    edit = threading.Timer(0.2, document_model.write_atomic, (document_model.document_path(thread_id), edited))
+    edit.start()
+    started = time.monotonic()
+    changes = store.wait_for_version(thread_id, version, timeout=10)
+    edit.join()
+
+    assert time.monotonic() - started < 5
+    assert changes["full"] and "Desde fuera." in changes["sections"]["PURPOSE"]
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+from embedding_pipeline import HashingEmbedder, LocalRetrieval, chunk_text, new_local_session_id
+
+
+@pytest.fixture
+def files(tmp_path):
+    solar = tmp_path / "solar.txt"
+    solar.write_text("Panel solar de silicio con seguimiento del sol y baterías de litio.", encoding="utf-8")
+    cheese = tmp_path / "queso.txt"
+    cheese.write_text("Proceso de maduración de queso de cabra en cuevas naturales.", encoding="utf-8")
+    return [("solar.txt", str(solar)), ("queso.txt", str(cheese))]
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    first = HashingEmbedder().embed(["Panel solar con baterías", ""])
+    second = HashingEmbedder().embed(["Panel solar con baterías", ""])
+    assert np.array_equal(first, second)
+    assert np.isclose(np.linalg.norm(first[0]), 1.0)
+    assert not first[1].any()
+
+
+def test_chunks_overlap_and_cover_the_text():
+    text = "\n".join(f"Línea {i} del documento." for i in range(200))
+    chunks = chunk_text(text, chunk_size=300, overlap=50)
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    assert chunks[0].startswith("Línea 0") and chunks[-1].endswith("Línea 199 del documento.")
+
+
+def test_search_ranks_the_relevant_file_first(tmp_path, files):
+    retrieval = LocalRetrieval(HashingEmbedder(), str(tmp_path / "indexes"))
+    session_id = new_local_session_id()
+    report = retrieval.ingest_files(session_id, files)
+    assert report["chunks"] == 2 and not report["failed"]
+
+    results = retrieval.search(session_id, "queso de cabra")
+    assert results[0]["file"] == "queso.txt"
+    assert retrieval.stats()["latency"]["query"]["count"] == 1
+
+
+def test_index_survives_a_restart_and_is_shared_between_workers(tmp_path, files):
+    index_dir = str(tmp_path / "indexes")
+    session_id = new_local_session_id()
+    LocalRetrieval(HashingEmbedder(), index_dir).ingest_files(session_id, files[:1])
+
+    other_worker = LocalRetrieval(HashingEmbedder(), index_dir)
+    assert other_worker.search(session_id, "panel solar")[0]["file"] == "solar.txt"
+
+    # Lo que añade un proceso lo ve el otro
+    LocalRetrieval(HashingEmbedder(), index_dir).ingest_files(session_id, files[1:])
+    assert other_worker.search(session_id, "queso de cabra")[0]["file"] == "queso.txt"
+
+    other_worker.drop(session_id)
+    assert not os.listdir(index_dir)
+    assert LocalRetrieval(HashingEmbedder(), index_dir).search(session_id, "panel solar") == []
+
+
+def test_rejects_ids_outside_the_index_dir(tmp_path):
+    retrieval = LocalRetrieval(HashingEmbedder(), str(tmp_path / "indexes"))
+    assert retrieval.search("local_../../etc/passwd", "x") == []
+    with pytest.raises(ValueError):
+        retrieval.drop("../escape")
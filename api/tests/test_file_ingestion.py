@@ -0,0 +1,31 @@
+import asyncio
+
+_VOLATILE = ("upload_seconds", "indexing_seconds", "total_seconds", "batch_id", "file_ids")
+
+
+def _stable(report):
+    """
+    Informe sin tiempos ni IDs, para comparar dos ingestas.
+    """
+    files = [{key: value for key, value in result.items() if key not in ("file_id", "upload_seconds")}
+             for result in report["files"]]
+    return {**{key: value for key, value in report.items() if key not in _VOLATILE}, "files": files}
+
+
+def test_sync_and_async_ingestion_build_the_same_report(fake_openai, tmp_path):
+    from file_ingestion import ingest_files, ingest_files_async
+    from openai_client import async_client, client
+
+    good = tmp_path / "notes.txt"
+    good.write_text("Notas de la invención", encoding="utf-8")
+    files = [("notes.txt", str(good)), ("missing.txt", str(tmp_path / "missing.txt"))]
+
+    vector_store_id = client.beta.vector_stores.create(name="test").id
+    sync_report = ingest_files(client, vector_store_id, files)
+    async_report = asyncio.run(ingest_files_async(async_client, vector_store_id, files))
+
+    assert _stable(sync_report) == _stable(async_report)
+    assert sync_report["batch_status"] == "completed"
+    assert [failure["filename"] for failure in sync_report["failed"]] == ["missing.txt"]
+    assert len(sync_report["file_ids"]) == len(async_report["file_ids"]) == 1
+
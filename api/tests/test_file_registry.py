@@ -0,0 +1,54 @@
+import pytest
+
+from file_registry import FileRegistry
+from openai_client import client
+
+
+@pytest.fixture
+def registry(tmp_path, fake_openai):
+    return FileRegistry(str(tmp_path / "registry.db"))
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / "template.tex"
+    path.write_text("\\section{PURPOSE}\n", encoding="utf-8")
+    return str(path)
+
+
+def _vector_store():
+    return client.beta.vector_stores.create(name="test").id
+
+
+def test_reuses_uploaded_files(registry, template, fake_openai):
+    first = registry.attach(client, _vector_store(), [template])
+    second = registry.attach(client, _vector_store(), [template])
+    assert first == second
+    assert fake_openai.calls["create_file"] == 1
+
+
+def test_reuploads_files_deleted_remotely(registry, template, fake_openai):
+    [stale] = registry.attach(client, _vector_store(), [template])
+    client.files.delete(file_id=stale)
+
+    [fresh] = registry.attach(client, _vector_store(), [template])
+    assert fresh != stale
+    assert fresh in fake_openai.files
+    # La entrada vieja no vuelve a usarse
+    assert registry.get_or_upload(client, template) == fresh
+
+
+def test_workers_share_refcounts(tmp_path, template, fake_openai):
+    path = str(tmp_path / "registry.db")
+    worker_a, worker_b = FileRegistry(path), FileRegistry(path)
+    store_a, store_b = _vector_store(), _vector_store()
+    [file_id] = worker_a.attach(client, store_a, [template])
+    assert worker_b.attach(client, store_b, [template]) == [file_id]
+
+    # La plantilla cambia: el archivo viejo se borra cuando lo suelta el último vector store
+    with open(template, "a", encoding="utf-8") as f:
+        f.write("% v2\n")
+    worker_a.get_or_upload(client, template)
+    assert worker_a.release(store_a) == []
+    assert worker_b.release(store_b) == [file_id]
+
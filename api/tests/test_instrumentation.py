@@ -0,0 +1,55 @@
+import contextvars
+import json
+from types import SimpleNamespace
+
+
+def test_build_cache_totals_are_exported_as_counters(fake_openai):
+    import main
+
+    text = main.app.test_client().get("/metrics").get_data(as_text=True)
+    assert "# TYPE idv2_build_cache_hits_total counter" in text
+    assert "# TYPE idv2_build_cache_misses_total counter" in text
+
+
+def test_tool_spans_only_use_known_tool_names(fake_openai):
+    import main
+    from instrumentation import render_metrics
+
+    call = SimpleNamespace(id="call_1", function=SimpleNamespace(name="made_up_tool_3f9a", arguments="{}"))
+    output = main.execute_tool_call(call, "thread_spans")
+
+    assert "Unknown function" in output["output"]
+    text = render_metrics()
+    assert 'span="tool.unknown"' in text
+    assert "made_up_tool_3f9a" not in text
+
+
+def test_background_events_are_structured_logs(capsys, monkeypatch):
+    import document_manipulation
+
+    def failing_submit(thread_id):
+        raise RuntimeError("scheduler stopped")
+
+    monkeypatch.setattr(document_manipulation.compile_scheduler, "submit", failing_submit)
+    # Fuera de una petición (como un hilo de fondo): el evento se escribe directamente
+    contextvars.Context().run(document_manipulation.request_compile, "thread_logs")
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+    assert {"event": "compile.request_error", "thread_id": "thread_logs",
+            "error": "scheduler stopped"}.items() <= records[-1].items()
+
+
+def test_unsampled_request_with_an_error_event_is_logged(capsys):
+    from instrumentation import finish_trace, log, start_trace
+
+    def request(event):
+        trace = start_trace("/draft", "thread_errors")
+        assert not trace.sampled  # TRACE_SAMPLE_RATE=0 en las pruebas
+        log(event, error="boom")
+        finish_trace(trace, 200)
+
+    contextvars.Context().run(request, "draft.started")
+    contextvars.Context().run(request, "draft.error")
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+    assert [record["events"][0]["event"] for record in records if "trace_id" in record] == ["draft.error"]
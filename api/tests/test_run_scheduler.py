@@ -0,0 +1,162 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import run_scheduler
+from run_scheduler import RunScheduler
+
+
+def _assistant_and_thread(client):
+    assistant = client.beta.assistants.create(model="gpt-4o", name="test")
+    thread = client.beta.threads.create()
+    client.beta.threads.messages.create(thread_id=thread.id, role="user", content="hola")
+    return assistant.id, thread.id
+
+
+def test_take_batch_skips_abandoned_tickets():
+    scheduler = RunScheduler(10)
+    leader = scheduler.enqueue("thread_x", "asst_x", "uno", [])
+    abandoned = scheduler.enqueue("thread_x", "asst_x", "dos", [])
+    follower = scheduler.enqueue("thread_x", "asst_x", "tres", [])
+
+    scheduler.abandon(abandoned)
+    assert abandoned.turn.is_set() and not abandoned.leader
+
+    assert scheduler.take_batch(leader) == [leader, follower]
+    assert scheduler.stats()["batched_messages"] == 2
+
+
+def test_cancelled_follower_releases_its_waiting_thread(monkeypatch):
+    scheduler = RunScheduler(10)
+    returned = []
+    wait_turn = scheduler.wait_turn
+
+    def recorded_wait_turn(ticket):
+        result = wait_turn(ticket)
+        returned.append(result)
+        return result
+
+    monkeypatch.setattr(scheduler, "wait_turn", recorded_wait_turn)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def execute(batch):
+            await release.wait()
+            return [ticket.content for ticket in batch]
+
+        leader = asyncio.create_task(scheduler.run_async("thread_x", "asst_x", "uno", [], execute))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(scheduler.run_async("thread_x", "asst_x", "dos", [], execute))
+        await asyncio.sleep(0.05)
+        follower.cancel()
+        for _ in range(100):
+            if returned:
+                break
+            await asyncio.sleep(0.01)
+        release.set()
+        return await leader
+
+    # El hilo de wait_turn del seguidor cancelado termina sin esperar al líder
+    assert asyncio.run(scenario()) == ["uno"]
+    assert returned == [False]
+    assert scheduler.stats()["active_threads"] == 0
+
+
+def test_durations_are_keyed_by_run_kind_and_model(fake_openai, monkeypatch):
+    from openai_client import client
+
+    monkeypatch.setattr(run_scheduler, "RUN_POLL_MIN_SECONDS", 0.01)
+    scheduler = RunScheduler(10)
+    fake_openai.tool_script = []
+    for _ in range(2):
+        assistant_id, thread_id = _assistant_and_thread(client)
+        run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+        assert scheduler.poll(client, thread_id, run, scheduler.clock()).status == "completed"
+
+    # Dos assistants efímeros distintos comparten una sola media
+    assert list(scheduler.stats()["expected_seconds"]) == ["chat:gpt-4o"]
+
+
+def test_duration_keys_are_capped(monkeypatch):
+    monkeypatch.setattr(run_scheduler, "RUN_DURATION_MAX_KEYS", 2)
+    scheduler = RunScheduler(10)
+    for key in ("chat:a", "chat:b", "draft:a"):
+        scheduler.observe(key, 1.0)
+
+    assert list(scheduler.stats()["expected_seconds"]) == ["chat:b", "draft:a"]
+
+
+def test_run_that_does_not_finish_cancelling_is_returned_as_expired(fake_openai, monkeypatch):
+    from openai_client import client
+
+    monkeypatch.setattr(run_scheduler, "RUN_DEADLINE_SECONDS", 0)
+    monkeypatch.setattr(run_scheduler, "RUN_CANCEL_GRACE_SECONDS", 0.05)
+    monkeypatch.setattr(run_scheduler, "RUN_POLL_MIN_SECONDS", 0.01)
+    scheduler = RunScheduler(10)
+    assistant_id, thread_id = _assistant_and_thread(client)
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+    cancelling = run.model_copy(update={"status": "cancelling"})
+    monkeypatch.setattr(client.beta.threads.runs, "cancel", lambda **_: cancelling)
+    monkeypatch.setattr(client.beta.threads.runs, "retrieve", lambda **_: cancelling)
+
+    run = scheduler.poll(client, thread_id, run, scheduler.clock())
+
+    assert run.status == "expired"
+    assert scheduler.stats()["cancelled_runs"] == 1
+
+
+def _active_run_error(thread_id):
+    request = httpx.Request("POST", f"http://fake/v1/threads/{thread_id}/runs")
+    return openai.BadRequestError(f"Thread {thread_id} already has an active run run_other.",
+                                  response=httpx.Response(400, request=request), body=None)
+
+
+def test_chat_waits_for_a_run_started_by_another_worker(fake_openai, monkeypatch):
+    import main
+    from openai_client import client
+
+    monkeypatch.setattr(run_scheduler, "RUN_POLL_MIN_SECONDS", 0.01)
+    create = client.beta.threads.runs.create
+    attempts = []
+
+    def busy_then_free(**kwargs):
+        attempts.append(kwargs["thread_id"])
+        if len(attempts) < 3:
+            raise _active_run_error(kwargs["thread_id"])
+        return create(**kwargs)
+
+    monkeypatch.setattr(client.beta.threads.runs, "create", busy_then_free)
+    fake_openai.tool_script = []
+    api = main.app.test_client()
+    session = api.get("/start").get_json()
+
+    response = api.post("/chat", data={**session, "message": "hola"})
+
+    assert response.status_code == 200, response.get_json()
+    assert len(attempts) == 3
+    # El reintento no vuelve a crear el mensaje del usuario
+    messages = client.beta.threads.messages.list(thread_id=session["thread_id"]).data
+    assert [message.role for message in messages].count("user") == 1
+
+
+def test_other_errors_and_long_conflicts_are_not_retried(monkeypatch):
+    monkeypatch.setattr(run_scheduler, "RUN_DEADLINE_SECONDS", 0)
+    monkeypatch.setattr(run_scheduler, "RUN_CANCEL_GRACE_SECONDS", 0)
+    scheduler = RunScheduler(10)
+    calls = []
+
+    def execute(error):
+        def run(batch):
+            calls.append(len(batch))
+            raise error
+        return run
+
+    with pytest.raises(RuntimeError):
+        scheduler.run("thread_x", "asst_x", "uno", [], execute(RuntimeError("boom")))
+    with pytest.raises(openai.BadRequestError):
+        scheduler.run("thread_x", "asst_x", "dos", [], execute(_active_run_error("thread_x")))
+    assert calls == [1, 1]
+    assert scheduler.stats()["active_threads"] == 0
@@ -0,0 +1,58 @@
+import json
+import time
+
+import pytest
+
+from openai_client import client
+from run_streaming import stream_run
+
+
+def _events(body: bytes) -> list:
+    events = []
+    for block in body.decode("utf-8").split("\n\n"):
+        if block.strip():
+            name, data = block.split("\n", 1)
+            events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@pytest.fixture
+def api(fake_openai):
+    import main
+    return main.app.test_client()
+
+
+def test_stream_applies_all_tool_calls_in_one_write_and_compile(api, fake_openai, compiles):
+    fake_openai.tool_script = [[
+        {"name": "modify_document", "arguments": {"Section": "PURPOSE", "Content": "Stream purpose."}},
+        {"name": "modify_document", "arguments": {"Section": "TITLE", "Content": "Stream title."}},
+    ]]
+    session = api.get("/start").get_json()
+
+    response = api.post("/chat/stream", data={**session, "message": "Rellena"})
+    events = _events(response.get_data())
+
+    names = [name for name, _ in events]
+    assert names.count("tool_output") == 2
+    assert names.count("section_updated") == 2
+    assert names[-1] == "done"
+    assert events[-1][1]["response"] == fake_openai.reply
+    assert compiles == [session["thread_id"]]
+    text = api.get("/readTextFile", query_string={"thread_id": session["thread_id"]}).get_json()["response"]
+    assert "Stream purpose." in text and "Stream title." in text
+
+
+def test_stalled_stream_times_out_at_the_deadline(fake_openai):
+    fake_openai.latencies["run"] = 5
+    assistant = client.beta.assistants.create(model="gpt-4o")
+    thread = client.beta.threads.create()
+
+    started = time.monotonic()
+    events = list(stream_run(client, thread.id, assistant.id, lambda tool_calls: [],
+                             deadline=time.monotonic() + 0.5))
+
+    assert time.monotonic() - started < 3
+    name, payload = events[-1]
+    assert (name, payload["status"]) == ("error", "cancelled")
+    [run] = fake_openai.threads[thread.id]["runs"].values()
+    assert run["status"] == "cancelled"
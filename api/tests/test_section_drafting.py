@@ -0,0 +1,40 @@
+import pytest
+
+import section_drafting
+from document_manipulation import apply_section_updates
+from document_model import document_store
+
+
+def test_drafts_do_not_overwrite_sections_edited_meanwhile(thread_id, compiles, monkeypatch):
+    def draft(client, assistant_id, vector_store_id, section_key):
+        if section_key == "PURPOSE":
+            # El usuario rellena la sección mientras se redacta
+            apply_section_updates(thread_id, {"PURPOSE": "Texto del usuario."}, compile=False)
+        return f"Borrador de {section_key}."
+
+    monkeypatch.setattr(section_drafting, "draft_section", draft)
+    events = dict(section_drafting.draft_sections(None, thread_id, "asst", "vs", ["PURPOSE", "CONCEPTION"]))
+
+    assert events["applied"] == {"sections": ["CONCEPTION"], "skipped": ["PURPOSE"]}
+    document = document_store.get(thread_id)
+    assert document.get_section("PURPOSE").strip() == "Texto del usuario."
+    assert document.get_section("CONCEPTION").strip() == "Borrador de CONCEPTION."
+    assert compiles == [thread_id]
+
+
+@pytest.mark.parametrize("sections", [{"PURPOSE": True}, [1, 2], 7, ["Purpose", "NOT_A_SECTION"]])
+def test_draft_rejects_bad_sections_before_streaming(thread_id, fake_openai, sections):
+    import main
+
+    response = main.app.test_client().post("/draft", json={
+        "thread_id": thread_id, "assistant_id": "asst", "vector_store_id": "vs", "sections": sections})
+    assert response.status_code == 400
+    assert response.mimetype == "application/json"
+
+
+def test_draft_reports_the_unknown_sections(thread_id, fake_openai):
+    import main
+
+    response = main.app.test_client().post("/draft", json={
+        "thread_id": thread_id, "assistant_id": "asst", "vector_store_id": "vs", "sections": ["Purpose", "Nope"]})
+    assert response.get_json() == {"error": "Unknown sections", "sections": ["NOPE"]}
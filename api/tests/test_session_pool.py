@@ -0,0 +1,101 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import session_pool
+from session_pool import SessionPool
+from session_reaper import session_reaper
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _row(thread_id):
+    with sqlite3.connect(session_reaper.db_path) as db:
+        return db.execute("SELECT pooled, expires_at FROM sessions WHERE thread_id = ?", (thread_id,)).fetchone()
+
+
+@pytest.fixture
+def pools(fake_openai):
+    created = []
+
+    def make(size=2):
+        pool = SessionPool(size, refill_interval=0.01, max_idle=600, lease_seconds=0.3)
+        created.append(pool)
+        return pool
+
+    yield make
+    for pool in created:
+        pool.stop()
+    while session_reaper.claim_pooled() is not None:
+        pass
+
+
+def test_pooled_sessions_are_registered_with_the_reaper_when_created(pools, fake_openai):
+    pool = pools()
+    pool.start()
+    assert _wait_for(lambda: session_reaper.pooled_count() == 2)
+
+    # Ninguna se ha entregado todavía, pero ya están en la base de datos del reaper
+    assert len(fake_openai.assistants) == 2
+    with sqlite3.connect(session_reaper.db_path) as db:
+        pooled = {row[0] for row in db.execute("SELECT assistant_id FROM sessions WHERE pooled = 1")}
+    assert pooled == set(fake_openai.assistants)
+
+
+def test_workers_share_one_pool(pools, fake_openai):
+    owner, other = pools(), pools()
+    owner.start()
+    assert _wait_for(lambda: session_reaper.pooled_count() == 2)
+    other.start()
+    time.sleep(0.5)
+
+    # El segundo worker no crea otro pool: entrega las sesiones del primero
+    assert owner.stats()["refilling"] and not other.stats()["refilling"]
+    assert len(fake_openai.assistants) == 2
+    thread_id, assistant_id, _ = other.acquire()
+    assert assistant_id in fake_openai.assistants
+    assert other.stats()["hits"] == 1
+
+    pooled, expires_at = _row(thread_id)
+    assert pooled == 0 and expires_at > time.time() + 3600
+    # El dueño repone la sesión entregada
+    assert _wait_for(lambda: len(fake_openai.assistants) == 3 and session_reaper.pooled_count() == 2)
+
+
+def test_refill_lease_moves_to_another_worker(pools, fake_openai):
+    owner, other = pools(), pools()
+    owner.start()
+    assert _wait_for(lambda: session_reaper.pooled_count() == 2)
+    other.start()
+    owner.stop()
+
+    assert _wait_for(lambda: other.stats()["refilling"])
+    session_reaper.claim_pooled()
+    assert _wait_for(lambda: session_reaper.pooled_count() == 2)
+
+
+def test_async_acquire_activates_pooled_sessions_off_the_event_loop(fake_openai, monkeypatch):
+    from openai_client import async_client
+
+    pool = SessionPool(1, refill_interval=60, max_idle=600, lease_seconds=1)
+    activated_on = []
+    monkeypatch.setattr(pool, "_take", lambda: ("thread_pooled", "asst_pooled", "vs_pooled"))
+    monkeypatch.setattr(session_pool, "activate_ephemeral_conversation",
+                        lambda *session: activated_on.append(threading.current_thread()))
+
+    async def acquire():
+        return await pool.acquire_async(async_client), threading.current_thread()
+
+    session, loop_thread = asyncio.run(acquire())
+    assert session == ("thread_pooled", "asst_pooled", "vs_pooled")
+    assert activated_on and activated_on[0] is not loop_thread
@@ -0,0 +1,66 @@
+import pytest
+
+from session_reaper import SessionReaper
+
+
+def test_a_session_is_reaped_by_one_process_only(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    first, second = SessionReaper(db_path), SessionReaper(db_path)
+    calls = []
+
+    def cleanup_in_first(assistant_id, vector_store_id, thread_id, file_ids):
+        calls.append("first")
+        # Mientras el primero limpia, el segundo proceso también la ve caducada
+        second._reap(thread_id)
+
+    first._cleanup = cleanup_in_first
+    second._cleanup = lambda *args: calls.append("second")
+    first.schedule("thread_a", "asst_a", "vs_a", ttl_seconds=-1)
+
+    first._reap("thread_a")
+
+    assert calls == ["first"]
+    assert first.active_threads() == set() and second.active_threads() == set()
+
+
+def test_failed_cleanup_releases_the_claim(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    first, second = SessionReaper(db_path), SessionReaper(db_path)
+
+    def failing_cleanup(*args):
+        raise RuntimeError("OpenAI unavailable")
+
+    first._cleanup = failing_cleanup
+    second._cleanup = lambda *args: None
+    first.schedule("thread_a", "asst_a", "vs_a", ttl_seconds=-1)
+    first._reap("thread_a")
+    assert first.failed == 1
+
+    # Sin reclamar: el reintento lo puede hacer cualquier proceso
+    second._reap("thread_a", force=True)
+    assert second.reaped == 1
+    assert first.active_threads() == set()
+
+
+def test_cleanup_can_be_retried_after_a_partial_failure(fake_openai, monkeypatch):
+    from ephemeral_assistant import end_ephemeral_conversation
+    from openai_client import client
+
+    assistant = client.beta.assistants.create(model="gpt-4o", name="test")
+    thread = client.beta.threads.create()
+    vector_store = client.beta.vector_stores.create(name="test")
+
+    def failing_delete(*args, **kwargs):
+        raise RuntimeError("OpenAI unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(client.beta.vector_stores, "delete", failing_delete)
+        with pytest.raises(RuntimeError, match="vector store"):
+            end_ephemeral_conversation(assistant.id, vector_store.id, thread.id)
+    # Los demás pasos se hicieron igualmente
+    assert assistant.id not in fake_openai.assistants
+    assert thread.id not in fake_openai.threads
+
+    # El reintento no falla por lo que ya se borró
+    end_ephemeral_conversation(assistant.id, vector_store.id, thread.id)
+    assert vector_store.id not in fake_openai.vector_stores
@@ -0,0 +1,53 @@
+import os
+import uuid
+
+import pytest
+
+import document_model
+from document_model import GENERATED_DOCUMENTS_DIR, DocumentStore, document_path, write_atomic
+from template_migration import document_template_hash, migrate_document, new_document, template_hash
+
+
+@pytest.fixture
+def thread_id(template):
+    """
+    Documento salido de una plantilla anterior, con el propósito relleno.
+    """
+    thread_id = f"thread_{uuid.uuid4().hex[:12]}"
+    write_atomic(document_path(thread_id), new_document("% plantilla anterior\n" + template))
+    DocumentStore(8).update_sections(thread_id, {"PURPOSE": "Propósito migrado.\n"})
+    return thread_id
+
+
+def _temporary_files():
+    return [name for name in os.listdir(GENERATED_DOCUMENTS_DIR) if name.startswith(".tmp-")]
+
+
+def test_outdated_document_is_migrated(thread_id, template):
+    digest = template_hash(template)
+
+    result = migrate_document(thread_id, template, digest)
+
+    assert result["status"] == "migrated"
+    assert document_template_hash(document_path(thread_id)) == digest
+    assert "Propósito migrado." in DocumentStore(8).get(thread_id).get_section("PURPOSE")
+
+
+def test_document_edited_before_the_rename_is_not_overwritten(thread_id, template, monkeypatch):
+    path = document_path(thread_id)
+    mkstemp = document_model.tempfile.mkstemp
+
+    def edit_while_migrating(*args, **kwargs):
+        # Otro proceso (la API) escribe el documento mientras se prepara el temporal
+        created = mkstemp(*args, **kwargs)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("% editado\n")
+        return created
+
+    monkeypatch.setattr(document_model.tempfile, "mkstemp", edit_while_migrating)
+    result = migrate_document(thread_id, template, template_hash(template))
+
+    assert result["status"] == "changed"
+    with open(path, encoding="utf-8") as f:
+        assert f.read().endswith("% editado\n")
+    assert _temporary_files() == []
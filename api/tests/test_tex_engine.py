@@ -0,0 +1,54 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from tex_engine import TexWorkerPool
+
+STUB_PDFLATEX = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "benchmarks", "stub_pdflatex.py")
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Los workers heredan el entorno al arrancar
+    monkeypatch.setenv("STUB_COMPILE_SECONDS", "5")
+    pool = TexWorkerPool(1)
+    if pool.size == 0:
+        pytest.skip("TeX workers need fork")
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def _command(tmp_path, jobname="doc"):
+    source = tmp_path / "doc.tex"
+    source.write_text("\\documentclass{article}\\begin{document}x\\end{document}", encoding="utf-8")
+    return [sys.executable, STUB_PDFLATEX, "-interaction=nonstopmode", f"-jobname={jobname}",
+            "-output-directory", str(tmp_path), str(source)]
+
+
+def test_terminate_cancels_the_build_through_the_worker(pool, tmp_path):
+    def on_process(handle):
+        threading.Timer(0.2, handle.terminate).start()
+
+    started = time.perf_counter()
+    returncode, _, _ = pool.run(_command(tmp_path), on_process=on_process)
+
+    assert returncode != 0
+    assert time.perf_counter() - started < 4
+    assert not (tmp_path / "doc.pdf").exists()
+
+
+def test_terminate_after_the_build_does_not_touch_the_next_one(pool):
+    handles = []
+    pool.run([sys.executable, "-c", "pass"], on_process=handles.append)
+
+    # El build ya terminó: no se le pide nada al worker (ni a su PID, que puede ser de otro)
+    handles[0].terminate()
+    handles[0]._conn.send("cancel")   # aunque llegara tarde, el worker la ignora
+
+    returncode, _, _ = pool.run([sys.executable, "-c", "import time; time.sleep(0.3)"])
+    assert returncode == 0
@@ -0,0 +1,95 @@
+from text_preprocessing import UploadPreprocessor, remove_temporary_files
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return (name, str(path))
+
+
+def _upload(preprocessor, session_id, files, ingest):
+    """
+    Preprocesa, ingesta con 'ingest' y registra lo subido, como main.
+    """
+    from file_ingestion import ingested_filenames
+
+    to_upload, temporary, report, hashes = preprocessor.preprocess(session_id, files)
+    try:
+        ingestion = ingest(to_upload)
+        preprocessor.record(session_id, hashes, ingested_filenames(ingestion))
+    finally:
+        remove_temporary_files(temporary)
+    return to_upload, report
+
+
+def test_failed_upload_is_retried_and_successful_one_is_deduplicated(fake_openai, tmp_path, monkeypatch):
+    from file_ingestion import ingest_files
+    from openai_client import client
+
+    preprocessor = UploadPreprocessor()
+    vector_store_id = client.beta.vector_stores.create(name="test").id
+    files = [_write(tmp_path, "notes.txt", "Una invención\n\ncon dos páginas.")]
+
+    def failing_create(*args, **kwargs):
+        raise RuntimeError("upload failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(client.files, "create", failing_create)
+        to_upload, report = _upload(preprocessor, vector_store_id, files,
+                                    lambda items: ingest_files(client, vector_store_id, items))
+    assert [name for name, _ in to_upload] == ["notes.txt"]
+
+    # El reintento no es un duplicado: la primera subida no llegó
+    to_upload, report = _upload(preprocessor, vector_store_id, files,
+                                lambda items: ingest_files(client, vector_store_id, items))
+    assert report["duplicate_files"] == []
+    assert [name for name, _ in to_upload] == ["notes.txt"]
+
+    # Una vez subido, la misma copia sí se descarta
+    to_upload, report = _upload(preprocessor, vector_store_id, files,
+                                lambda items: ingest_files(client, vector_store_id, items))
+    assert report["duplicate_files"] == ["notes.txt"]
+    assert to_upload == []
+
+
+def test_file_without_text_is_sent_raw(tmp_path):
+    preprocessor = UploadPreprocessor()
+    name, path = _write(tmp_path, "blank.txt", "  \n\n \t ")
+
+    to_upload, temporary, report, hashes = preprocessor.preprocess("vs_test", [(name, path)])
+
+    assert to_upload == [(name, path)]
+    assert report["no_text"] == ["blank.txt"]
+    assert report["duplicate_files"] == []
+    assert hashes == {} and temporary == []
+
+
+def test_files_with_the_same_stem_get_distinct_upload_names(tmp_path):
+    preprocessor = UploadPreprocessor()
+    files = [_write(tmp_path, "notes.md", "Notas en markdown."), _write(tmp_path, "notes.txt", "Notas en texto.")]
+
+    to_upload, temporary, report, hashes = preprocessor.preprocess("vs_test", files)
+    remove_temporary_files(temporary)
+
+    names = [name for name, _ in to_upload]
+    assert names == ["notes.md.txt", "notes.txt"]
+    assert set(hashes) == set(names)
+
+    # Sólo se subió uno: el otro no cuenta como visto
+    preprocessor.record("vs_test", hashes, {"notes.txt"})
+    to_upload, temporary, report, hashes = preprocessor.preprocess("vs_test", files)
+    remove_temporary_files(temporary)
+    assert [name for name, _ in to_upload] == ["notes.md.txt"]
+    assert report["duplicate_files"] == ["notes.txt"]
+
+
+def test_repeated_upload_names_get_a_counter(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = _write(tmp_path / "a", "report.txt", "Primer informe.")
+    second = _write(tmp_path / "b", "report.txt", "Segundo informe.")
+
+    to_upload, temporary, report, hashes = UploadPreprocessor().preprocess("vs_test", [first, second])
+    remove_temporary_files(temporary)
+
+    assert [name for name, _ in to_upload] == ["report.txt", "report (2).txt"]
@@ -0,0 +1,80 @@
+import thread_history as thread_history_module
+from openai_client import client, openai_factory
+from thread_history import ThreadHistoryCache
+
+
+def _thread_with_messages(count):
+    thread = client.beta.threads.create()
+    for i in range(count):
+        client.beta.threads.messages.create(thread_id=thread.id, role="user", content=f"mensaje {i}")
+    return thread.id
+
+
+class _RecordedSession:
+    """
+    La RestSession compartida, apuntando los parámetros de cada petición.
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def get(self, url, params=None, **kwargs):
+        self.requests.append(dict(params or {}))
+        return openai_factory.rest().get(url, params=params, **kwargs)
+
+
+def test_only_messages_after_the_cursor_are_fetched(fake_openai, monkeypatch):
+    monkeypatch.setattr(thread_history_module, "HISTORY_PAGE_SIZE", 2)
+    requests = []
+    history = ThreadHistoryCache(_RecordedSession(requests), 8)
+    thread_id = _thread_with_messages(3)
+
+    data, _ = history.get(thread_id)
+    assert [message["content"][0]["text"]["value"] for message in data["data"]] == \
+        ["mensaje 0", "mensaje 1", "mensaje 2"]
+    # Tres mensajes en páginas de dos: la segunda página sigue desde el último de la primera
+    assert [request.get("after") for request in requests] == [None, data["data"][1]["id"]]
+
+    last_id = data["data"][-1]["id"]
+    client.beta.threads.messages.create(thread_id=thread_id, role="user", content="mensaje 3")
+    requests.clear()
+    data, _ = history.get(thread_id)
+
+    assert [request.get("after") for request in requests] == [last_id]
+    assert len(data["data"]) == 4 and data["data"][-1]["content"][0]["text"]["value"] == "mensaje 3"
+
+
+def test_unchanged_history_is_not_modified(fake_openai):
+    import main
+
+    api = main.app.test_client()
+    thread_id = _thread_with_messages(2)
+    response = api.get("/threadHistory", query_string={"thread_id": thread_id})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = api.get("/threadHistory", query_string={"thread_id": thread_id}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    client.beta.threads.messages.create(thread_id=thread_id, role="user", content="nuevo")
+    response = api.get("/threadHistory", query_string={"thread_id": thread_id}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.get_json()["data"]) == 3
+
+
+def test_history_is_dropped_when_the_session_ends(fake_openai):
+    import main
+    from thread_history import thread_history
+
+    api = main.app.test_client()
+    session = api.get("/start").get_json()
+    response = api.get("/threadHistory", query_string={"thread_id": session["thread_id"]})
+    assert response.status_code == 200, response.get_json()
+    assert session["thread_id"] in thread_history._histories
+
+    response = api.post("/end", data={"assistant_id": session["assistant_id"],
+                                      "vector_store_id": session["vector_store_id"]})
+    assert response.status_code == 200
+    assert session["thread_id"] not in thread_history._histories
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_api_starts_without_an_uploads_folder(fake_openai):
+    # Proceso aparte: el entorno de las pruebas sin UPLOADS_PATH y con los módulos sin importar
+    env = {key: value for key, value in os.environ.items() if key != "UPLOADS_PATH"}
+    result = subprocess.run([sys.executable, "-c", "import ephemeral_assistant"], cwd=API_DIR, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+
+def test_chat_uploads_are_not_written_to_disk(fake_openai, workdir):
+    import io
+
+    import main
+
+    api = main.app.test_client()
+    session = api.get("/start").get_json()
+    before = set(os.listdir(workdir))
+    response = api.post("/chat", data={**session, "message": "Resume el archivo",
+                                       "files": (io.BytesIO(b"Notas de la invencion."), "notas.txt")},
+                        content_type="multipart/form-data")
+    assert response.status_code == 200, response.get_json()
+    assert "notas.txt" in {file["filename"] for file in fake_openai.files.values()}
+    assert set(os.listdir(workdir)) == before
@@ -0,0 +1,422 @@
+import atexit
+import hashlib
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import subprocess
+import threading
+import time
+
+from instrumentation import log
+
+# Binario de TeX ("stub" = compilador falso para pruebas y benchmarks)
+TEX_BINARY = os.environ.get(
+    'TEX_BINARY',
+    "C:/Program Files/MiKTeX/miktex/bin/x64/pdflatex.exe" if os.name == 'nt' else 'pdflatex'
+)
+STUB_COMPILER = "stub"
+# Segundos que tarda el compilador falso (para simular la latencia de pdflatex)
+STUB_COMPILE_SECONDS = float(os.environ.get('STUB_COMPILE_SECONDS', '0'))
+# Procesos hijos pre-lanzados que ejecutan TeX (0 = se lanza desde el propio proceso)
+TEX_WORKERS = int(os.environ.get('TEX_WORKERS', '0' if os.name == 'nt' else '2'))
+# Formato precompilado con el preámbulo de la plantilla
+TEX_USE_FORMAT = os.environ.get('TEX_USE_FORMAT', 'True') == 'True'
+TEX_FORMAT_DIR = os.path.abspath(os.environ.get('TEX_FORMAT_DIR', 'texFormats'))
+TEX_TEMPLATE_PATH = os.environ.get('FILES_TO_UPLOAD_STRUCTURE_PATH', 'invention-disclosure-structure.tex')
+
+# Líneas que forman la parte fija del preámbulo (clase y paquetes)
+_PREAMBLE_LINE = re.compile(r'\s*(\\documentclass|\\usepackage|\\RequirePackage|%|$)')
+# Errores de TeX al cargar un .fmt incompatible (p. ej. tras actualizar la distribución)
+_FORMAT_ERROR = re.compile(r'format file|was written by', re.IGNORECASE)
+
+# PDF mínimo válido que escribe el compilador falso
+_STUB_PDF = (
+    b"%PDF-1.4\n"
+    b"1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n"
+    b"%%EOF\n"
+)
+
+
+def static_preamble(text: str) -> str:
+    """
+    Devuelve el inicio del documento que sólo carga la clase y los paquetes
+    (lo que se puede volcar a un formato), o "" si no empieza por \\documentclass.
+    """
+    position = 0
+    end = 0
+    depth = 0
+    for line in text.splitlines(keepends=True):
+        if not _PREAMBLE_LINE.match(line):
+            break
+        code = line.split('%', 1)[0]
+        depth += code.count('{') - code.count('}')
+        position += len(line)
+        if depth == 0:
+            end = position
+    prefix = text[:end]
+    return prefix if '\\documentclass' in prefix else ""
+
+
+# Intervalo (segundos) con el que un worker mira si le piden cancelar el build
+_CANCEL_POLL_SECONDS = 0.05
+
+
+def _watch_for_cancel(conn, process):
+    """
+    Hilo del worker mientras TeX corre: si el proceso web pide 'cancel', lo
+    termina con Popen.terminate, que no envía la señal si ya se recogió.
+    """
+    while process.poll() is None:
+        if conn.poll(_CANCEL_POLL_SECONDS) and conn.recv() == "cancel":
+            process.terminate()
+
+
+def _worker_main(conn):
+    """
+    Proceso hijo: recibe (cmd, cwd) por la tubería, ejecuta TeX y devuelve
+    primero el pid y luego el resultado. Mientras TeX corre, atiende 'cancel'.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        if request == "cancel":
+            # Llegó cuando el build ya había terminado
+            continue
+        cmd, cwd = request
+        try:
+            process = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, text=True, errors='replace')
+        except OSError as e:
+            conn.send(("error", str(e)))
+            continue
+        conn.send(("started", process.pid))
+        watcher = threading.Thread(target=_watch_for_cancel, args=(conn, process), daemon=True)
+        watcher.start()
+        stdout, stderr = process.communicate()
+        watcher.join()
+        conn.send(("done", process.returncode, stdout, stderr))
+
+
+class _ProcessHandle:
+    """
+    Proceso TeX lanzado por un worker: expone terminate() como Popen, que es
+    lo que usa el scheduler para cancelar builds obsoletos. La cancelación se
+    pide al worker, que es quien tiene el proceso: nunca se envía una señal a
+    un PID que ya puede ser de otro proceso.
+    """
+
+    def __init__(self, pid: int, conn):
+        self.pid = pid
+        self._conn = conn
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def terminate(self):
+        with self._lock:
+            if self._finished:
+                return
+            try:
+                self._conn.send("cancel")
+            except OSError:
+                pass
+
+    def finish(self):
+        """
+        El build terminó: terminate() ya no hace nada.
+        """
+        with self._lock:
+            self._finished = True
+
+
+class TexWorkerPool:
+    """
+    Pool de procesos hijos lanzados al arrancar. Cada compilación se entrega a
+    un worker libre, de modo que el proceso web (grande y con muchos hilos) no
+    hace un fork por cada build.
+    """
+
+    def __init__(self, size: int):
+        self.size = size if hasattr(os, 'fork') else 0
+        self._context = multiprocessing.get_context('fork') if self.size > 0 else None
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self.runs = 0
+        self.respawned = 0
+
+    def start(self):
+        with self._lock:
+            if self._started or self.size <= 0:
+                return
+            self._started = True
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+        log("tex_engine.workers_started", workers=self.size)
+
+    def stop(self):
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        while True:
+            try:
+                process, conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(timeout=1)
+
+    def _spawn(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn,), name="tex-worker", daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def run(self, cmd: list, cwd: str = None, on_process=None) -> tuple:
+        """
+        Ejecuta cmd y devuelve (returncode, stdout, stderr). Sin workers, lanza
+        el proceso directamente.
+        """
+        if self.size <= 0:
+            return _run_inline(cmd, cwd, on_process)
+
+        self.start()
+        worker = self._idle.get()
+        handle = None
+        try:
+            process, conn = worker
+            conn.send((cmd, cwd))
+            reply = conn.recv()
+            if reply[0] == "error":
+                raise OSError(reply[1])
+            handle = _ProcessHandle(reply[1], conn)
+            if on_process is not None:
+                on_process(handle)
+            _, returncode, stdout, stderr = conn.recv()
+            with self._lock:
+                self.runs += 1
+            return returncode, stdout, stderr
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            # El worker murió: lo sustituimos por uno nuevo
+            worker[0].kill()
+            worker = self._spawn()
+            with self._lock:
+                self.respawned += 1
+            raise RuntimeError("TeX worker process died")
+        finally:
+            if handle is not None:
+                handle.finish()
+            self._idle.put(worker)
+
+
+def _run_inline(cmd: list, cwd: str, on_process) -> tuple:
+    process = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True, errors='replace')
+    if on_process is not None:
+        on_process(process)
+    stdout, stderr = process.communicate()
+    return process.returncode, stdout, stderr
+
+
+class PreambleFormat:
+    """
+    Formato (.fmt) con la clase y los paquetes de la plantilla ya cargados. Se
+    genera una vez por versión del preámbulo; los documentos que empiezan por
+    ese mismo preámbulo se compilan con él y sólo procesan el resto del fuente.
+    """
+
+    def __init__(self, tex_binary: str, format_dir: str, template_path: str):
+        self.tex_binary = tex_binary
+        self.format_dir = format_dir
+        self.template_path = template_path
+        self._lock = threading.Lock()
+        self.preamble = None
+        self.path = None       # ruta del .fmt sin extensión
+        self.broken = set()    # hashes de preámbulo cuyo formato no funciona
+        self.build_seconds = None
+
+    def current(self):
+        """
+        (preámbulo, hash) de la plantilla actual, o None si no tiene preámbulo
+        que se pueda volcar a un formato.
+        """
+        try:
+            with open(self.template_path, 'r', encoding='utf-8') as f:
+                preamble = static_preamble(f.read())
+        except OSError:
+            return None
+        if not preamble:
+            return None
+        return preamble, hashlib.sha256(f"{self.tex_binary}\0{preamble}".encode('utf-8')).hexdigest()[:16]
+
+    def ensure(self, pool: TexWorkerPool):
+        """
+        Devuelve (preámbulo, ruta del formato) o None si no hay formato utilizable.
+        """
+        current = self.current()
+        if current is None:
+            return None
+
+        preamble, digest = current
+        if digest in self.broken:
+            return None
+        name = f"preamble-{digest}"
+        path = os.path.join(self.format_dir, name)
+
+        with self._lock:
+            if not os.path.exists(path + ".fmt"):
+                self._build(pool, name, preamble, digest)
+            if digest in self.broken:
+                return None
+            self.preamble = preamble
+            self.path = path
+            return preamble, path
+
+    def _build(self, pool: TexWorkerPool, name: str, preamble: str, digest: str):
+        os.makedirs(self.format_dir, exist_ok=True)
+        source = os.path.join(self.format_dir, f"{name}.tex")
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write(preamble + "\\dump\n")
+
+        base_format = "&" + os.path.splitext(os.path.basename(self.tex_binary))[0]
+        started = time.perf_counter()
+        returncode, stdout, stderr = pool.run([
+            self.tex_binary, "-ini", "-interaction=nonstopmode", f"-jobname={name}",
+            "-output-directory", self.format_dir, base_format, source
+        ])
+        self.build_seconds = round(time.perf_counter() - started, 3)
+        if returncode != 0:
+            self.broken.add(digest)
+            log("tex_engine.format_error", format=name, stdout=stdout[-2000:], stderr=stderr)
+            return
+        log("tex_engine.format_built", format=name, seconds=self.build_seconds)
+
+    def mark_broken(self, path: str):
+        with self._lock:
+            self.broken.add(os.path.basename(path)[len("preamble-"):])
+
+
+class TexEngine:
+    """
+    Ejecuta las compilaciones: binario configurable, formato precompilado del
+    preámbulo, carpeta de salida (y .aux) reutilizada por thread y pool de
+    workers. Devuelve los tiempos de cada build.
+    """
+
+    def __init__(self, tex_binary: str, workers: int, use_format: bool, format_dir: str, template_path: str):
+        self.tex_binary = tex_binary
+        self.stub = tex_binary == STUB_COMPILER
+        self.pool = TexWorkerPool(0 if self.stub else workers)
+        self.format = PreambleFormat(tex_binary, format_dir, template_path) if use_format and not self.stub else None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.format_builds = 0
+        self.tex_seconds_total = 0.0
+        self.last_timings = None
+
+    def start(self):
+        """
+        Lanza los workers y prepara el formato en segundo plano.
+        """
+        if self.stub:
+            log("tex_engine.stub_compiler")
+            return
+        self.pool.start()
+        if self.format is not None:
+            threading.Thread(target=self.format.ensure, args=(self.pool,), name="tex-format", daemon=True).start()
+
+    def stop(self):
+        self.pool.stop()
+
+    def compile(self, tex_path: str, output_dir: str, jobname: str, on_process=None) -> tuple:
+        """
+        Compila tex_path en output_dir/<jobname>.pdf. Devuelve
+        (returncode, stdout, stderr, timings).
+        """
+        started = time.perf_counter()
+        timings = {"compiler": self.tex_binary, "format": False}
+
+        if self.stub:
+            time.sleep(STUB_COMPILE_SECONDS)
+            with open(os.path.join(output_dir, f"{jobname}.pdf"), 'wb') as f:
+                f.write(_STUB_PDF)
+            result = (0, "", "")
+        else:
+            with open(tex_path, 'r', encoding='utf-8') as f:
+                source = f.read()
+            prepared = self.format.ensure(self.pool) if self.format is not None else None
+            timings["prepare_seconds"] = round(time.perf_counter() - started, 3)
+
+            result = None
+            if prepared is not None and source.startswith(prepared[0]):
+                preamble, format_path = prepared
+                body_path = os.path.join(output_dir, f"{jobname}-body.tex")
+                with open(body_path, 'w', encoding='utf-8') as f:
+                    f.write(source[len(preamble):])
+                result = self.pool.run(self._command(body_path, output_dir, jobname, format_path), on_process=on_process)
+                timings["format"] = True
+                if result[0] > 0 and _FORMAT_ERROR.search(result[1] + result[2]):
+                    # Formato incompatible con el binario: no se vuelve a usar
+                    log("tex_engine.format_rejected", format=format_path)
+                    self.format.mark_broken(format_path)
+                    result = None
+                    timings["format"] = False
+
+            if result is None:
+                result = self.pool.run(self._command(tex_path, output_dir, jobname), on_process=on_process)
+
+        timings["tex_seconds"] = round(time.perf_counter() - started - timings.get("prepare_seconds", 0), 3)
+        with self._lock:
+            self.builds += 1
+            self.format_builds += 1 if timings["format"] else 0
+            self.tex_seconds_total += timings["tex_seconds"]
+            self.last_timings = timings
+        return result + (timings,)
+
+    def build_id(self) -> str:
+        """
+        Cómo se compila ahora (binario y formato del preámbulo); forma parte
+        de la clave de la caché de builds.
+        """
+        current = self.format.current() if self.format is not None else None
+        return f"{self.tex_binary}|format:{current[1] if current else 'none'}"
+
+    def _command(self, source_path: str, output_dir: str, jobname: str, format_path: str = None) -> list:
+        cmd = [self.tex_binary, "-interaction=nonstopmode", f"-jobname={jobname}", "-output-directory", output_dir]
+        if format_path is not None:
+            cmd.insert(1, f"-fmt={format_path}")
+        return cmd + [source_path]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "compiler": self.tex_binary,
+                "workers": self.pool.size,
+                "worker_runs": self.pool.runs,
+                "workers_respawned": self.pool.respawned,
+                "format": self.format.path if self.format is not None else None,
+                "format_build_seconds": self.format.build_seconds if self.format is not None else None,
+                "builds": self.builds,
+                "format_builds": self.format_builds,
+                "avg_tex_seconds": (self.tex_seconds_total / self.builds) if self.builds else None,
+                "last_timings": self.last_timings,
+            }
+
+
+# Motor de compilación compartido por el proceso
+tex_engine = TexEngine(TEX_BINARY, TEX_WORKERS, TEX_USE_FORMAT, TEX_FORMAT_DIR, TEX_TEMPLATE_PATH)
+atexit.register(tex_engine.stop)
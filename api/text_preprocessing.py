@@ -0,0 +1,231 @@
+import hashlib
+import os
+import re
+import threading
+
+from instrumentation import log
+from upload_streaming import HashingSpooledFile, SpooledUpload, open_source, source_size
+
+# Si está activo, los PDF y textos se suben como texto compacto y deduplicado
+PREPROCESS_UPLOADS = os.environ.get('PREPROCESS_UPLOADS', 'True') == 'True'
+# Tamaño (en caracteres) de las "páginas" en las que se parten los archivos de texto
+TEXT_PAGE_SIZE = int(os.environ.get('TEXT_PAGE_SIZE', '4000'))
+
+TEXT_EXTENSIONS = {".txt", ".md", ".tex", ".csv"}
+
+_SPACES_RE = re.compile(r"[ \t\f\v ]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def normalize_whitespace(text: str) -> str:
+    """
+    Colapsa espacios, quita espacios al final de cada línea y deja como
+    máximo una línea en blanco seguida.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = [_SPACES_RE.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def iter_pdf_pages(source):
+    """
+    Devuelve el texto del PDF página a página (generador): nunca se tiene
+    el documento entero en memoria. 'source' es una ruta o un SpooledUpload.
+    """
+    from PyPDF2 import PdfReader  # import diferido: sólo hace falta al subir PDFs
+    with open_source(source) as f:
+        reader = PdfReader(f)
+        for page in reader.pages:
+            yield page.extract_text() or ""
+
+
+def iter_text_pages(source, page_size: int = TEXT_PAGE_SIZE):
+    """
+    Lee un archivo de texto por bloques de ~page_size caracteres, cortando en
+    fin de línea.
+    """
+    with open_source(source) as f:
+        buffer = []
+        size = 0
+        for raw_line in f:
+            line = raw_line.decode('utf-8', errors='replace')
+            buffer.append(line)
+            size += len(line)
+            if size >= page_size:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+
+
+def iter_pages(filename: str, source):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".pdf":
+        return iter_pdf_pages(source)
+    if extension in TEXT_EXTENSIONS:
+        return iter_text_pages(source)
+    return None
+
+
+class UploadPreprocessor:
+    """
+    Convierte los archivos subidos en texto compacto antes de enviarlos:
+      - extrae el texto página a página y normaliza espacios,
+      - descarta archivos repetidos (mismo contenido normalizado),
+      - descarta páginas repetidas (cabeceras, portadas, anexos duplicados).
+    Los hashes se recuerdan por sesión (vector_store_id) cuando la subida se
+    confirma (record), de modo que volver a subir una copia del mismo archivo
+    en otro mensaje no cuesta nada, pero reintentar una subida fallida sí se
+    envía. Los formatos que no sabe leer, y los archivos de los que no se
+    extrae texto (p. ej. PDFs escaneados), se envían tal cual.
+    """
+
+    def __init__(self):
+        self._seen = {}  # vector_store_id -> {"files": set, "pages": set}
+        self._lock = threading.Lock()
+
+    def _session_hashes(self, session_id: str) -> dict:
+        with self._lock:
+            return self._seen.setdefault(session_id, {"files": set(), "pages": set()})
+
+    def preprocess(self, session_id: str, files: list) -> tuple:
+        """
+        'files' es una lista de (filename, origen), con origen una ruta o un
+        SpooledUpload. Devuelve (archivos a subir, buffers temporales a
+        liberar después, informe, hashes). El texto extraído se escribe en
+        buffers acotados en memoria, no en disco. 'hashes' ({nombre subido:
+        (hash del archivo, hashes de sus páginas)}) se pasa a record() con los
+        archivos que llegaron a subirse.
+        """
+        seen = self._session_hashes(session_id)
+        to_upload = []
+        temporary = []
+        hashes = {}
+        call_files = set()
+        call_pages = set()
+        names = set()  # nombres con los que se sube cada archivo en esta llamada
+        report = {"bytes_in": 0, "bytes_out": 0, "pages": 0, "duplicate_pages": 0,
+                  "duplicate_files": [], "no_text": [], "passthrough": []}
+
+        for filename, source in files:
+            size = source_size(source)
+            report["bytes_in"] += size
+            pages = iter_pages(filename, source)
+            if pages is None:
+                to_upload.append((_unique_name(filename, names), source))
+                report["passthrough"].append(filename)
+                report["bytes_out"] += size
+                continue
+
+            file_digest = hashlib.sha256()
+            new_page_hashes = []
+            text_pages = 0
+            out = HashingSpooledFile()
+            try:
+                for page in pages:
+                    text = normalize_whitespace(page)
+                    if not text:
+                        continue
+                    text_pages += 1
+                    encoded = text.encode('utf-8')
+                    file_digest.update(encoded)
+                    page_hash = hashlib.sha256(encoded).hexdigest()
+                    with self._lock:
+                        duplicated = page_hash in seen["pages"]
+                    if duplicated or page_hash in call_pages or page_hash in new_page_hashes:
+                        report["duplicate_pages"] += 1
+                        continue
+                    new_page_hashes.append(page_hash)
+                    out.write(encoded)
+                    out.write(b"\n\n")
+            except Exception as e:
+                out.close()
+                log("preprocess.extract_error", filename=filename, error=str(e))
+                to_upload.append((_unique_name(filename, names), source))
+                report["passthrough"].append(filename)
+                report["bytes_out"] += size
+                continue
+            report["pages"] += text_pages
+
+            if text_pages == 0:
+                # Sin texto extraíble (escaneado, sólo imágenes): se envía el original
+                out.close()
+                to_upload.append((_unique_name(filename, names), source))
+                report["no_text"].append(filename)
+                report["bytes_out"] += size
+                log("preprocess.no_text", filename=filename)
+                continue
+
+            file_hash = file_digest.hexdigest()
+            with self._lock:
+                duplicated_file = file_hash in seen["files"]
+            out_size = out.size
+            if duplicated_file or file_hash in call_files or out_size == 0:
+                out.close()
+                report["duplicate_files"].append(filename)
+                log("preprocess.duplicate_file", filename=filename)
+                continue
+            call_files.add(file_hash)
+            call_pages.update(new_page_hashes)
+
+            # 'informe.pdf' -> 'informe.pdf.txt': no choca con 'informe.docx' ni con un 'informe.txt'
+            text_filename = filename if os.path.splitext(filename)[1].lower() == ".txt" else f"{filename}.txt"
+            text_filename = _unique_name(text_filename, names)
+            text_upload = SpooledUpload(text_filename, out)
+            temporary.append(text_upload)
+            to_upload.append((text_filename, text_upload))
+            hashes[text_filename] = (file_hash, new_page_hashes)
+            report["bytes_out"] += out_size
+            log("preprocess.reduced", filename=filename, bytes_in=size, bytes_out=out_size)
+
+        return to_upload, temporary, report, hashes
+
+    def record(self, session_id: str, hashes: dict, uploaded: set):
+        """
+        Recuerda como vistos los archivos de 'hashes' que se subieron bien
+        ('uploaded': nombres subidos). Los que fallaron se pueden reintentar.
+        """
+        with self._lock:
+            seen = self._seen.setdefault(session_id, {"files": set(), "pages": set()})
+            for filename, (file_hash, page_hashes) in hashes.items():
+                if filename in uploaded:
+                    seen["files"].add(file_hash)
+                    seen["pages"].update(page_hashes)
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._seen.pop(session_id, None)
+
+
+def _unique_name(filename: str, names: set) -> str:
+    """
+    'filename', o 'nombre (2).ext', 'nombre (3).ext'... si ya se usó en 'names'
+    (lo añade a 'names').
+    """
+    stem, ext = os.path.splitext(filename)
+    unique = filename
+    counter = 1
+    while unique in names:
+        counter += 1
+        unique = f"{stem} ({counter}){ext}"
+    names.add(unique)
+    return unique
+
+
+def remove_temporary_files(temporary: list):
+    """
+    Libera los buffers del preprocesado (y borra las rutas, si las hay).
+    """
+    for item in temporary:
+        if isinstance(item, SpooledUpload):
+            item.close()
+            continue
+        try:
+            os.remove(item)
+        except FileNotFoundError:
+            pass
+
+
+# Preprocesador compartido por el proceso
+upload_preprocessor = UploadPreprocessor()
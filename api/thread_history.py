@@ -0,0 +1,113 @@
+import collections
+import hashlib
+import os
+import threading
+
+from openai_client import OPENAI_BASE_URL, openai_factory
+
+# Historiales de thread que se mantienen en memoria (LRU)
+HISTORY_CACHE_SIZE = int(os.environ.get('HISTORY_CACHE_SIZE', '512'))
+HISTORY_PAGE_SIZE = 100
+
+
+class HistoryFetchError(Exception):
+    def __init__(self, status_code: int, details: str):
+        super().__init__(f"OpenAI returned {status_code}")
+        self.status_code = status_code
+        self.details = details
+
+
+class _History:
+    def __init__(self):
+        self.messages = []   # mensajes terminados, del más antiguo al más reciente
+        self.tail = []       # mensajes aún en curso: se vuelven a pedir cada vez
+        self.etag = None
+        self.lock = threading.Lock()
+
+
+class ThreadHistoryCache:
+    """
+    Historial de mensajes por thread que sólo pide a OpenAI los mensajes
+    posteriores al último ya visto (cursor 'after'), paginando si hace falta.
+    Cada versión del historial tiene un ETag, para que el frontend reciba un
+    304 cuando no hay nada nuevo. 'session' es la RestSession de openai_client.
+    """
+
+    def __init__(self, session, max_threads: int):
+        self.session = session
+        self.max_threads = max_threads
+        self._histories = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, thread_id: str) -> _History:
+        with self._lock:
+            entry = self._histories.get(thread_id)
+            if entry is None:
+                entry = self._histories[thread_id] = _History()
+            self._histories.move_to_end(thread_id)
+            while len(self._histories) > self.max_threads:
+                self._histories.popitem(last=False)
+            return entry
+
+    def _fetch_after(self, thread_id: str, after: str) -> list:
+        url = f"{OPENAI_BASE_URL}/threads/{thread_id}/messages"
+        params = {"order": "asc", "limit": HISTORY_PAGE_SIZE}
+        messages = []
+        while True:
+            if after:
+                params["after"] = after
+            response = self.session.get(url, params=params)
+            if response.status_code != 200:
+                raise HistoryFetchError(response.status_code, response.text)
+            page = response.json()
+            messages.extend(page.get("data", []))
+            if not page.get("has_more") or not page.get("data"):
+                return messages
+            after = page["data"][-1]["id"]
+
+    def get(self, thread_id: str) -> tuple:
+        """
+        Actualiza el historial con los mensajes nuevos y devuelve
+        (respuesta en el mismo formato que la API, etag).
+        """
+        entry = self._entry(thread_id)
+        with entry.lock:
+            after = entry.messages[-1]["id"] if entry.messages else None
+            fresh = self._fetch_after(thread_id, after)
+
+            # Los mensajes en curso (el assistant aún escribe) no avanzan el cursor
+            for index, message in enumerate(fresh):
+                if message.get("status") == "in_progress":
+                    entry.messages.extend(fresh[:index])
+                    entry.tail = fresh[index:]
+                    break
+            else:
+                entry.messages.extend(fresh)
+                entry.tail = []
+
+            data = entry.messages + entry.tail
+            last_id = entry.messages[-1]["id"] if entry.messages else ""
+            digest = hashlib.sha256(f"{thread_id}:{len(entry.messages)}:{last_id}".encode('utf-8'))
+            for message in entry.tail:
+                digest.update(repr(message).encode('utf-8'))
+            entry.etag = digest.hexdigest()[:32]
+
+            return {
+                "object": "list",
+                "data": data,
+                "first_id": data[0]["id"] if data else None,
+                "last_id": data[-1]["id"] if data else None,
+                "has_more": False,
+            }, entry.etag
+
+    def forget(self, thread_id: str):
+        """
+        Suelta el historial de un thread que ya no existe (fin de la sesión).
+        """
+        with self._lock:
+            self._histories.pop(thread_id, None)
+
+
+# Historial de /threadHistory con llamadas REST sobre el pool compartido de
+# openai_client, compartido por el proceso
+thread_history = ThreadHistoryCache(openai_factory.rest(), HISTORY_CACHE_SIZE)
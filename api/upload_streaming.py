@@ -0,0 +1,156 @@
+import contextlib
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+
+# Bytes de cada archivo subido que se guardan en memoria; por encima pasa a un temporal
+UPLOAD_SPOOL_MAX_BYTES = int(os.environ.get('UPLOAD_SPOOL_MAX_BYTES', str(4 * 1024 * 1024)))
+# Bytes máximos del cuerpo de una petición con archivos (413 si se supera)
+UPLOAD_MAX_REQUEST_BYTES = int(os.environ.get('UPLOAD_MAX_REQUEST_BYTES', str(64 * 1024 * 1024)))
+
+_COPY_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """
+    Los archivos de la petición superan UPLOAD_MAX_REQUEST_BYTES.
+    """
+
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """
+    Buffer de un archivo subido: en memoria hasta UPLOAD_SPOOL_MAX_BYTES y en
+    un temporal (que se borra al cerrarlo) a partir de ahí. Calcula el sha256
+    y el tamaño a medida que se escribe, sin volver a leer el contenido.
+    """
+
+    def __init__(self, max_size: int = None):
+        super().__init__(max_size=max_size or UPLOAD_SPOOL_MAX_BYTES, mode="w+b", prefix="upload-")
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return super().write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def spilled(self) -> bool:
+        return self._rolled
+
+
+class SpooledUpload:
+    """
+    Archivo subido listo para preprocesar, indexar o enviar a OpenAI. Se usa
+    en lugar de una ruta en las listas (filename, origen) de la ingesta.
+    """
+
+    def __init__(self, filename: str, buffer: HashingSpooledFile):
+        self.filename = filename
+        self.buffer = buffer
+
+    @property
+    def size(self) -> int:
+        return self.buffer.size
+
+    @property
+    def sha256(self) -> str:
+        return self.buffer.sha256
+
+    def close(self):
+        self.buffer.close()
+
+
+class UploadRequest(Request):
+    """
+    Request de Flask que escribe cada archivo del multipart directamente en
+    un HashingSpooledFile mientras se parsea el cuerpo.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpooledFile()
+
+
+def spool_uploads(uploaded_files, max_request_bytes: int = None) -> list:
+    """
+    Convierte los archivos de la petición (FileStorage de Flask o UploadFile
+    de Starlette) en [(filename, SpooledUpload)]. Si el archivo ya llegó en un
+    HashingSpooledFile se usa tal cual; si no, se copia por bloques.
+    Lanza UploadTooLarge si el total supera el límite por petición.
+    """
+    max_request_bytes = max_request_bytes or UPLOAD_MAX_REQUEST_BYTES
+    spooled = []
+    total = 0
+    try:
+        for file in uploaded_files:
+            stream = getattr(file, "stream", None) or file.file
+            if isinstance(stream, HashingSpooledFile):
+                buffer = stream
+            else:
+                buffer = HashingSpooledFile()
+                try:
+                    _copy_limited(stream, buffer, max_request_bytes - total)
+                except Exception:
+                    buffer.close()
+                    raise
+            spooled.append((file.filename, SpooledUpload(file.filename, buffer)))
+            total += buffer.size
+            if total > max_request_bytes:
+                raise UploadTooLarge("Uploads exceed the per-request size limit")
+    except Exception:
+        close_uploads(spooled)
+        raise
+    return spooled
+
+
+def _copy_limited(stream, buffer: HashingSpooledFile, limit: int):
+    for chunk in iter(lambda: stream.read(_COPY_CHUNK_SIZE), b""):
+        if buffer.size + len(chunk) > limit:
+            raise UploadTooLarge("Uploads exceed the per-request size limit")
+        buffer.write(chunk)
+
+
+def close_uploads(files: list):
+    """
+    Libera los buffers de [(filename, origen)]; las rutas no se tocan.
+    """
+    for _, source in files:
+        if isinstance(source, SpooledUpload):
+            source.close()
+
+
+@contextlib.contextmanager
+def open_source(source):
+    """
+    Abre en binario, desde el principio, una ruta o un SpooledUpload.
+    El buffer de un SpooledUpload no se cierra al salir.
+    """
+    if isinstance(source, SpooledUpload):
+        source.buffer.seek(0)
+        yield source.buffer
+        return
+    with open(source, "rb") as f:
+        yield f
+
+
+def source_size(source) -> int:
+    if isinstance(source, SpooledUpload):
+        return source.size
+    return os.path.getsize(source)
+
+
+def source_sha256(source) -> str:
+    if isinstance(source, SpooledUpload):
+        return source.sha256
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(_COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
@@ -51,6 +51,8 @@ export default function Home() {
 
   // Estado para verificar si el PDF existe
   const [pdfExists, setPdfExists] = useState(false);
+  // Hash del build publicado (ETag de /pdf): la vista previa sólo se recarga cuando cambia
+  const [pdfVersion, setPdfVersion] = useState<string>("");
 
 
   const messagesRef = useRef<HTMLDivElement>(null);
@@ -105,9 +107,10 @@ export default function Home() {
   // Verificar si el PDF existe en el backend
   const checkPdfExistence = async (threadId: string) => {
     try {
-      const response = await fetch(`/pdf/${threadId}/${threadId}.pdf`, { method: "HEAD" });
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/pdf/${threadId}`, { method: "HEAD" });
       if (response.ok) {
         setPdfExists(true); // El archivo PDF existe
+        setPdfVersion((response.headers.get("ETag") ?? "").replace(/"/g, ""));
       } else {
         setPdfExists(false); // El archivo PDF no existe
       }
@@ -609,7 +612,7 @@ export default function Home() {
           <div className="w-2/5 px-2 h-full overflow-auto">
             <h2 className="text-lg font-bold mb-4">Vista Previa PDF</h2>
             <iframe
-              src={`/pdf/${Cookies.get("thread_id")}/${Cookies.get("thread_id")}.pdf?refresh=${new Date().getTime()}`}
+              src={`${process.env.NEXT_PUBLIC_API_URL}/pdf/${Cookies.get("thread_id")}?v=${pdfVersion}`}
               className="w-full h-[90vh] border"
               title="PDF Preview"
             />